@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+'''
+Instantiates a form with many fields. Fields are copied for each form
+instance, and the copying is compared for `field(parent=form)` calls
+(as before bindable constructors were introduced) and `field._bind(form)`::
+
+    python benchmarks/forms_init.py [forms]
+'''
+
+import sys
+import timeit
+from iktomi.utils.storage import VersionedStorage
+from iktomi.forms import Form, Field, FieldSet, FieldList, convs, widgets
+
+
+def make_fields(count):
+    fields = []
+    for i in range(count):
+        widget = [widgets.TextInput, widgets.Textarea,
+                  widgets.CheckBox][i % 3]
+        conv = convs.Bool() if widget is widgets.CheckBox else \
+               convs.Char(convs.length(0, 100), required=True)
+        fields.append(Field('field{}'.format(i), conv, widget=widget(),
+                            label=u'Field {}'.format(i)))
+    return fields
+
+
+class BenchmarkForm(Form):
+
+    fields = make_fields(120) + [
+        FieldSet('fieldset', fields=make_fields(20)),
+        FieldList('list', field=FieldSet(None, fields=make_fields(10))),
+    ]
+
+
+def main(number):
+    env = VersionedStorage()
+    form = BenchmarkForm(env)
+    for title, func in [
+            ('Form(env)', lambda: BenchmarkForm(env)),
+            ('field(parent=form)',
+             lambda: [field(parent=form) for field in BenchmarkForm.fields]),
+            ('field._bind(form)',
+             lambda: [field._bind(form) for field in BenchmarkForm.fields])]:
+        duration = timeit.timeit(func, number=number)
+        print('{:<20} {:.2f} ms per form'.format(title,
+                                                duration / number * 1000))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
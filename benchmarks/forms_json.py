@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+'''
+Accepts a nested JSON object with `form.accept_json` and with
+`form.accept` of the same data flattened into MultiDict (as JSON APIs had
+to do before `accept_json` was introduced)::
+
+    python benchmarks/forms_json.py [objects]
+'''
+
+import sys
+import timeit
+from webob.multidict import MultiDict
+from iktomi.web.app import AppEnvironment
+from iktomi.forms import Form, Field, FieldSet, FieldList, convs
+
+
+def make_fields(count):
+    return [Field('field{}'.format(i),
+                  convs.Int() if i % 2 else convs.Char(convs.length(0, 100)))
+            for i in range(count)]
+
+
+class BenchmarkForm(Form):
+
+    fields = make_fields(40) + [
+        FieldSet('fieldset', fields=make_fields(10)),
+        FieldList('list', field=FieldSet(None, fields=make_fields(5))),
+    ]
+
+
+def make_object(fields):
+    return dict(('field{}'.format(i), i if i % 2 else u'value {}'.format(i))
+                for i in range(fields))
+
+
+def flatten(value, prefix, data):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            flatten(item, prefix + key + '.', data)
+    elif isinstance(value, list):
+        for index, item in enumerate(value, 1):
+            data.add(prefix[:-1] + '-indices', str(index))
+            flatten(item, '{}{}.'.format(prefix, index), data)
+    else:
+        data.add(prefix[:-1], u'{}'.format(value))
+    return data
+
+
+OBJECT = dict(make_object(40), fieldset=make_object(10),
+              list=[make_object(5) for i in range(20)])
+
+
+def main(number):
+    env = AppEnvironment.create()
+    form = BenchmarkForm(env)
+    assert form.accept_json(OBJECT) and form.python_data['list']
+    json_data = form.python_data
+    assert form.accept(flatten(OBJECT, '', MultiDict()))
+    assert form.python_data == json_data
+    for title, func in [
+            ('accept(flatten(obj))',
+             lambda: form.accept(flatten(OBJECT, '', MultiDict()))),
+            ('accept_json(obj)', lambda: form.accept_json(OBJECT))]:
+        duration = timeit.timeit(func, number=number)
+        print('{:<22} {:.2f} ms per object'.format(title,
+                                                  duration / number * 1000))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+'''
+Renders a form with about 150 fields with `env.template` (each widget
+template is resolved and rendered separately) and with
+`iktomi.templates.jinja2.FormRenderer`::
+
+    python benchmarks/forms_render.py [renders]
+'''
+
+import sys
+import timeit
+from webob.multidict import MultiDict
+from iktomi.templates import Template, BoundTemplate
+from iktomi.templates.jinja2 import TemplateEngine, FormRenderer, \
+                                    TEMPLATE_DIR
+from iktomi.utils.storage import VersionedStorage
+from iktomi.forms import Form, Field, FieldSet, FieldList, convs, widgets
+
+
+def make_fields(count):
+    fields = []
+    for i in range(count):
+        widget = [widgets.TextInput, widgets.Textarea,
+                  widgets.CheckBox][i % 3]
+        conv = convs.Bool() if widget is widgets.CheckBox else \
+               convs.Char(convs.length(0, 100))
+        fields.append(Field('field{}'.format(i), conv, widget=widget(),
+                            label=u'Field {}'.format(i)))
+    return fields
+
+
+class BenchmarkForm(Form):
+
+    fields = make_fields(120) + [
+        FieldSet('fieldset', fields=make_fields(20)),
+        FieldList('list', field=FieldSet(None, fields=make_fields(10))),
+    ]
+
+
+class CompiledForm(BenchmarkForm):
+
+    renderer = FormRenderer()
+
+
+def main(number):
+    env = VersionedStorage()
+    template = Template(TEMPLATE_DIR,
+                        engines={'html': TemplateEngine(TEMPLATE_DIR)})
+    env.template = BoundTemplate(env, template)
+    data = MultiDict([('list-indices', '1'), ('list-indices', '2')])
+    results = []
+    for form_class in [BenchmarkForm, CompiledForm]:
+        form = form_class(env)
+        form.accept(data)
+        results.append(form.render())
+        duration = timeit.timeit(form.render, number=number)
+        print('{:<14} {:.2f} ms per render'.format(
+                    form_class.__name__, duration / number * 1000))
+    assert results[0] == results[1]
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100)
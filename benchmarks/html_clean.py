@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+'''
+Cleans typical article bodies with `convs.Html.clean_value`. Converters are
+copied for each form instance, and the run with a converter copy per body
+(as in a form per request) is compared to the run with a single converter
+and to the cleaning alone with a prebuilt cleaner::
+
+    python benchmarks/html_clean.py [articles]
+'''
+
+import sys
+import timeit
+from lxml import html
+from iktomi.forms import convs
+
+
+PARAGRAPH = (u'<p>Lorem <b>ipsum</b> dolor sit amet, <a href="http://'
+             u'example.com/{0}" onclick="track()">consectetur</a> adipiscing '
+             u'elit.<br>Sed do <i>eiusmod</i> tempor <span style="color: red">'
+             u'incididunt</span> ut labore et dolore magna aliqua.</p>\n')
+
+ARTICLE = (u'Lead text with <em>emphasis</em> and <strong>strong</strong>\n' +
+           u''.join(PARAGRAPH.format(i) for i in range(12)) +
+           u'<ul><li>first</li><li>second <sup>2</sup></li></ul>\n'
+           u'<blockquote class="quote">Quote</blockquote>'
+           u'<script>alert("x")</script><p></p>')
+
+
+def main(number):
+    conv = convs.Html()
+    cleaner = conv.cleaner
+
+    def clean_only():
+        doc = html.fragment_fromstring(ARTICLE, create_parent=True)
+        cleaner(doc)
+        return html.tostring(doc, encoding='utf-8')
+
+    for title, func in [
+            ('conv().clean_value', lambda: conv().clean_value(ARTICLE)),
+            ('conv.clean_value', lambda: conv.clean_value(ARTICLE)),
+            ('cleaner(doc)', clean_only)]:
+        duration = timeit.timeit(func, number=number)
+        print('{:<20} {:.1f} us per article'.format(
+                    title, duration / number * 1000000))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
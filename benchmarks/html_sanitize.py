@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+'''
+Sanitizes a large article (about 200 KB) with `iktomi.utils.html.Cleaner`
+in default and single pass modes::
+
+    python benchmarks/html_sanitize.py [runs]
+'''
+
+import sys
+import timeit
+from lxml import html as lxml_html
+from iktomi.utils.html import Cleaner
+
+
+PARAGRAPH = (u'<p class="text note">Lorem <b>ipsum</b> dolor sit amet, '
+             u'<a href="http://example.com/{0}" onclick="track()">consectetur'
+             u'</a> adipiscing <a>elit</a>.<br>Sed do <i>eiusmod</i> tempor '
+             u'<span style="color: red">incididunt</span> ut labore et '
+             u'<img src="/img/{0}.png" alt="image"> dolore magna aliqua.'
+             u'<br><br></p>\n<p><u> </u></p><blockquote cite="ftp://a/{0}">'
+             u'Quote <sup>{0}</sup></blockquote>\n')
+
+ARTICLE = u'Lead <b>text</b>\n' + u''.join(PARAGRAPH.format(i)
+                                           for i in range(550))
+
+OPTIONS = dict(allow_tags=['a', 'p', 'br', 'li', 'ul', 'ol', 'hr', 'u', 'i',
+                           'b', 'blockquote', 'sub', 'sup', 'img'],
+               safe_attrs=['href', 'src', 'alt', 'title', 'class', 'rel',
+                           'cite'],
+               allow_classes={'p': set(['text'])},
+               drop_empty_tags=['p', 'a', 'u', 'i', 'b', 'sub', 'sup'])
+
+
+def main(number):
+    print('Article size: {} KB'.format(len(ARTICLE) // 1024))
+    for title, cleaner in [
+            ('default', Cleaner(**OPTIONS)),
+            ('single_pass', Cleaner(single_pass=True, **OPTIONS))]:
+        def sanitize():
+            doc = lxml_html.fragment_fromstring(ARTICLE, create_parent=True)
+            cleaner(doc)
+            return lxml_html.tostring(doc, encoding='utf-8')
+        duration = timeit.timeit(sanitize, number=number)
+        print('{:<12} {:.1f} ms per article'.format(
+                    title, duration / number * 1000))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20)
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+'''
+Renders a form with many fields using template resolution by `glob` on
+each call (as before the index was introduced), with the index checked
+against directories modification times (development) and with the frozen
+index (`cache=True`, production)::
+
+    python benchmarks/templates_resolve.py [renders]
+'''
+
+import sys
+import timeit
+from os import path
+from iktomi.utils.storage import VersionedStorage
+from iktomi.templates import Template, BoundTemplate
+from iktomi.templates import jinja2 as jnj
+from iktomi.templates.jinja2 import TemplateEngine
+from iktomi.forms import Form, Field, FieldSet, convs, widgets
+
+TEMPLATES = [path.join(path.dirname(path.abspath(jnj.__file__)), 'templates')]
+
+
+class GlobTemplate(Template):
+
+    resolve = Template._resolve
+
+
+def make_fields(count):
+    fields = []
+    for i in range(count):
+        widget = [widgets.TextInput, widgets.Textarea,
+                  widgets.CheckBox][i % 3]
+        conv = convs.Bool() if widget is widgets.CheckBox else convs.Char()
+        fields.append(Field('field{}'.format(i), conv, widget=widget(),
+                            label=u'Field {}'.format(i)))
+    return fields
+
+
+class BenchmarkForm(Form):
+
+    fields = make_fields(30) + [
+        FieldSet('fieldset', fields=make_fields(10)),
+    ]
+
+
+def render_form(template_class, **kwargs):
+    engine = TemplateEngine(TEMPLATES)
+    template = template_class(engines={'html': engine}, *TEMPLATES,
+                              **kwargs)
+    env = VersionedStorage()
+    env.template = BoundTemplate(env, template)
+    def render():
+        return BenchmarkForm(env).render()
+    return render
+
+
+def main(number):
+    for title, template_class, kwargs in [
+            ('glob', GlobTemplate, {}),
+            ('index, mtime checks', Template, {}),
+            ('index, frozen', Template, {'cache': True})]:
+        render = render_form(template_class, **kwargs)
+        render() # warm up Jinja2 templates cache
+        duration = timeit.timeit(render, number=number)
+        print('{:<20} {:.2f} ms per form'.format(title,
+                                                duration / number * 1000))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
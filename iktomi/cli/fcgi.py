@@ -4,7 +4,11 @@ import os
 import sys
 import time
 import errno
+import fcntl
 import signal
+import json
+import socket
+import struct
 import logging
 logger = logging.getLogger(__name__)
 
@@ -13,13 +17,395 @@ from iktomi.utils.system import safe_makedirs, is_running, terminate, \
                                 doublefork
 
 
-def flup_fastcgi(wsgi_app, bind, cwd=None, pidfile=None, logfile=None,
-                 daemonize=False, umask=None, **params):
-    if params.pop('preforked', False):
-        from flup.server import fcgi_fork as fcgi
+# Environment variables used to pass listening socket to the new master
+# process on graceful restart
+LISTEN_FD_ENV = 'IKTOMI_FCGI_LISTEN_FD'
+PREDECESSOR_ENV = 'IKTOMI_FCGI_PREDECESSOR'
+
+# Key of pseudo-child in `_children` of preforked server, its socket is
+# written to wake up the main loop
+WAKEUP_CHILD = 'wakeup'
+
+
+class GracefulRestartMixin(object):
+    '''
+    Mixin for flup `WSGIServer` classes implementing zero-downtime restart:
+
+        * on `SIGUSR2` the master process executes itself again, the new
+          master inherits the listening socket;
+        * the new master loads an application and sends `SIGQUIT` to the
+          old one;
+        * on `SIGQUIT` the master stops accepting connections and waits
+          for in-flight requests for `drain_timeout` seconds.
+    '''
+
+    #: attributes that can be set through `fastcgi_params`
+    options = ('drain_timeout',)
+
+    drain_timeout = 30
+    _draining = False
+    # command line to execute the new master process with
+    _argv = None
+
+    def _setupSocket(self):
+        fd = os.environ.pop(LISTEN_FD_ENV, None)
+        if fd is None:
+            sock = super(GracefulRestartMixin, self)._setupSocket()
+        else:
+            fd = int(fd)
+            family = socket.AF_INET if isinstance(self._bindAddress, tuple) \
+                     else socket.AF_UNIX
+            sock = socket.fromfd(fd, family, socket.SOCK_STREAM)
+            os.close(fd)
+            predecessor = os.environ.pop(PREDECESSOR_ENV, None)
+            if predecessor is not None:
+                logger.info('Inherited listening socket, stopping old '
+                            'master process %s', predecessor)
+                try:
+                    os.kill(int(predecessor), signal.SIGQUIT)
+                except OSError as exc:
+                    if exc.errno != errno.ESRCH:
+                        raise
+        self._listenSock = sock
+        return sock
+
+    def _installSignalHandlers(self):
+        super(GracefulRestartMixin, self)._installSignalHandlers()
+        for sig, handler in [(signal.SIGUSR2, self._restartHandler),
+                             (signal.SIGQUIT, self._drainHandler)]:
+            self._oldSIGs.append((sig, signal.getsignal(sig)))
+            signal.signal(sig, handler)
+
+    def _restartHandler(self, signum, frame):
+        if self._draining or self._argv is None:
+            return
+        logger.info('Starting new master process')
+        if os.fork():
+            return
+        try:
+            fd = self._listenSock.fileno()
+            flags = fcntl.fcntl(fd, fcntl.F_GETFD)
+            fcntl.fcntl(fd, fcntl.F_SETFD, flags & ~fcntl.FD_CLOEXEC)
+            environ = dict(os.environ)
+            environ[LISTEN_FD_ENV] = str(fd)
+            environ[PREDECESSOR_ENV] = str(os.getppid())
+            os.execve(sys.executable, [sys.executable] + self._argv, environ)
+        finally:
+            os._exit(1)
+
+    def _drainHandler(self, signum, frame):
+        logger.info('Stopping master process after in-flight requests '
+                    'are done')
+        self._draining = True
+        self._keepGoing = False
+
+
+class ThreadedGracefulRestartMixin(GracefulRestartMixin):
+
+    def run(self):
+        result = super(ThreadedGracefulRestartMixin, self).run()
+        if self._draining:
+            pool = self._threadPool
+            deadline = time.time() + self.drain_timeout
+            while pool._idleCount < pool._workerCount and \
+                    time.time() < deadline:
+                time.sleep(0.1)
+        return result
+
+
+class PreforkGracefulRestartMixin(GracefulRestartMixin):
+
+    def _drainHandler(self, signum, frame):
+        GracefulRestartMixin._drainHandler(self, signum, frame)
+        # Main loop is blocked in select() on children sockets, shutting
+        # them down wakes it up. Children notice the shut down socket in
+        # select() between requests only, so requests in progress are done.
+        # A child reports it's busy only after accepting a connection, so
+        # a signal to the child looking idle could interrupt a request.
+        for child in self._children.values():
+            if child['file'] is not None:
+                shutdown_socket(child['file'])
+
+    def _spawnChild(self, sock):
+        if self._draining:
+            return False
+        return super(PreforkGracefulRestartMixin, self)._spawnChild(sock)
+
+    def _cleanupChildren(self):
+        if not self._draining:
+            return super(PreforkGracefulRestartMixin, self)._cleanupChildren()
+        # Closed socket tells the child to exit after current request
+        for child in self._children.values():
+            if child['file'] is not None:
+                child['file'].close()
+                child['file'] = None
+        deadline = time.time() + self.drain_timeout
+        while self._children and time.time() < deadline:
+            self._reapChildren()
+            time.sleep(0.1)
+        for pid in list(self._children):
+            logger.warning('Killing child process %s after drain timeout', pid)
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except OSError as exc:
+                if exc.errno != errno.ESRCH:
+                    raise
+
+
+def shutdown_socket(sock):
+    '''Shuts down the socket to the child process. Unlike closing, this is
+    safe while the main loop is waiting for the socket in select(), and
+    wakes it up. The main loop closes the socket itself.'''
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except socket.error as exc:
+        # already shut down
+        if exc.errno != errno.ENOTCONN:
+            raise
+
+
+def listen_queue_depth(sock):
+    '''Returns a number of connections waiting in the listen queue of TCP
+    socket or `None` if it's unknown (UNIX sockets, non-Linux systems).'''
+    if sock.family != socket.AF_INET or not hasattr(socket, 'TCP_INFO'):
+        return None
+    info = sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_INFO, 104)
+    # tcpi_unacked field holds accept queue length for listening socket
+    return struct.unpack_from('I', info, 24)[0]
+
+
+class StatusMixin(object):
+    '''
+    Mixin for flup `WSGIServer` classes writing server state to
+    `status_file` as JSON on start and on `SIGUSR1`.
+    '''
+
+    status_file = None
+
+    def _installSignalHandlers(self):
+        super(StatusMixin, self)._installSignalHandlers()
+        self._oldSIGs.append((signal.SIGUSR1, signal.getsignal(signal.SIGUSR1)))
+        signal.signal(signal.SIGUSR1, self._statusHandler)
+        # Written on start too, so `Flup.command_restart` and
+        # `Flup.command_status` know signals are handled by the running
+        # server
+        self._statusHandler(signal.SIGUSR1, None)
+
+    def _statusHandler(self, signum, frame):
+        if self.status_file is None:
+            return
+        status = dict(pid=os.getpid(), autoscale=None,
+                      graceful_restart=isinstance(self, GracefulRestartMixin))
+        status.update(self._status())
+        tmp_file = self.status_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(status, f)
+        os.rename(tmp_file, self.status_file)
+
+    def _status(self):
+        return {}
+
+
+class ThreadedStatusMixin(StatusMixin):
+
+    def _status(self):
+        pool = self._threadPool
+        return dict(workers=pool._workerCount,
+                    busy=pool._workerCount - pool._idleCount,
+                    queue=listen_queue_depth(self._listenSock))
+
+
+class AutoscaleMixin(StatusMixin):
+    '''
+    Mixin for preforked flup `WSGIServer` class scaling a number of workers
+    between `min_workers` and `max_workers`.
+
+    The number of workers is checked each time a worker changes its state
+    and every `check_interval` seconds. It is increased as soon as
+    `scale_up_ratio` of workers are busy or there are connections waiting
+    in the listen queue, and decreased by one when no more than
+    `scale_down_ratio` of workers are busy during `scale_down_delay`
+    seconds. Autoscaling is disabled unless `max_workers` is set.
+    '''
+
+    options = GracefulRestartMixin.options + (
+        'min_workers', 'max_workers', 'scale_up_ratio', 'scale_down_ratio',
+        'scale_down_delay', 'check_interval')
+
+    min_workers = 1
+    max_workers = None
+    scale_up_ratio = 0.75
+    scale_down_ratio = 0.25
+    scale_down_delay = 30
+    #: Main loop waits for children without timeout, so without traffic
+    #: the load is checked by timer (`SIGALRM`)
+    check_interval = 5
+    _lowLoadSince = None
+    _autoscaling = False
+    # socket to write to wake up the main loop
+    _wakeup = None
+
+    def run(self):
+        if self.max_workers:
+            assert 0 < self.min_workers <= self.max_workers
+            # flup's main loop waits in select() for children sockets only,
+            # so the timer wakes it up through a pseudo-child
+            self._wakeup, wakeup_end = socket.socketpair()
+            self._wakeup.setblocking(0)
+            wakeup_end.setblocking(0)
+            self._children[WAKEUP_CHILD] = {'file': wakeup_end,
+                                            'avail': False}
+            self._minSpare = 0
+            self._maxChildren = self.max_workers + 1
+            self._setWorkers(self.min_workers)
+        return super(AutoscaleMixin, self).run()
+
+    def _setWorkers(self, workers):
+        self._workers = workers
+        # flup counts the pseudo-child too
+        self._maxSpare = workers + (WAKEUP_CHILD in self._children)
+
+    def _wakeUp(self):
+        if self._wakeup is None:
+            return
+        # Zero byte marks the pseudo-child busy, so flup doesn't stop it
+        try:
+            self._wakeup.send(b'\x00')
+        except socket.error as exc:
+            # the main loop has not read previous ones yet
+            if exc.errno != errno.EAGAIN:
+                raise
+
+    def _child(self, sock, parent):
+        # Copies of children sockets are closed by flup
+        if self._wakeup is not None:
+            self._wakeup.close()
+        return super(AutoscaleMixin, self)._child(sock, parent)
+
+    def _cleanupChildren(self):
+        wakeup = self._children.pop(WAKEUP_CHILD, None)
+        if wakeup is not None:
+            if wakeup['file'] is not None:
+                wakeup['file'].close()
+            self._wakeup.close()
+            self._wakeup = None
+        return super(AutoscaleMixin, self)._cleanupChildren()
+
+    def _installSignalHandlers(self):
+        super(AutoscaleMixin, self)._installSignalHandlers()
+        if self.max_workers:
+            self._oldSIGs.append((signal.SIGALRM,
+                                  signal.getsignal(signal.SIGALRM)))
+            signal.signal(signal.SIGALRM, self._alarmHandler)
+            signal.setitimer(signal.ITIMER_REAL, self.check_interval,
+                             self.check_interval)
+
+    def _restoreSignalHandlers(self):
+        # Is called in children too, timers are not inherited by them
+        if self.max_workers:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+        super(AutoscaleMixin, self)._restoreSignalHandlers()
+
+    def _alarmHandler(self, signum, frame):
+        if self._draining or self._autoscaling:
+            return
+        workers = self._workers
+        self._autoscale(in_handler=True)
+        if self._workers > workers:
+            # Main loop is blocked in select() until a child changes its
+            # state, since Python 3.5 select() is restarted after signal
+            # handlers (PEP 475). Woken up, it spawns new workers.
+            self._wakeUp()
+
+    def _running(self):
+        # Children closed by `_stopIdleChildren` are not reaped yet
+        return [x for pid, x in self._children.items()
+                if pid != WAKEUP_CHILD and x['file'] is not None]
+
+    def _status(self):
+        running = self._running()
+        status = dict(workers=len(running),
+                      busy=len([x for x in running if not x['avail']]),
+                      queue=listen_queue_depth(self._listenSock))
+        if self.max_workers:
+            status['autoscale'] = dict(workers=self._workers,
+                                       min_workers=self.min_workers,
+                                       max_workers=self.max_workers)
+        return status
+
+    def _reapChildren(self):
+        super(AutoscaleMixin, self)._reapChildren()
+        if self.max_workers and not self._draining:
+            self._autoscaling = True
+            try:
+                self._autoscale()
+            finally:
+                self._autoscaling = False
+
+    def _autoscale(self, in_handler=False):
+        running = self._running()
+        total = len(running)
+        busy = len([x for x in running if not x['avail']])
+        queue = listen_queue_depth(self._listenSock)
+        ratio = float(busy) / total if total else 1
+        workers = self._workers
+        if ratio >= self.scale_up_ratio or queue:
+            self._lowLoadSince = None
+            workers = min(self.max_workers, workers + max(1, queue or 0))
+        elif ratio <= self.scale_down_ratio and workers > self.min_workers:
+            now = time.time()
+            if self._lowLoadSince is None:
+                self._lowLoadSince = now
+            elif now - self._lowLoadSince >= self.scale_down_delay:
+                self._lowLoadSince = now
+                workers -= 1
+        else:
+            self._lowLoadSince = None
+        if workers != self._workers:
+            logger.info('Scaling workers from %d to %d (%d busy)',
+                        self._workers, workers, busy)
+            self._setWorkers(workers)
+            self._stopIdleChildren(total - workers, in_handler)
+
+    def _stopIdleChildren(self, count, in_handler=False):
+        idle = sorted(pid for pid, x in self._children.items()
+                      if x['avail'] and x['file'] is not None)
+        for pid in idle[:max(count, 0)]:
+            child = self._children[pid]
+            if in_handler:
+                # The main loop may be blocked in select() on the socket
+                shutdown_socket(child['file'])
+                continue
+            # closed socket tells the child to exit (as flup does)
+            child['file'].close()
+            child['file'] = None
+            child['avail'] = False
+
+
+def server_class(preforked=False):
+    '''Returns flup `WSGIServer` class with graceful restart support'''
+    if preforked:
+        from flup.server.fcgi_fork import WSGIServer
+        mixins = (AutoscaleMixin, PreforkGracefulRestartMixin)
     else:
-        from flup.server import fcgi
+        from flup.server.fcgi import WSGIServer
+        mixins = (ThreadedStatusMixin, ThreadedGracefulRestartMixin)
+    return type('WSGIServer', mixins + (WSGIServer,), {})
+
+
+def flup_fastcgi(wsgi_app, bind, cwd=None, pidfile=None, logfile=None,
+                 daemonize=False, umask=None, warmup=None, statusfile=None,
+                 **params):
+    server_cls = server_class(params.pop('preforked', False))
+    options = dict((name, params.pop(name)) for name in server_cls.options
+                   if name in params)
+    # The new master is started by start command with the same options,
+    # whatever command has started this one (e.g. `flup:restart --hard`)
+    digest_name = sys.argv[1].split(':', 1)[0] if len(sys.argv) > 1 \
+                  else 'flup'
+    argv = [os.path.abspath(sys.argv[0]), digest_name + ':start']
     if daemonize:
+        argv.append('--daemonize')
         if os.path.isfile(pidfile):
             with open(pidfile, 'r') as f:
                 try:
@@ -27,7 +413,12 @@ def flup_fastcgi(wsgi_app, bind, cwd=None, pidfile=None, logfile=None,
                 except ValueError:
                     pid = None
 
-            if pid is not None and  is_running(pid):
+            if pid is not None and \
+                    os.environ.get(PREDECESSOR_ENV) == str(pid):
+                # graceful restart, old master will be stopped when
+                # the listening socket is taken over
+                pass
+            elif pid is not None and  is_running(pid):
                 sys.exit('Already running (PID: {})'.format(pid))
             elif pid is not None:
                 logger.info('PID file was pointing to nonexistent process %r',
@@ -35,9 +426,16 @@ def flup_fastcgi(wsgi_app, bind, cwd=None, pidfile=None, logfile=None,
             else:
                 logger.info('PID file should contain a number')
         doublefork(pidfile, logfile, cwd, umask)
+    if warmup is not None:
+        logger.info('Warming up the application')
+        warmup()
     logger.info('Starting FastCGI server (flup), current working dir %r', cwd)
-    fcgi.WSGIServer(wsgi_app, bindAddress=bind, umask=umask,
-                    debug=False, **params).run()
+    server = server_cls(wsgi_app, bindAddress=bind, umask=umask,
+                        debug=False, **params)
+    server.__dict__.update(options)
+    server.status_file = statusfile
+    server._argv = argv
+    server.run()
 
 
 class Flup(Cli):
@@ -48,15 +446,26 @@ class Flup(Cli):
     :param bind: socket file
     :param logfile: log file
     :param pidfile: PID file
+    :param statusfile: file the server writes its state to
     :param cwd: current working directory
     :param umask:
     :param dict fastcgi_params: arguments accepted by flup `WSGIServer`,
-        plus `preforked`
+        plus `preforked`, `drain_timeout` (seconds to wait for in-flight
+        requests on graceful restart) and autoscaling options for preforked
+        server: `min_workers`, `max_workers`, `scale_up_ratio`,
+        `scale_down_ratio`, `scale_down_delay`, `check_interval` (see
+        :class:`AutoscaleMixin`)
+    :param warmup: callable called before server starts accepting requests
     '''
 
+    #: seconds to wait for the server on graceful restart and status request
+    restart_timeout = 10
+
     def __init__(self, app, bind='', logfile=None, pidfile=None,
-                 cwd='.', umask=2, fastcgi_params=None):
+                 cwd='.', umask=2, fastcgi_params=None, warmup=None,
+                 statusfile=None):
         self.app = app
+        self.warmup = warmup
         self.cwd = os.path.abspath(cwd)
         if ':' in bind:
             host, port = bind.split(':')
@@ -69,6 +478,7 @@ class Flup(Cli):
         self.umask = umask
         self.logfile = logfile or os.path.join(self.cwd, 'fcgi.log')
         self.pidfile = pidfile or os.path.join(self.cwd, 'fcgi.pid')
+        self.statusfile = statusfile or os.path.join(self.cwd, 'fcgi.status')
         self.fastcgi_params = fastcgi_params or {}
 
     def command_start(self, daemonize=False):
@@ -79,9 +489,12 @@ class Flup(Cli):
         '''
         if daemonize:
             safe_makedirs(self.logfile, self.pidfile)
+        safe_makedirs(self.statusfile)
         flup_fastcgi(self.app, bind=self.bind, pidfile=self.pidfile,
+                     statusfile=self.statusfile,
                      logfile=self.logfile, daemonize=daemonize,
-                     cwd=self.cwd, umask=self.umask, **self.fastcgi_params)
+                     cwd=self.cwd, umask=self.umask, warmup=self.warmup,
+                     **self.fastcgi_params)
 
     def command_stop(self):
         '''
@@ -108,7 +521,106 @@ class Flup(Cli):
                         sys.exit('Not running')
         sys.exit('No pidfile provided')
 
-    def command_restart(self):
-        self.command_stop()
-        # restart is useless for non-daemon programs
-        self.command_start(daemonize=True)
+    def command_restart(self, hard=False):
+        '''
+        Restart a server::
+
+            ./manage.py flup:restart [--hard]
+
+        By default new master process takes over the listening socket and
+        the old one exits after in-flight requests are done. Pass `--hard`
+        to stop the server and start it again. Servers not supporting
+        graceful restart (started by older iktomi) are restarted this way
+        too.
+        '''
+        if not hard:
+            if not os.path.exists(self.pidfile):
+                sys.exit("Pidfile {!r} doesn't exist".format(self.pidfile))
+            with open(self.pidfile) as pidfile:
+                pid = int(pidfile.read())
+            if is_running(pid) and not self._graceful_restart_supported(pid):
+                # SIGUSR2 would just kill it
+                sys.stdout.write('Server does not support graceful restart, '
+                                 'restarting it with --hard\n')
+                hard = True
+        if hard:
+            self.command_stop()
+            # restart is useless for non-daemon programs
+            self.command_start(daemonize=True)
+            return
+        try:
+            os.kill(pid, signal.SIGUSR2)
+        except OSError as exc:
+            if exc.errno != errno.ESRCH:
+                raise
+            sys.exit('Not running')
+        start = time.time()
+        while time.time()-start < self.restart_timeout:
+            time.sleep(0.1)
+            with open(self.pidfile) as pidfile:
+                try:
+                    new_pid = int(pidfile.read())
+                except ValueError:
+                    # PID file is being written
+                    continue
+            if new_pid != pid and is_running(new_pid):
+                return
+        sys.exit('New master process is not started in {} seconds'\
+                    .format(self.restart_timeout))
+
+    def _server_status(self, pid):
+        # Status file is written by servers handling SIGUSR1 on start, older
+        # ones are killed by the signal
+        try:
+            with open(self.statusfile) as f:
+                status = json.load(f)
+        except (IOError, ValueError):
+            return None
+        if not isinstance(status, dict) or status.get('pid') != pid or \
+                'graceful_restart' not in status:
+            return None
+        return status
+
+    def _graceful_restart_supported(self, pid):
+        status = self._server_status(pid)
+        return status is not None and bool(status['graceful_restart'])
+
+    def command_status(self):
+        '''
+        Show state of the server::
+
+            ./manage.py flup:status
+        '''
+        if not os.path.exists(self.pidfile):
+            sys.exit('Not running')
+        with open(self.pidfile) as pidfile:
+            pid = int(pidfile.read())
+        if not is_running(pid):
+            sys.exit('Not running')
+        if self._server_status(pid) is None:
+            # SIGUSR1 would just kill it
+            sys.exit('Running (PID: {}), but the server does not report '
+                     'its state'.format(pid))
+        os.remove(self.statusfile)
+        try:
+            os.kill(pid, signal.SIGUSR1)
+        except OSError as exc:
+            if exc.errno != errno.ESRCH:
+                raise
+            sys.exit('Not running')
+        sys.stdout.write('Running (PID: {})\n'.format(pid))
+        start = time.time()
+        while not os.path.exists(self.statusfile):
+            if time.time()-start >= self.restart_timeout:
+                sys.exit('Server has not reported its state')
+            time.sleep(0.1)
+        with open(self.statusfile) as f:
+            status = json.load(f)
+        if status['queue'] is None:
+            status['queue'] = 'unknown'
+        sys.stdout.write('Workers: {workers} ({busy} busy)\n'
+                         'Queued connections: {queue}\n'.format(**status))
+        if status['autoscale']:
+            sys.stdout.write('Autoscaling: {workers} workers '
+                             '(min {min_workers}, max {max_workers})\n'\
+                                .format(**status['autoscale']))
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+import sys
+from .base import Cli
+
+__all__ = ['Templates']
+
+
+class Templates(Cli):
+    '''
+    Templates management
+
+    :param template: :class:`Template<iktomi.templates.Template>` instance
+    '''
+
+    def __init__(self, template):
+        self.template = template
+
+    def command_compile(self, verbose=False):
+        '''
+        Compiles all templates in template directories to fill engines'
+        bytecode caches (to be called at build or deploy time)::
+
+            ./manage.py templates:compile [--verbose]
+
+        Exits with non-zero status if any template fails to compile.
+        '''
+        compiled = failed = 0
+        for name, engine in self.template.list_templates():
+            if not hasattr(engine, 'compile'):
+                continue
+            try:
+                engine.compile(name)
+            except Exception as exc:
+                failed += 1
+                print('{}: {}'.format(name, exc), file=sys.stderr)
+            else:
+                compiled += 1
+                if verbose:
+                    print(name)
+        print('Compiled {} templates, {} failed'.format(compiled, failed))
+        if failed:
+            sys.exit(1)
+
+    #: Columns of `templates:profile` report: stat key, title and format
+    profile_columns = [('calls', 'calls', '{:d}'),
+                       ('time', 'total ms', '{:.1f}'),
+                       ('avg_time', 'avg ms', '{:.2f}'),
+                       ('self_time', 'self ms', '{:.1f}'),
+                       ('avg_size', 'avg size', '{:.0f}')]
+
+    def command_profile(self, sort='self_time', limit=20):
+        '''
+        Prints templates with the largest render time collected by
+        :class:`TemplateProfile<iktomi.templates.profile.TemplateProfile>`
+        of the template::
+
+            ./manage.py templates:profile [--sort=self_time] [--limit=20]
+
+        Sort keys are `self_time` (excluding nested templates), `time`,
+        `avg_time`, `calls` and `avg_size`.
+        '''
+        profile = self.template.profile
+        if profile is None:
+            sys.exit('Template profiling is not enabled')
+        keys = [key for key, title, format in self.profile_columns]
+        if sort not in keys:
+            sys.exit('Unknown sort key "{}", use one of: {}'.format(
+                        sort, ', '.join(keys)))
+        stats = profile.stats()
+        for stat in stats:
+            stat['time'] *= 1000
+            stat['self_time'] *= 1000
+            stat['avg_time'] = stat['time'] / stat['calls']
+            stat['avg_size'] = float(stat['size']) / stat['calls']
+        stats.sort(key=lambda stat: stat[sort], reverse=True)
+        rows = [[title for key, title, format in self.profile_columns] +
+                ['template']]
+        for stat in stats[:int(limit)]:
+            rows.append([format.format(stat[key])
+                         for key, title, format in self.profile_columns] +
+                        [stat['template']])
+        widths = [max(len(row[i]) for row in rows)
+                  for i in range(len(self.profile_columns))]
+        for row in rows:
+            print('  '.join([value.rjust(width)
+                             for value, width in zip(row, widths)] +
+                            [row[-1]]))
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+'''
+Functions computing HTTP validators of model objects for
+:class:`web.conditional<iktomi.web.conditional>` filter. They select
+a single column instead of loading the object::
+
+    web.match('/<int:id>', 'item') | web.conditional(
+        etag_func=version_etag(News.version),
+        last_modified_func=last_modified(News.updated_at)) | item
+'''
+
+__all__ = ['last_modified', 'version_etag']
+
+
+def _select_column(column, key, data_attr):
+    model = column.class_
+    key_column = getattr(model, key)
+    data_attr = key if data_attr is None else data_attr
+
+    def select(env, data):
+        value = getattr(data, data_attr, None)
+        if value is None:
+            return None
+        return env.db.query(column).filter(key_column == value).scalar()
+    return select
+
+
+def last_modified(column, key='id', data_attr=None):
+    '''
+    Returns `last_modified_func` selecting `column` value (`datetime`,
+    e.g. `updated_at` column) of the object which `key` column is equal to
+    `data` attribute named `data_attr` (equal to `key` by default).
+    '''
+    return _select_column(column, key, data_attr)
+
+
+def version_etag(column, key='id', data_attr=None):
+    '''
+    Returns `etag_func` building ETag from model name, `key` value and
+    `column` value, which should be changed on each update (e.g. version
+    counter used as `version_id_col`).
+    '''
+    select = _select_column(column, key, data_attr)
+    data_attr = key if data_attr is None else data_attr
+    name = column.class_.__name__
+
+    def etag(env, data):
+        version = select(env, data)
+        if version is None:
+            return None
+        return u'{}-{}-{}'.format(name, getattr(data, data_attr), version)
+    return etag
@@ -6,14 +6,17 @@ convert and validate form field's data.
 
 import six
 import re
+import os
+import hashlib
+import binascii
+import threading
 from ..utils import weakproxy, replace_nontext
 from datetime import datetime
 from collections import OrderedDict
 from ..utils.dt import strftime
 from ..utils.deprecation import deprecated
 try:
-    from ..utils.html import Cleaner
-    from lxml import html
+    from ..utils.html import Cleaner, clean_html
     from lxml.etree import XMLSyntaxError
 except ImportError: # pragma: no cover
     # lxml is required for Html conv, therefore you can use forms without this
@@ -22,6 +25,9 @@ except ImportError: # pragma: no cover
 
 from iktomi.utils import cached_property
 from iktomi.utils.i18n import N_, M_
+from sqlalchemy import event, func
+from sqlalchemy.exc import CompileError
+from sqlalchemy.orm import class_mapper, object_mapper
 from sqlalchemy.ext.associationproxy import _AssociationCollection
 
 
@@ -124,6 +130,10 @@ class Converter(object):
         self.__dict__.update(kwargs)
         self.validators = tuple(self.validators) + args
 
+    #: Marks `__init__` which result depends on its arguments only (see
+    #: `BaseField._bindable_init` in :mod:`iktomi.forms.fields`)
+    _bindable_init = __init__
+
     @property
     def env(self):
         '''A shortcut for `form.env`'''
@@ -175,6 +185,15 @@ class Converter(object):
             value = ''
         return value
 
+    def prefetch(self, values):
+        """
+        Is called with raw values of several fields using copies of this
+        converter (items of `FieldList` or values of `ListOf`) before they
+        are accepted, so data needed to convert them can be loaded at once.
+        Does nothing by default.
+        """
+        pass
+
     def __call__(self, *args, **kwargs):
         '''
         Creates current object's copy with extra constructor arguments
@@ -186,6 +205,23 @@ class Converter(object):
         validators = tuple(validators) + args
         return self.__class__(*validators, **kwargs)
 
+    def _bind(self, field):
+        '''
+        Returns a copy of the converter bound to `field`, the same as
+        `self(field=field)`, but without calling the constructor if it is
+        bindable (see `_bindable_init`).
+        '''
+        cls = self.__class__
+        if cls.__init__ != cls._bindable_init or \
+                cls.__call__ != Converter.__call__:
+            return self(field=field)
+        conv = object.__new__(cls)
+        kwargs = dict(self._init_kwargs, field=field)
+        conv._init_kwargs = kwargs
+        conv.__dict__.update(kwargs)
+        conv.validators = tuple(cls.validators) + self.validators
+        return conv
+
     def assert_(self, expression, msg):
         'Shortcut for assertions of certain type'
         if not expression:
@@ -432,6 +468,8 @@ class BaseDatetime(CharBased):
             kwargs['readable_format'] = fmt
         Converter.__init__(self, *args, **kwargs)
 
+    _bindable_init = __init__
+
     def from_python(self, value):
         if value is None:
             return ''
@@ -520,6 +558,42 @@ class SplitDateTime(Converter):
         return res
 
 
+#: Cleaners shared by Html converters, keyed by class and options
+_cleaners = {}
+_cleaners_lock = threading.Lock()
+#: Cleaners for converters created on the fly (with closures in
+#: `dom_callbacks` for example) are not cached after this limit
+_cleaners_limit = 256
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return frozenset((key, _freeze(item)) for key, item in value.items())
+    if isinstance(value, (set, frozenset)):
+        return frozenset(_freeze(item) for item in value)
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def _shared_cleaner(cleaner_class, options):
+    '''Returns a cleaner built with given options once per process'''
+    key = (cleaner_class, _freeze(options))
+    try:
+        cleaner = _cleaners.get(key)
+    except TypeError:
+        # unhashable option
+        return cleaner_class(**options)
+    if cleaner is None:
+        with _cleaners_lock:
+            cleaner = _cleaners.get(key)
+            if cleaner is None:
+                cleaner = cleaner_class(**options)
+                if len(_cleaners) < _cleaners_limit:
+                    _cleaners[key] = cleaner
+    return cleaner
+
+
 class Html(Char):
     '''
     Converter for flexible cleanup of HTML document fragments.
@@ -569,6 +643,13 @@ class Html(Char):
     #: A Cleaner class. Be default, 'iktomi.utils.html.Cleaner' is used.
     #: It is a `lxml.html.clean.Cleaner` subclass
     Cleaner = Cleaner
+    #: Whether cleaner instance is shared by all converters with the same
+    #: options. Cleaners are reused across threads, so set to `False` if
+    #: custom `Cleaner` class keeps state between calls.
+    shared_cleaner = True
+    #: :class:`SanitizeCache<iktomi.utils.html.SanitizeCache>` instance to
+    #: reuse results of cleaning unchanged markup
+    clean_cache = None
     class Nothing: pass
 
     PROPERTIES = ['allowed_elements', 'allowed_attributes', 'allowed_protocols',
@@ -622,31 +703,40 @@ class Html(Char):
                 kwargs[opt].update(kwargs.pop(add_key))
         Char.__init__(self, *args, **kwargs)
 
+    _bindable_init = __init__
+
     def clean_value(self, value):
         value = Char.clean_value(self, value)
         try:
-            doc = html.fragment_fromstring(value, create_parent=True)
+            if self.clean_cache is not None:
+                clean = self.clean_cache.clean(value, self.cleaner)
+            else:
+                clean = clean_html(value, self.cleaner)
         except XMLSyntaxError: # pragma: no cover. XXX: seems like this exception is
                                # unreachable with create_parent=True,
                                # maybe it should be removed?
             raise ValidationError(N_(u'Error parsing HTML'))
-        self.cleaner(doc)
-        clean = html.tostring(doc, encoding='utf-8').decode('utf-8')
-        clean = clean.split('>', 1)[1].rsplit('<', 1)[0]
         return self.Markup(clean)
 
+    def cleaner_options(self):
+        '''Returns a dict of keyword arguments for `Cleaner` constructor'''
+        return dict(allow_tags=self.allowed_elements,
+                    safe_attrs=self.allowed_attributes,
+                    allow_classes=self.allowed_classes,
+                    allowed_protocols=self.allowed_protocols,
+                    drop_empty_tags=self.drop_empty_tags,
+                    dom_callbacks=self.dom_callbacks,
+                    wrap_inline_tags=self.wrap_inline_tags,
+                    split_paragraphs_by_br=self.split_paragraphs_by_br,
+                    tags_to_wrap=self.tags_to_wrap,
+                    )
+
     @cached_property
     def cleaner(self):
-        return self.Cleaner(allow_tags=self.allowed_elements,
-                            safe_attrs=self.allowed_attributes,
-                            allow_classes=self.allowed_classes,
-                            allowed_protocols=self.allowed_protocols,
-                            drop_empty_tags=self.drop_empty_tags,
-                            dom_callbacks=self.dom_callbacks,
-                            wrap_inline_tags=self.wrap_inline_tags,
-                            split_paragraphs_by_br=self.split_paragraphs_by_br,
-                            tags_to_wrap=self.tags_to_wrap,
-                            )
+        options = self.cleaner_options()
+        if not self.shared_cleaner:
+            return self.Cleaner(**options)
+        return _shared_cleaner(self.Cleaner, options)
 
 
 class List(Converter):
@@ -693,7 +783,11 @@ class ListOf(Converter):
         kwargs['conv'] = conv
         Converter.__init__(self, *args, **kwargs)
 
+    def prefetch(self, values):
+        self.conv.prefetch([item for value in values for item in value or []])
+
     def to_python(self, value):
+        self.conv.prefetch(value or [])
         result = []
         for val in value or []:
             val = self.conv.accept(val)
@@ -796,11 +890,96 @@ class OptionLabel(six.text_type):
     published = False
 
 
+class OptionsCache(object):
+    '''
+    Caches :meth:`ModelChoice.options` in `iktomi.storage.Storage`
+    backend::
+
+        options_cache = OptionsCache(cache)
+        options_cache.track(db_maker)
+
+        Field('author', conv=convs.ModelChoice(model=Author,
+                                              options_cache=options_cache))
+
+    Cache key includes versions of model tables. A version is changed by
+    :meth:`invalidate`, :meth:`track` makes sessions call it on commit for
+    tables changed in the transaction.
+    '''
+
+    key_prefix = 'options:'
+    #: Seconds to keep options, 0 means they are kept until invalidated
+    ttl = 0
+    _info_key = 'iktomi_changed_tables'
+
+    def __init__(self, storage, ttl=None, key_prefix=None):
+        self.storage = storage
+        if ttl is not None:
+            self.ttl = ttl
+        if key_prefix is not None:
+            self.key_prefix = key_prefix
+
+    def _version_key(self, table_name):
+        return '{}version:{}'.format(self.key_prefix, table_name)
+
+    def version(self, table_name):
+        '''Returns current version of the table'''
+        version = self.storage.get(self._version_key(table_name))
+        if version is None:
+            version = self.invalidate(table_name)
+        return version
+
+    def invalidate(self, table_name):
+        '''Drops cached options of models stored in the table'''
+        version = binascii.hexlify(os.urandom(4)).decode('ascii')
+        self.storage.set(self._version_key(table_name), version)
+        return version
+
+    def track(self, session):
+        '''
+        Invalidates tables changed by `session` (`Session` instance,
+        class or `sessionmaker`) on commit
+        '''
+        event.listen(session, 'after_flush', self._after_flush)
+        event.listen(session, 'after_commit', self._after_commit)
+        event.listen(session, 'after_rollback', self._after_rollback)
+
+    def _after_flush(self, session, flush_context):
+        tables = session.info.setdefault(self._info_key, set())
+        for obj in list(session.new) + list(session.dirty) + \
+                list(session.deleted):
+            tables.update(table.name for table in object_mapper(obj).tables)
+
+    def _after_commit(self, session):
+        for table_name in session.info.pop(self._info_key, ()):
+            self.invalidate(table_name)
+
+    def _after_rollback(self, session):
+        session.info.pop(self._info_key, None)
+
+    def get_or_load(self, model, key, load):
+        '''Returns options cached for `model` with `key` or calls `load` and
+        caches its result'''
+        versions = [self.version(table.name)
+                    for table in class_mapper(model).tables]
+        digest = hashlib.md5(key.encode('utf-8')).hexdigest()
+        full_key = '{}{}:{}'.format(self.key_prefix, '.'.join(versions),
+                                    digest)
+        options = self.storage.get(full_key)
+        if options is None:
+            options = load()
+            self.storage.set(full_key, options, self.ttl)
+        return options
+
+
 class ModelChoice(EnumChoice):
 
     condition = None
     conv = Int(required=False)
     title_field = 'title'
+    #: :class:`OptionsCache` to cache :meth:`options` in
+    options_cache = None
+    #: Number of options per page returned by :meth:`search`
+    search_page_size = 20
 
     def __init__(self, *args, **kwargs):
         EnumChoice.__init__(self, *args, **kwargs)
@@ -821,6 +1000,35 @@ class ModelChoice(EnumChoice):
         else:
             return ''
 
+    def _loaded(self):
+        # Objects loaded during current accept of the form, copies of the
+        # converter share them
+        key = (self.__class__, self.model, id(self.condition))
+        return self.field.form.accept_cache.setdefault(key, {})
+
+    def _ids(self, values):
+        ids = []
+        for value in values:
+            try:
+                value = self.conv.to_python(value)
+            except (ValidationError, TypeError, ValueError):
+                continue
+            if value is not None:
+                ids.append(value)
+        return ids
+
+    def prefetch(self, values):
+        '''Loads objects for all `values` with a single query'''
+        loaded = self._loaded()
+        ids = set(self._ids(values)) - set(loaded)
+        if not ids:
+            return
+        for obj in self.query.filter(self.model.id.in_(ids)):
+            loaded[obj.id] = obj
+        for id_ in ids:
+            # missing objects are not queried again
+            loaded.setdefault(id_, None)
+
     def to_python(self, value):
         try:
             value = self.conv.to_python(value)
@@ -828,7 +1036,10 @@ class ModelChoice(EnumChoice):
             return None
         else:
             if value is not None:
-                return self.query.filter_by(id=value).first()
+                loaded = self._loaded()
+                if value not in loaded:
+                    loaded[value] = self.query.filter_by(id=value).first()
+                return loaded[value]
 
     def get_object_label(self, obj):
         label = OptionLabel(getattr(obj, self.title_field))
@@ -838,9 +1049,83 @@ class ModelChoice(EnumChoice):
             pass
         return label
 
+    def options_cache_key(self):
+        '''
+        Returns a string identifying options list in `options_cache` or
+        `None` if options can not be cached. Subclasses overriding `query`
+        should override it too.
+        '''
+        condition = self.condition
+        if isinstance(condition, dict):
+            condition = sorted(condition.items())
+        elif condition is not None:
+            try:
+                condition = condition.compile(
+                        compile_kwargs={'literal_binds': True})
+            except (CompileError, NotImplementedError):
+                return None
+        return u'{}.{}:{}:{}'.format(self.model.__module__,
+                                     self.model.__name__,
+                                     self.title_field, condition)
+
+    def _option(self, obj):
+        label = self.get_object_label(obj)
+        return self.conv.from_python(obj.id), label
+
+    def _load_options(self):
+        # labels are stored as text and `published` flag
+        return [(value, six.text_type(label), label.published)
+                for value, label in map(self._option, self.query.all())]
+
     def options(self):
-        for obj in self.query.all():
-            yield self.conv.from_python(obj.id), self.get_object_label(obj)
+        '''
+        Yields `(raw_value, label)` pairs for all objects. Options are
+        cached if `options_cache` is set.
+        '''
+        key = None
+        if self.options_cache is not None:
+            key = self.options_cache_key()
+        if key is None:
+            for obj in self.query.all():
+                yield self._option(obj)
+            return
+        options = self.options_cache.get_or_load(self.model, key,
+                                                 self._load_options)
+        for value, title, published in options:
+            label = OptionLabel(title)
+            label.published = published
+            yield value, label
+
+    def selected_options(self, values):
+        '''
+        Yields `(raw_value, label)` pairs for objects with given raw values
+        in the same order
+        '''
+        self.prefetch(values)
+        loaded = self._loaded()
+        for value in values:
+            ids = self._ids([value])
+            if ids and loaded.get(ids[0]) is not None:
+                yield self._option(loaded[ids[0]])
+
+    def search(self, text=u'', page=1):
+        '''
+        Returns a list of `(raw_value, label)` pairs for objects having
+        `text` in title (case-insensitive) on the given page (starting
+        from 1) and whether there are more pages
+        '''
+        query = self.query
+        title = getattr(self.model, self.title_field)
+        if text:
+            pattern = text.lower().replace('\\', '\\\\')\
+                                  .replace('%', '\\%')\
+                                  .replace('_', '\\_')
+            query = query.filter(func.lower(title).like(
+                    u'%{}%'.format(pattern), escape='\\'))
+        size = self.search_page_size
+        objs = query.order_by(title, self.model.id)\
+                    .offset((page - 1) * size).limit(size + 1).all()
+        return [self._option(obj) for obj in objs[:size]], len(objs) > size
 
 
 
@@ -15,6 +15,21 @@ logger = logging.getLogger(__name__)
 __all__ = ['BaseField', 'Field', 'FieldBlock', 'FieldSet', 'FieldList', 'FileField']
 
 
+def index_fields(fields):
+    '''
+    Returns a dict mapping names to fields from `fields` list, fields of
+    nested `FieldBlock` objects are included as they are fields of the
+    list. The first field with a name wins.
+    '''
+    index = {}
+    for field in fields:
+        if isinstance(field, FieldBlock):
+            for name, subfield in field._fields_index.items():
+                index.setdefault(name, subfield)
+        index.setdefault(field.name, field)
+    return index
+
+
 class BaseField(object):
     '''
     Simple container class which ancestors represents various parts of Form.
@@ -57,6 +72,12 @@ class BaseField(object):
         self._init_kwargs = kwargs
         self.__dict__.update(kwargs)
 
+    #: Constructor which result depends on its arguments only, so copies
+    #: of the field can be made by `_bind` without calling it. Subclasses
+    #: overriding `__init__` should set it to new `__init__` if this is true
+    #: for it too.
+    _bindable_init = __init__
+
     def __call__(self, **kwargs):
         '''
         Creates current object's copy with extra constructor arguments passed.
@@ -64,6 +85,30 @@ class BaseField(object):
         params = dict(self._init_kwargs, **kwargs)
         return self.__class__(**params)
 
+    def _bind(self, parent):
+        '''
+        Returns a copy of the field bound to `parent`, the same as
+        `self(parent=parent)`, but without calling constructors of the field,
+        its converter and widget if they are bindable (see
+        `_bindable_init`).
+        '''
+        cls = self.__class__
+        if cls.__init__ != cls._bindable_init or \
+                cls.__call__ != BaseField.__call__:
+            return self(parent=parent)
+        field = object.__new__(cls)
+        kwargs = dict(self._init_kwargs, parent=parent)
+        kwargs['conv'] = kwargs['conv']._bind(field)
+        kwargs['widget'] = kwargs['widget']._bind(field)
+        field._bind_children(kwargs)
+        field._init_kwargs = kwargs
+        field.__dict__.update(kwargs)
+        return field
+
+    def _bind_children(self, kwargs):
+        '''Binds nested fields in constructor arguments to the field'''
+        pass
+
     @property
     def multiple(self):
         return self.conv.multiple
@@ -138,6 +183,35 @@ class BaseField(object):
     def field_names(self):
         return [self.name]
 
+    def prefetch(self, fields, values=None):
+        '''
+        Is called by `FieldList` with its items (copies of this field)
+        before they are accepted, so their converters can load data needed
+        to convert their values at once (see `Converter.prefetch`).
+        `values` are items of JSON list if they are accepted by
+        `accept_json`.
+        '''
+        pass
+
+    def _json_value(self, data):
+        # value of the field in JSON object of its parent
+        if isinstance(data, dict):
+            return data.get(self.name)
+        return None
+
+    def accept_json(self, value):
+        '''
+        Acts as `accept`, but takes the value from JSON data instead of
+        form's raw data (see `Form.accept_json`).
+
+        By default the value is set to form's raw data by `set_raw_value`
+        and accepted by `accept`, so fields which don't override this
+        method take JSON values in the form of raw values.
+        '''
+        if value is not None:
+            self.set_raw_value(self.form.raw_data, value)
+        return self.accept()
+
     def load_initial(self, initial, raw_data):
         value = initial.get(self.name, self.get_initial())
         self.set_raw_value(raw_data,
@@ -184,24 +258,60 @@ class Field(BaseField):
         else:
             raw_data[self.input_name] = value
 
+    def _has_valid_type(self, value):
+        values = value if self.multiple else [value]
+        return all(isinstance(item, six.string_types) for item in values)
+
     def _check_value_type(self, values):
-        if not self.multiple:
-            values = [values]
-        for value in values:
-            if not isinstance(value, six.string_types):
-                self.form.errors[self.input_name] = 'Given value has incompatible type'
-                return False
+        if not self._has_valid_type(values):
+            self.form.errors[self.input_name] = 'Given value has incompatible type'
+            return False
         return True
 
-    def accept(self):
-        '''Extracts raw value from form's raw data and passes it to converter'''
-        value = self.raw_value
+    def prefetch(self, fields, values=None):
+        if values is None:
+            raw_values = [field.raw_value for field in fields]
+        else:
+            raw_values = [self._raw_from_json(value) for value in values]
+        # Values of incompatible type are rejected by accept anyway
+        self.conv.prefetch([value for value in raw_values
+                            if self._has_valid_type(value)])
+
+    def _raw_scalar_from_json(self, value):
+        if value is None:
+            return self._null_value
+        if isinstance(value, bool):
+            return u'1' if value else u''
+        if isinstance(value, six.integer_types + (float,)):
+            return six.text_type(value)
+        # strings and values of incompatible type
+        return value
+
+    def _raw_from_json(self, value):
+        '''Converts JSON value to the form of `raw_value`'''
+        if not self.multiple:
+            return self._raw_scalar_from_json(value)
+        if value is None:
+            return []
+        if not isinstance(value, list):
+            value = [value]
+        return [self._raw_scalar_from_json(item) for item in value
+                if item is not None]
+
+    def _accept_raw(self, value):
         if not self._check_value_type(value):
             # XXX should this be silent or TypeError?
             value = [] if self.multiple else self._null_value
         self.clean_value = self.conv.accept(value)
         return {self.name: self.clean_value}
 
+    def accept(self):
+        '''Extracts raw value from form's raw data and passes it to converter'''
+        return self._accept_raw(self.raw_value)
+
+    def accept_json(self, value):
+        return self._accept_raw(self._raw_from_json(value))
+
 
 class AggregateField(BaseField):
 
@@ -236,27 +346,35 @@ class FieldSet(AggregateField):
         )
         BaseField.__init__(self, **kwargs)
 
+    _bindable_init = __init__
+
+    def _bind_children(self, kwargs):
+        if kwargs['parent']:
+            kwargs['fields'] = [field._bind(self)
+                                for field in kwargs['fields']]
+
     @property
     def prefix(self):
         return self.input_name+'.'
 
+    @cached_property
+    def _fields_index(self):
+        return index_fields(self.fields)
+
+    @cached_property
+    def _subfield_names(self):
+        return sum([x.field_names for x in self.fields], [])
+
     def get_field(self, name):
         names = name.split('.', 1)
-        for field in self.fields:
-            if isinstance(field, FieldBlock):
-                result = field.get_field(name)
-                if result is not None:
-                    return result
-            if field.name == names[0]:
-                if len(names) > 1:
-                    return field.get_field(names[1])
-                return field
-        return None
+        field = self._fields_index.get(names[0])
+        if field is not None and len(names) > 1:
+            return field.get_field(names[1])
+        return field
 
     def get_initial(self):
-        field_names = sum([x.field_names for x in self.fields], [])
         result = dict((name, self.get_field(name).get_initial())
-                      for name in field_names)
+                      for name in self._subfield_names)
         return self.conv.accept(result, silent=True)
 
     def set_raw_value(self, raw_data, value):
@@ -267,12 +385,18 @@ class FieldSet(AggregateField):
         if not value:
             # Field set can be optional
             return
-        field_names = sum([x.field_names for x in self.fields], [])
-        for field_name in field_names:
+        for field_name in self._subfield_names:
             subvalue = value[field_name]
             field = self.get_field(field_name)
             field.set_raw_value(raw_data, field.from_python(subvalue))
 
+    def prefetch(self, fields, values=None):
+        for index, subfield in enumerate(self.fields):
+            subvalues = None if values is None else \
+                    [subfield._json_value(value) for value in values]
+            subfield.prefetch([field.fields[index] for field in fields],
+                              subvalues)
+
     def accept(self):
         '''
         Accepts all children fields, collects resulting values into dict and
@@ -291,6 +415,14 @@ class FieldSet(AggregateField):
         self.clean_value = self.conv.accept(result)
         return {self.name: self.clean_value}
 
+    def accept_json(self, value):
+        result = dict(self.python_data)
+        for field in self.fields:
+            if field.writable:
+                result.update(field.accept_json(field._json_value(value)))
+        self.clean_value = self.conv.accept(result)
+        return {self.name: self.clean_value}
+
 
 class FieldBlock(FieldSet):
     '''
@@ -314,6 +446,8 @@ class FieldBlock(FieldSet):
         kwargs.setdefault('name', '') # XXX generate unique name
         FieldSet.__init__(self, **kwargs)
 
+    _bindable_init = __init__
+
     @cached_property
     def prefix(self):
         return self.parent.prefix
@@ -327,6 +461,15 @@ class FieldBlock(FieldSet):
         self.clean_value = result[self.name]
         return self.clean_value
 
+    def _json_value(self, data):
+        # subfields are accepted from the same object as the block
+        return data
+
+    def accept_json(self, value):
+        result = FieldSet.accept_json(self, value)
+        self.clean_value = result[self.name]
+        return self.clean_value
+
     def load_initial(self, initial, raw_data):
         result = {}
         for field in self.fields:
@@ -335,10 +478,7 @@ class FieldBlock(FieldSet):
 
     @cached_property
     def field_names(self):
-        result = []
-        for field in self.fields:
-            result += field.field_names
-        return result
+        return self._subfield_names
 
     @property
     def python_data(self):
@@ -373,6 +513,12 @@ class FieldList(AggregateField):
         )
         BaseField.__init__(self, **kwargs)
 
+    _bindable_init = __init__
+
+    def _bind_children(self, kwargs):
+        if kwargs['parent']:
+            kwargs['field'] = kwargs['field']._bind(self)
+
     @property
     def prefix(self):
         # NOTE: There was '-' instead of '.' and get_field('list-1') was broken
@@ -398,6 +544,7 @@ class FieldList(AggregateField):
     def accept(self):
         old = self.python_data
         result = OrderedDict()
+        fields = []
         for index in self.form.raw_data.getall(self.indices_input_name):
             try:
                 #XXX: we do not convert index to int, just check it.
@@ -407,7 +554,10 @@ class FieldList(AggregateField):
                 logger.warning('Got incorrect index from form: %r', index)
                 continue
             #TODO: describe this
-            field = self.field(name=str(index))
+            fields.append((index, self.field(name=str(index))))
+        self.field.prefetch([field for index, field in fields
+                             if field.writable])
+        for index, field in fields:
             if not field.writable:
                 # readonly field
                 if index in old:
@@ -417,6 +567,27 @@ class FieldList(AggregateField):
         self.clean_value = self.conv.accept(result)
         return {self.name: self.clean_value}
 
+    def accept_json(self, value):
+        old = self.python_data
+        result = OrderedDict()
+        if not isinstance(value, list):
+            value = []
+        fields = [self.field(name=str(index))
+                  for index in range(1, len(value) + 1)]
+        writable = [(field, item) for field, item in zip(fields, value)
+                    if field.writable]
+        self.field.prefetch([field for field, item in writable],
+                            [item for field, item in writable])
+        for field, item in zip(fields, value):
+            if not field.writable:
+                # readonly field
+                if field.name in old:
+                    result[field.name] = old[field.name]
+            else:
+                result.update(field.accept_json(item))
+        self.clean_value = self.conv.accept(result)
+        return {self.name: self.clean_value}
+
     def set_raw_value(self, raw_data, value):
         indices = []
         for index in range(1, len(value)+1):
@@ -110,6 +110,8 @@ class FileFieldSet(FieldSet):
         kwargs.setdefault('conv', self.conv)
         FieldSet.__init__(self, name, **kwargs)
 
+    _bindable_init = __init__
+
     def get_initial(self):
         # Redefine because FieldSet.get_initial returns dict by default,
         # but python value of FileFieldSet is either None, either BaseFile
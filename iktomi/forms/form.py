@@ -1,10 +1,68 @@
 # -*- coding: utf-8 -*-
 from webob.multidict import MultiDict
 import six
+import multiprocessing
+from collections import deque
 
 from . import convs
 from .perms import DEFAULT_PERMISSIONS
-from .fields import FieldBlock
+from .fields import index_fields
+from ..utils import cached_property
+
+
+#: Validator of a process forked by `Form.validate_many`, set in the
+#: worker process only
+_batch_validator = None
+
+
+def _batch_init(form_class, env, kwargs):
+    global _batch_validator
+    _batch_validator = _BatchValidator(form_class(env, **kwargs))
+
+
+def _batch_validate(rows):
+    return [_batch_validator.validate(row) for row in rows]
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class _BatchValidator(object):
+    '''Accepts rows with a single form instance'''
+
+    def __init__(self, form):
+        self.form = form
+        self.python_data = form.python_data
+        # Aggregate fields start accept from their `clean_value`, so it is
+        # restored too (missing one is computed from parent's python_data)
+        self.clean_values = [(field, field.__dict__.get('clean_value'))
+                             for field in self._fields(form.fields)]
+
+    def _fields(self, fields):
+        for field in fields:
+            yield field
+            for subfield in self._fields(getattr(field, 'fields', [])):
+                yield subfield
+
+    def validate(self, row):
+        form = self.form
+        # state of the form after initialization
+        form.python_data = self.python_data.copy()
+        for field, clean_value in self.clean_values:
+            if clean_value is None:
+                field.__dict__.pop('clean_value', None)
+            else:
+                field.clean_value = clean_value
+        form.accept(row)
+        return form.python_data, form.errors
 
 
 class FormValidationMetaClass(type):
@@ -22,6 +80,9 @@ class FormValidationMetaClass(type):
 class Form(six.with_metaclass(FormValidationMetaClass, object)):
 
     template = 'forms/default'
+    #: Object rendering the form and its widgets instead of `env.template`,
+    #: e.g. :class:`FormRenderer<iktomi.templates.jinja2.FormRenderer>`
+    renderer = None
     permissions = DEFAULT_PERMISSIONS
     id = ''
 
@@ -37,7 +98,7 @@ class Form(six.with_metaclass(FormValidationMetaClass, object)):
         self.initial = initial
         self.python_data = initial.copy()
         # clone all fields
-        self.fields = [field(parent=self) for field in self.fields]
+        self.fields = [field._bind(self) for field in self.fields]
 
         if permissions is None:
             permissions = self.permissions
@@ -48,6 +109,10 @@ class Form(six.with_metaclass(FormValidationMetaClass, object)):
             #       because it may differ for each call
             self.python_data.update(field.load_initial(initial, self.raw_data))
         self.errors = {}
+        #: Data shared by converters during accept (objects loaded by
+        #: :class:`ModelChoice<iktomi.forms.convs.ModelChoice>` etc), is
+        #: cleared on each accept
+        self.accept_cache = {}
 
     @property
     def form(self):
@@ -63,6 +128,8 @@ class Form(six.with_metaclass(FormValidationMetaClass, object)):
 
     def render(self):
         '''Proxy method to form's environment render method'''
+        if self.renderer is not None:
+            return self.renderer.render(self)
         return self.env.template.render(self.template, form=self)
 
     @property
@@ -76,6 +143,7 @@ class Form(six.with_metaclass(FormValidationMetaClass, object)):
         '''
         self.raw_data = MultiDict(data)
         self.errors = {}
+        self.accept_cache = {}
         for field in self.fields:
             if field.writable:
                 self.python_data.update(field.accept())
@@ -87,21 +155,100 @@ class Form(six.with_metaclass(FormValidationMetaClass, object)):
                     subfield.set_raw_value(self.raw_data, subfield.from_python(value))
         return self.is_valid
 
+    def accept_json(self, data):
+        '''
+        Accepts parsed JSON object and returns if it is valid. Values of
+        :class:`FieldSet<iktomi.forms.fields.FieldSet>` are nested objects,
+        values of :class:`FieldList<iktomi.forms.fields.FieldList>` and
+        multiple fields are lists::
+
+            form.accept_json({'title': 'News', 'tags': [1, 2],
+                              'links': [{'url': 'http://example.com'}]})
+
+        Numbers are converted to strings, `true` and `false` to `'1'` and
+        `''`, `null` to empty value, before values are passed to
+        converters.
+
+        Unlike `accept`, values are not flattened into `raw_data`, which is
+        left unchanged (except for values of custom fields not implementing
+        `accept_json`), so use `accept` if the form is to be rendered with
+        submitted values.
+        '''
+        if not isinstance(data, dict):
+            data = {}
+        self.errors = {}
+        self.accept_cache = {}
+        for field in self.fields:
+            if field.writable:
+                self.python_data.update(
+                        field.accept_json(field._json_value(data)))
+        return self.is_valid
+
+    @classmethod
+    def validate_many(cls, env, rows, processes=None, chunk_size=100,
+                      **kwargs):
+        '''
+        Accepts each of `rows` (MultiDict-like objects or dicts of raw
+        values) and yields `(python_data, errors)` tuple for it, in the same
+        order::
+
+            for python_data, errors in ImportForm.validate_many(env, rows):
+                ...
+
+        Unlike creating a form for each row, fields, converters and widgets
+        are created once and reused, and rows are processed as they are
+        read from `rows` iterable. Extra keyword arguments are passed to
+        the form constructor.
+
+        If `processes` is given, rows are validated by a pool of forked
+        processes in chunks of `chunk_size` rows. At most `2 * processes`
+        chunks are read ahead of the yielded results. Each process creates its
+        own form using `env` inherited from the parent, so `env` should not
+        hold open database connections or sockets, and `python_data` values
+        must be picklable.
+        '''
+        if not processes:
+            validator = _BatchValidator(cls(env, **kwargs))
+            for row in rows:
+                yield validator.validate(row)
+            return
+        # Arguments are inherited by forked processes, not pickled
+        initargs = (cls, env, kwargs)
+        if hasattr(multiprocessing, 'get_context'):
+            pool = multiprocessing.get_context('fork').Pool(
+                processes, initializer=_batch_init, initargs=initargs)
+        else: # pragma: no cover, python 2
+            pool = multiprocessing.Pool(
+                processes, initializer=_batch_init, initargs=initargs)
+        try:
+            # Pool.imap() reads the whole iterable in a background thread,
+            # so chunks are submitted one by one as results are consumed
+            pending = deque()
+            for chunk in _chunks(rows, chunk_size):
+                pending.append(pool.apply_async(_batch_validate, (chunk,)))
+                if len(pending) < 2 * processes:
+                    continue
+                for result in pending.popleft().get():
+                    yield result
+            while pending:
+                for result in pending.popleft().get():
+                    yield result
+        finally:
+            pool.terminate()
+
+    @cached_property
+    def _fields_index(self):
+        return index_fields(self.fields)
+
     def get_field(self, name):
         '''
         Gets field by input name
         '''
         names = name.split('.', 1)
-        for field in self.fields:
-            if isinstance(field, FieldBlock):
-                result = field.get_field(name)
-                if result is not None:
-                    return result
-            if field.name == names[0]:
-                if len(names) > 1:
-                    return field.get_field(names[1])
-                return field
-        return None
+        field = self._fields_index.get(names[0])
+        if field is not None and len(names) > 1:
+            return field.get_field(names[1])
+        return field
 
     def get_data(self, compact=True):
         '''
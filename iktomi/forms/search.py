@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+'''
+Web handler serving options of
+:class:`RemoteSelect<iktomi.forms.widgets.RemoteSelect>` widget.
+'''
+
+__all__ = ['choice_search']
+
+import json
+from webob import Response
+from webob.exc import HTTPForbidden, HTTPNotFound
+from iktomi.web.core import WebHandler
+from . import convs
+
+
+class choice_search(WebHandler):
+    '''
+    Returns a page of options of `ModelChoice` converter of the form
+    field matching `q` request parameter in JSON format::
+
+        {"results": [{"id": "1", "text": "Title"}, ...], "more": true}
+
+    Page number (starting from 1) is given in `page` parameter. The form is
+    instantiated with `env`, so field permissions and converter query are
+    the same as for the form being rendered::
+
+        web.match('/authors', 'authors') | choice_search(NewsForm, 'author')
+    '''
+
+    def __init__(self, form_class, field_name):
+        self.form_class = form_class
+        self.field_name = field_name
+
+    def get_conv(self, env):
+        field = self.form_class(env).get_field(self.field_name)
+        if field is None:
+            raise HTTPNotFound()
+        if not field.readable:
+            raise HTTPForbidden()
+        conv = field.conv
+        if isinstance(conv, convs.ListOf):
+            conv = conv.conv
+        return conv
+
+    def choice_search(self, env, data):
+        conv = self.get_conv(env)
+        try:
+            page = max(int(env.request.GET.get('page', 1)), 1)
+        except ValueError:
+            page = 1
+        options, more = conv.search(env.request.GET.get('q', u''), page)
+        body = json.dumps({
+            'results': [{'id': value, 'text': label}
+                        for value, label in options],
+            'more': more,
+        })
+        return Response(body, content_type='application/json',
+                        charset='utf-8')
+    __call__ = choice_search
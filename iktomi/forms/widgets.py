@@ -33,6 +33,12 @@ class Widget(object):
         self._init_kwargs = kwargs
         self.__dict__.update(kwargs)
 
+    #: Constructor which result depends on its arguments only, so copies
+    #: of the widget can be made by `_bind` without calling it. Subclasses
+    #: overriding `__init__` should set it to new `__init__` if this is true
+    #: for it too.
+    _bindable_init = __init__
+
     @property
     def multiple(self):
         return self.field.multiple
@@ -69,6 +75,9 @@ class Widget(object):
         '''
         data = self.prepare_data()
         if self.field.readable:
+            renderer = self.field.form.renderer
+            if renderer is not None:
+                return renderer.render_widget(self, data)
             return self.env.template.render(self.template, **data)
         return ''
 
@@ -80,6 +89,22 @@ class Widget(object):
         kwargs.setdefault('field', self.field)
         return self.__class__(**kwargs)
 
+    def _bind(self, field):
+        '''
+        Returns a copy of the widget bound to `field`, the same as
+        `self(field=field)`, but without calling the constructor if it is
+        bindable (see `_bindable_init`).
+        '''
+        cls = self.__class__
+        if cls.__init__ != cls._bindable_init or \
+                cls.__call__ != Widget.__call__:
+            return self(field=field)
+        widget = object.__new__(cls)
+        widget.field = weakproxy(field)
+        widget._init_kwargs = kwargs = dict(self._init_kwargs)
+        widget.__dict__.update(kwargs)
+        return widget
+
 
 class TextInput(Widget):
 
@@ -129,7 +154,7 @@ class Select(Widget):
         has_null_value = False
 
         values = value if self.multiple else [value]
-        for choice, label in choice_conv.options():
+        for choice, label in self.choices(choice_conv, values):
             has_null_value = has_null_value or choice == ''
             options.append(dict(value=choice,
                                 title=label,
@@ -143,6 +168,10 @@ class Select(Widget):
                                'selected': value in (None, '')})
         return options
 
+    def choices(self, choice_conv, values):
+        '''Returns `(raw_value, label)` pairs to render as options'''
+        return choice_conv.options()
+
     def prepare_data(self):
         data = Widget.prepare_data(self)
         return dict(data,
@@ -150,6 +179,23 @@ class Select(Widget):
                     required=('true' if self.field.conv.required else 'false'))
 
 
+class RemoteSelect(Select):
+    '''
+    Select rendering selected options only, the rest are to be loaded by
+    client script from `url` serving
+    :class:`choice_search<iktomi.forms.search.choice_search>` handler.
+    Requires :class:`ModelChoice<iktomi.forms.convs.ModelChoice>`
+    converter.
+    '''
+
+    template = 'widgets/remote-select'
+    #: URL of the search handler
+    url = None
+
+    def choices(self, choice_conv, values):
+        return choice_conv.selected_options(values)
+
+
 class CheckBoxSelect(Select):
 
     classname = 'select-checkbox'
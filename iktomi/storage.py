@@ -1,11 +1,17 @@
 # -*- coding: utf-8 -*-
 
+import threading
+
 
 class Storage(object):
     def set(self, key, value, time=0):# pragma: no cover
         raise NotImplementedError()
     def get(self, key, default=None):# pragma: no cover
         raise NotImplementedError()
+    def add(self, key, value, time=0):# pragma: no cover
+        '''Sets value only if the key does not exist, returns `True` if
+        value was set'''
+        raise NotImplementedError()
     def delete(self, key):# pragma: no cover
         raise NotImplementedError()
 
@@ -13,6 +19,7 @@ class Storage(object):
 class LocalMemStorage(Storage):
     def __init__(self):
         self.storage = {}
+        self._lock = threading.Lock()
 
     def set(self, key, value, time=0):
         self.storage[key] = value
@@ -21,6 +28,13 @@ class LocalMemStorage(Storage):
     def get(self, key, default=None):
         return self.storage.get(key, default)
 
+    def add(self, key, value, time=0):
+        with self._lock:
+            if key in self.storage:
+                return False
+            self.storage[key] = value
+            return True
+
     def delete(self, key):
         if key in self.storage:
             del self.storage[key]
@@ -42,5 +56,8 @@ class MemcachedStorage(Storage):
             return default
         return value
 
+    def add(self, key, value, time=0):
+        return bool(self.storage.add(key, value, time))
+
     def delete(self, key):
         return self.storage.delete(key)
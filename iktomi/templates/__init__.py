@@ -5,7 +5,8 @@ import logging
 logger = logging.getLogger(__name__)
 from glob import glob
 from ..web import Response, request_filter
-from ..utils import cached_property
+from ..web.timing import null_timing
+from ..utils import cached_property, ChainMapping
 
 __all__ = ('Template',)
 
@@ -15,18 +16,50 @@ class TemplateError(Exception):
     pass
 
 
+def buffered(chunks, size):
+    '''Joins string chunks into chunks of at least `size` characters'''
+    buf = []
+    length = 0
+    for chunk in chunks:
+        buf.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield u''.join(buf)
+            buf = []
+            length = 0
+    if buf:
+        yield u''.join(buf)
+
+
 class Template(object):
     '''Proxy class managing a set of template engines'''
 
+    #: Minimal size (in characters) of chunks yielded by `render_to_stream`
+    stream_buffer_size = 8192
+    #: :class:`TemplateProfile<iktomi.templates.profile.TemplateProfile>`
+    #: collecting render stats. Engines supporting profiling (having
+    #: `profile` attribute) measure templates themselves, including the
+    #: nested ones, others are measured by `Template`.
+    profile = None
+
     def __init__(self, *dirs, **kwargs):
         self.globs = kwargs.get('globs', {})
         self.cache = kwargs.get('cache', False)
+        if 'stream_buffer_size' in kwargs:
+            self.stream_buffer_size = kwargs['stream_buffer_size']
         self.dirs = []
         for d in dirs:
             self.dirs.append(d)
         self.engines = {}
         for template_type, engine in kwargs.get('engines', {}).items():
             self.engines[template_type] = engine
+        if kwargs.get('profile') is not None:
+            self.profile = kwargs['profile']
+            for engine in self.engines.values():
+                if getattr(engine, 'profile', False) is None:
+                    engine.profile = self.profile
+        # template name -> ((relative path, engine), dirs mtimes)
+        self._index = {}
 
     def render(self, template_name, **kw):
         '''
@@ -39,9 +72,108 @@ class Template(object):
         vars = self.globs.copy()
         vars.update(kw)
         resolved_name, engine = self.resolve(template_name)
-        return engine.render(resolved_name, **vars)
+        return self._render(engine, resolved_name, engine.render,
+                            resolved_name, **vars)
+
+    def _profiled(self, engine):
+        return self.profile is not None and not hasattr(engine, 'profile')
+
+    def _render(self, engine, resolved_name, render, *args, **kwargs):
+        if not self._profiled(engine):
+            return render(*args, **kwargs)
+        with self.profile.measure(resolved_name) as measured:
+            result = render(*args, **kwargs)
+            measured.size = len(result)
+        return result
+
+    def render_context(self, template_name, context):
+        '''
+        Same as `render`, but template vars are given as a mapping, which is
+        not copied by engines supporting this (having `render_context`
+        method).
+        '''
+        logger.debug('Rendering template "%s"', template_name)
+        resolved_name, engine = self.resolve(template_name)
+        if isinstance(context, dict):
+            vars = self.globs.copy()
+            vars.update(context)
+            context = vars
+        elif self.globs:
+            context = ChainMapping(context, self.globs)
+        if not hasattr(engine, 'render_context'):
+            return self._render(engine, resolved_name, engine.render,
+                                resolved_name, **dict(context))
+        return self._render(engine, resolved_name, engine.render_context,
+                            resolved_name, context)
+
+    def render_to_stream(self, template_name, **kw):
+        '''
+        Same as `render`, but returns an iterator over rendered template
+        chunks. Template is rendered while the iterator is consumed by
+        engines supporting this (having `render_to_stream` method).
+        '''
+        logger.debug('Rendering template "%s" to stream', template_name)
+        vars = self.globs.copy()
+        vars.update(kw)
+        resolved_name, engine = self.resolve(template_name)
+        if not hasattr(engine, 'render_to_stream'):
+            chunks = iter([engine.render(resolved_name, **vars)])
+        else:
+            chunks = engine.render_to_stream(resolved_name, **vars)
+        if self._profiled(engine):
+            chunks = self.profile.measure_iter(resolved_name, chunks)
+        return buffered(chunks, self.stream_buffer_size)
+
+    def _dirs_mtimes(self, template_name):
+        subdir = os.path.dirname(template_name)
+        mtimes = []
+        for d in self.dirs:
+            try:
+                path = os.path.join(d, subdir)
+                mtimes.append(os.stat(path).st_mtime)
+            except OSError:
+                mtimes.append(None)
+        return mtimes
 
     def resolve(self, template_name):
+        '''
+        Returns a tuple of template path relative to template directory and
+        engine for the template.
+
+        Results are kept in an index. If `cache` is set, the index is
+        never invalidated, otherwise an entry is checked against
+        modification times of directories containing the template.
+        '''
+        entry = self._index.get(template_name)
+        if entry is not None:
+            resolved, mtimes = entry
+            if self.cache or mtimes == self._dirs_mtimes(template_name):
+                return resolved
+        # Modification times are taken before the search, so files added
+        # during it invalidate the entry
+        mtimes = None if self.cache else self._dirs_mtimes(template_name)
+        resolved = self._resolve(template_name)
+        self._index[template_name] = (resolved, mtimes)
+        return resolved
+
+    def list_templates(self):
+        '''
+        Yields tuples of template path relative to template directory and
+        engine for all templates in `dirs` having known engine. Templates
+        overridden by ones in preceding directories are skipped.
+        '''
+        seen = set()
+        for d in self.dirs:
+            for dir_path, dir_names, file_names in os.walk(d):
+                dir_names.sort()
+                for file_name in sorted(file_names):
+                    name = os.path.relpath(os.path.join(dir_path, file_name), d)
+                    template_type = os.path.splitext(file_name)[1][1:]
+                    if template_type in self.engines and name not in seen:
+                        seen.add(name)
+                        yield name, self.engines[template_type]
+
+    def _resolve(self, template_name):
         pattern = template_name
         if not os.path.splitext(template_name)[1]:
             pattern += '.*'
@@ -97,11 +229,22 @@ class BoundTemplate(object):
         d.update(self.get_template_vars())
         return d
 
+    def _context(self, __data, **kw):
+        '''Same as `_vars`, but `VersionedStorage` data is not copied: a
+        read-only mapping view of it is returned instead'''
+        if not hasattr(__data, 'as_mapping'):
+            # Copying small dicts is cheaper than lookups in mapping view
+            return self._vars(__data, **kw)
+        vars = dict(kw)
+        vars.update(self.get_template_vars())
+        return ChainMapping(vars, __data.as_mapping())
+
     def render(self, template_name, __data=None, **kw):
         '''Given a template name and template data.
         Renders a template and returns as string'''
-        return self.template.render(template_name,
-                                    **self._vars(__data, **kw))
+        with getattr(self.env, 'timing', null_timing).phase('template'):
+            return self.template.render_context(template_name,
+                                                self._context(__data, **kw))
 
     def render_to_response(self, template_name, __data,
                            content_type="text/html"):
@@ -110,3 +253,24 @@ class BoundTemplate(object):
         resp = self.render(template_name, __data)
         return Response(resp,
                         content_type=content_type)
+
+    def render_to_stream(self, template_name, __data=None, **kw):
+        '''Given a template name and template data.
+        Returns an iterator over rendered template chunks.
+
+        Note that the template is rendered after the handler returns,
+        when `env` storage frames pushed by `web.cases` are already popped,
+        so values set in nested routing branches should be passed
+        in template data explicitly. Template data is copied for the same
+        reason.'''
+        return self.template.render_to_stream(template_name,
+                                              **self._vars(__data, **kw))
+
+    def stream_to_response(self, template_name, __data,
+                           content_type="text/html"):
+        '''Given a template name and template data.
+        Returns `webob.Response` object sending the template while it is
+        rendered'''
+        stream = self.render_to_stream(template_name, __data)
+        return Response(app_iter=(chunk.encode('utf-8') for chunk in stream),
+                        content_type=content_type, charset='utf-8')
@@ -4,35 +4,422 @@ from os.path import dirname, abspath, join
 import logging
 logger = logging.getLogger(__name__)
 
+import os
+import six
+import time
+import hashlib
+import binascii
+import threading
+from collections import OrderedDict
 import jinja2
+from jinja2 import nodes
+from jinja2.ext import Extension
+from jinja2.utils import concat
+from markupsafe import Markup
+from iktomi.storage import Storage
+from iktomi.utils import ChainMapping
+from iktomi.web.timing import null_timing
 
-__all__ = ('TemplateEngine', 'TEMPLATE_DIR')
+__all__ = ('TemplateEngine', 'StorageBytecodeCache', 'FragmentCache',
+           'FragmentCacheExtension', 'ProfiledTemplate', 'FormRenderer',
+           'TEMPLATE_DIR')
 
 CURDIR = dirname(abspath(__file__))
 TEMPLATE_DIR = join(CURDIR, 'templates')
 
 
+class StorageBytecodeCache(jinja2.BytecodeCache):
+    '''
+    Keeps compiled templates in `iktomi.storage.Storage` backend, so they
+    are shared by all workers and hosts using the same storage.
+    '''
+
+    def __init__(self, storage, prefix='jinja2/bytecode/', timeout=0):
+        self.storage = storage
+        self.prefix = prefix
+        self.timeout = timeout
+
+    def load_bytecode(self, bucket):
+        code = self.storage.get(self.prefix + bucket.key)
+        if code is not None:
+            bucket.bytecode_from_string(code)
+
+    def dump_bytecode(self, bucket):
+        self.storage.set(self.prefix + bucket.key,
+                         bucket.bytecode_to_string(), self.timeout)
+
+
+class _LocalTier(object):
+    '''In-process LRU cache with expiration'''
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.items.pop(key, None)
+            if item is None or item[0] < time.time():
+                return None
+            self.items[key] = item
+            return item[1]
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if not ttl else min(ttl, self.ttl)
+        with self.lock:
+            self.items.pop(key, None)
+            self.items[key] = (time.time() + ttl, value)
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
+
+
+class FragmentCache(object):
+    '''
+    Storage of rendered template fragments used by
+    :class:`FragmentCacheExtension`::
+
+        fragment_cache = FragmentCache(MemcachedStorage(cfg.MEMCACHE))
+        engine = TemplateEngine(paths,
+                                extensions=[FragmentCacheExtension])
+        engine.env.fragment_cache = fragment_cache
+
+    The first part of the fragment key is its name. All fragments with given
+    name are invalidated at once by changing name's version stored in
+    `storage`, so no deletes are needed::
+
+        fragment_cache.invalidate('sidebar')
+
+    Fragments and versions are kept in in-process tier for `local_ttl`
+    seconds in front of `storage`, so invalidation in other processes takes
+    effect after this delay. Set `local_ttl` to 0 to disable the local tier.
+    '''
+
+    prefix = 'fragment:'
+    local_ttl = 5
+    local_size = 1000
+
+    def __init__(self, storage, prefix=None, local_ttl=None,
+                 local_size=None):
+        self.storage = storage
+        if prefix is not None:
+            self.prefix = prefix
+        if local_ttl is not None:
+            self.local_ttl = local_ttl
+        if local_size is not None:
+            self.local_size = local_size
+        self.local = _LocalTier(self.local_size, self.local_ttl) \
+                if self.local_ttl else None
+
+    def _get(self, key):
+        if self.local is not None:
+            value = self.local.get(key)
+            if value is not None:
+                return value
+        value = self.storage.get(key)
+        if value is not None and self.local is not None:
+            self.local.set(key, value)
+        return value
+
+    def _set(self, key, value, ttl):
+        self.storage.set(key, value, ttl)
+        if self.local is not None:
+            self.local.set(key, value, ttl)
+
+    def _version_key(self, name):
+        return '{}version:{}'.format(self.prefix, name)
+
+    def version(self, name):
+        '''Returns current version of fragments with given name'''
+        version = self._get(self._version_key(name))
+        if version is None:
+            version = self.invalidate(name)
+        return version
+
+    def invalidate(self, name):
+        '''Invalidates all fragments with given name'''
+        version = binascii.hexlify(os.urandom(4)).decode('ascii')
+        self._set(self._version_key(name), version, 0)
+        return version
+
+    def make_key(self, key):
+        '''Builds storage key from fragment key (string or tuple of parts,
+        the first one is the name)'''
+        parts = key if isinstance(key, (tuple, list)) else (key,)
+        parts = [u'{}'.format(part) for part in parts]
+        digest = hashlib.md5(u'\n'.join(parts).encode('utf-8')).hexdigest()
+        return u'{}{}:{}:{}'.format(self.prefix, parts[0],
+                                    self.version(parts[0]), digest)
+
+    def get_or_render(self, key, ttl, render):
+        '''Returns cached fragment or calls `render` and caches its
+        result for `ttl` seconds'''
+        key = self.make_key(key)
+        value = self._get(key)
+        if value is None:
+            value = six.text_type(render())
+            self._set(key, value, ttl)
+        return value
+
+
+class FragmentCacheExtension(Extension):
+    '''
+    Jinja2 extension adding `cache` tag caching the rendered block in
+    environment's `fragment_cache` (:class:`FragmentCache` instance) for
+    given number of seconds::
+
+        {% cache ('sidebar', lang), 300 %}
+            ...
+        {% endcache %}
+
+    Blocks are rendered each time if `fragment_cache` is not set.
+    '''
+
+    tags = set(['cache'])
+
+    def __init__(self, environment):
+        Extension.__init__(self, environment)
+        environment.extend(fragment_cache=None)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key = parser.parse_expression()
+        parser.stream.expect('comma')
+        ttl = parser.parse_expression()
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        call = self.call_method('_cache', [key, ttl])
+        return nodes.CallBlock(call, [], [], body).set_lineno(lineno)
+
+    def _cache(self, key, ttl, caller):
+        fragment_cache = self.environment.fragment_cache
+        if fragment_cache is None:
+            return caller()
+        return Markup(fragment_cache.get_or_render(key, ttl, caller))
+
+
+class ProfiledTemplate(jinja2.Template):
+    '''
+    Template measuring its renders with environment's `template_profile`
+    (:class:`TemplateProfile<iktomi.templates.profile.TemplateProfile>`
+    instance) if it is set. Renders of included and parent templates are
+    measured too.
+    '''
+
+    @classmethod
+    def _from_namespace(cls, environment, namespace, globals):
+        template = super(ProfiledTemplate, cls)._from_namespace(
+                environment, namespace, globals)
+        root_render_func = template.root_render_func
+        name = template.name or '<string>'
+
+        def profiled_root_render_func(context):
+            profile = environment.template_profile
+            if profile is None:
+                return root_render_func(context)
+            return profile.measure_iter(name, root_render_func(context))
+
+        template.root_render_func = profiled_root_render_func
+        return template
+
+
 class TemplateEngine(object):
     '''
     Jinja2 engine adapter.
     '''
-    def __init__(self, paths, cache=False, extensions=None):
+    def __init__(self, paths, cache=False, extensions=None, profile=None):
         '''
         :param paths: list of paths
+        :param cache: bytecode cache for compiled templates: directory path,
+            `iktomi.storage.Storage` or `jinja2.BytecodeCache` instance.
+            `True` means a directory in the system temporary directory.
         :param extensions: list of extensions
+        :param profile: `iktomi.templates.profile.TemplateProfile` instance,
+            is set by `Template` if not given
         '''
         self.extensions = extensions or []
+        self.bytecode_cache = self._make_bytecode_cache(cache)
         self.env = self._make_env(paths)
+        self.env.template_class = ProfiledTemplate
+        self.env.extend(template_profile=profile)
+
+    @property
+    def profile(self):
+        return self.env.template_profile
 
+    @profile.setter
+    def profile(self, profile):
+        self.env.template_profile = profile
+
+    def _make_bytecode_cache(self, cache):
+        if not cache:
+            return None
+        if isinstance(cache, jinja2.BytecodeCache):
+            return cache
+        if isinstance(cache, Storage):
+            return StorageBytecodeCache(cache)
+        if isinstance(cache, six.string_types):
+            return jinja2.FileSystemBytecodeCache(cache)
+        return jinja2.FileSystemBytecodeCache()
 
     def _make_env(self, paths):
         # XXX make an interface method
         return jinja2.Environment(
             loader=jinja2.FileSystemLoader(paths),
             autoescape=True,
-            extensions=self.extensions
+            extensions=self.extensions,
+            bytecode_cache=self.bytecode_cache,
         )
 
     def render(self, template_name, **kw):
         'Interface method called from `Template.render`'
         return self.env.get_template(template_name).render(**kw)
+
+    def render_context(self, template_name, context):
+        'Interface method called from `Template.render_context`'
+        template = self.env.get_template(template_name)
+        if isinstance(context, dict):
+            # Copying small dict is cheaper than lookups in ChainMapping
+            return template.render(context)
+        # Shared context uses given mapping as is, without merging it with
+        # globals into a new dict
+        context = template.new_context(
+                ChainMapping(context, template.globals), shared=True)
+        try:
+            return concat(template.root_render_func(context))
+        except Exception:
+            return self.env.handle_exception()
+
+    def render_to_stream(self, template_name, **kw):
+        'Interface method called from `Template.render_to_stream`'
+        return self.env.get_template(template_name).generate(**kw)
+
+    def compile(self, template_name):
+        '''Interface method compiling template and putting it to the
+        bytecode cache'''
+        self.env.get_template(template_name)
+
+
+class FormRenderer(object):
+    '''
+    Renders forms with Jinja2 templates compiled once per form class.
+    Set it as `renderer` attribute of the form class to use::
+
+        class MyForm(Form):
+            renderer = FormRenderer()
+            fields = [...]
+
+    On the first render of the form class its layout template and templates
+    of all its widgets (including nested ones) are resolved and compiled to
+    a plan. Then the form is rendered by a single call of the layout
+    template, and widgets are rendered by compiled templates directly, with
+    flat context built from variables computed once per form render.
+    Templates of other engines are rendered by `env.template` as usual.
+
+    Unless `Template.cache` is set, the plan is compiled again when any of
+    its templates is modified.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (Template, form class, layout name) ->
+        #     {template name: jinja2 template or None}
+        self._plans = {}
+        self._local = threading.local()
+
+    def _renders(self):
+        # form -> (plan, context) for forms being rendered in this thread
+        renders = getattr(self._local, 'renders', None)
+        if renders is None:
+            renders = self._local.renders = {}
+        return renders
+
+    def _compile_template(self, template, name):
+        resolved_name, engine = template.resolve(name)
+        if not isinstance(engine, TemplateEngine):
+            return None
+        return engine.env.get_template(resolved_name)
+
+    def _template_names(self, fields):
+        for field in fields:
+            yield field.widget.template
+            subfields = list(getattr(field, 'fields', []))
+            if getattr(field, 'field', None) is not None:
+                subfields.append(field.field)
+            for name in self._template_names(subfields):
+                yield name
+
+    def compile(self, form):
+        '''Returns the plan of the form class, compiling it if needed'''
+        template = form.env.template.template
+        key = (template, type(form), form.template)
+        plan = self._plans.get(key)
+        if plan is not None and (template.cache or all(
+                compiled is None or compiled.is_up_to_date
+                for compiled in list(plan.values()))):
+            return plan
+        with self.lock:
+            names = set(self._template_names(form.fields))
+            names.add(form.template)
+            plan = dict((name, self._compile_template(template, name))
+                        for name in names if name)
+            self._plans[key] = plan
+        return plan
+
+    def _context(self, form, plan):
+        bound = form.env.template
+        globs = {}
+        for compiled in plan.values():
+            if compiled is not None:
+                globs.update(compiled.globals)
+                break
+        globs.update(bound.template.globs)
+        return globs, bound.get_template_vars()
+
+    def _render(self, compiled, context, data):
+        globs, template_vars = context
+        vars = dict(globs)
+        vars.update(data)
+        vars.update(template_vars)
+        try:
+            return concat(compiled.root_render_func(
+                    compiled.new_context(vars, shared=True)))
+        except Exception:
+            return compiled.environment.handle_exception()
+
+    def render(self, form):
+        '''Renders the form, called by `Form.render`'''
+        plan = self.compile(form)
+        compiled = plan[form.template]
+        if compiled is None:
+            return form.env.template.render(form.template, form=form)
+        renders = self._renders()
+        with getattr(form.env, 'timing', null_timing).phase('template'):
+            context = self._context(form, plan)
+            renders[form] = (plan, context)
+            try:
+                return self._render(compiled, context, {'form': form})
+            finally:
+                del renders[form]
+
+    def render_widget(self, widget, data):
+        '''Renders the widget with prepared data, called by
+        `Widget.render`'''
+        form = widget.field.form
+        state = self._renders().get(form)
+        if state is None:
+            # Widget is rendered outside of form's layout template
+            plan = self.compile(form)
+        else:
+            plan = state[0]
+        if widget.template not in plan:
+            # Widget template is changed after the plan is compiled
+            plan[widget.template] = self._compile_template(
+                    form.env.template.template, widget.template)
+        compiled = plan[widget.template]
+        if compiled is None:
+            return widget.env.template.render(widget.template, **data)
+        if state is not None:
+            return self._render(compiled, state[1], data)
+        with getattr(form.env, 'timing', null_timing).phase('template'):
+            return self._render(compiled, self._context(form, plan), data)
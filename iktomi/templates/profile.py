@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+'''
+Template render profiling.
+'''
+
+__all__ = ['TemplateProfile']
+
+import time
+import threading
+from contextlib import contextmanager
+
+
+class _Render(object):
+    '''A template render in progress'''
+
+    def __init__(self):
+        self.nested = 0
+        self.size = 0
+
+
+class TemplateProfile(object):
+    '''
+    Collects per-template render stats in
+    :class:`Metrics<iktomi.web.monitoring.Metrics>` registry::
+
+        metrics = Metrics(path='/dev/shm/myproject-metrics')
+        template = Template(cfg.TEMPLATES, engines={...},
+                            profile=TemplateProfile(metrics))
+
+    Following metrics are collected for each template name:
+
+    * `iktomi_template_render_seconds` histogram of render durations,
+      including nested templates (includes, parent templates, widgets
+      rendered from the template);
+    * `iktomi_template_self_seconds_total` counter of render durations
+      excluding nested templates;
+    * `iktomi_template_output_chars_total` counter of rendered characters.
+
+    The report is printed with `templates:profile` command of
+    :class:`Templates<iktomi.cli.templates.Templates>` CLI.
+    '''
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self._local = threading.local()
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    @contextmanager
+    def measure(self, name):
+        '''Context manager measuring a render of template `name`. Yields an
+        object which `size` attribute should be set to output length.'''
+        stack = self._stack()
+        render = _Render()
+        stack.append(render)
+        start = time.time()
+        try:
+            yield render
+        finally:
+            duration = time.time() - start
+            # streamed renders may finish in any order
+            stack.remove(render)
+            if stack:
+                stack[-1].nested += duration
+            self.record(name, duration, duration - render.nested,
+                        render.size)
+
+    def measure_iter(self, name, chunks):
+        '''Yields `chunks` measuring time of their rendering. For streamed
+        templates it includes the time consumer spends between chunks.'''
+        with self.measure(name) as render:
+            for chunk in chunks:
+                render.size += len(chunk)
+                yield chunk
+
+    def record(self, name, duration, self_duration, size):
+        self.metrics.observe('iktomi_template_render_seconds', duration,
+                             template=name)
+        self.metrics.inc('iktomi_template_self_seconds_total',
+                         self_duration, template=name)
+        self.metrics.inc('iktomi_template_output_chars_total', size,
+                         template=name)
+
+    def stats(self):
+        '''Returns a list of dicts with `template`, `calls`, `time`,
+        `self_time` and `size` (totals over all calls) keys aggregated over
+        all processes sharing metrics'''
+        counters, gauges, histograms = self.metrics.collect()
+        stats = {}
+        for (name, labels), value in histograms.items():
+            if name == 'iktomi_template_render_seconds':
+                template = dict(labels)['template']
+                stats[template] = {'template': template,
+                                   'calls': sum(value[:-1]),
+                                   'time': value[-1],
+                                   'self_time': 0,
+                                   'size': 0}
+        for (name, labels), value in counters.items():
+            template = dict(labels).get('template')
+            if template not in stats:
+                continue
+            if name == 'iktomi_template_self_seconds_total':
+                stats[template]['self_time'] = value
+            elif name == 'iktomi_template_output_chars_total':
+                stats[template]['size'] = value
+        return list(stats.values())
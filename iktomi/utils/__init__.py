@@ -3,6 +3,10 @@ import six
 
 from xml.sax import saxutils
 import weakref, re, sys
+try:
+    from collections.abc import Mapping
+except ImportError: # pragma: no cover, python 2
+    from collections import Mapping
 
 from iktomi.utils.i18n import M_, N_ # deprecated, import from iktomi.utils.i18n
 
@@ -72,6 +76,37 @@ class cached_class_property(object):
         return result
 
 
+class ChainMapping(Mapping):
+    '''Read-only view of several mappings, the first mapping containing
+    a key wins. Mappings are not copied.'''
+
+    def __init__(self, *maps):
+        self.maps = maps
+
+    def __getitem__(self, key):
+        for mapping in self.maps:
+            if key in mapping:
+                return mapping[key]
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        for mapping in self.maps:
+            if key in mapping:
+                return True
+        return False
+
+    def __iter__(self):
+        seen = set()
+        for mapping in self.maps:
+            for key in mapping:
+                if key not in seen:
+                    seen.add(key)
+                    yield key
+
+    def __len__(self):
+        return len(set().union(*self.maps))
+
+
 # http://www.w3.org/TR/REC-xml/#NT-Char
 # Char ::= #x9 | #xA | #xD | [#x20-#xD7FF] | [#xE000-#xFFFD] | 
 #          [#x10000- #x10FFFF]
@@ -1,6 +1,12 @@
 # -*- coding: utf-8 -*-
+import six
+import hashlib
+import weakref
+import threading
+from types import ModuleType
+from collections import OrderedDict
 from six.moves.urllib.parse import urlsplit
-from lxml import html
+from lxml import html, etree
 from lxml.html import clean
 # XXX move to iktomi.cms?
 
@@ -31,6 +37,10 @@ class Cleaner(clean.Cleaner):
                     'var', 'a', 'bdo', 'br', 'map', 'object',
                     'q', 'span', 'sub', 'sup']
     split_paragraphs_by_br = True
+    # Apply link, class and empty tag rules in one tree walk each instead of
+    # a separate query per rule. Output is the same, but large documents are
+    # processed faster.
+    single_pass = False
 
     def __init__(self, *args, **kwargs):
         clean.Cleaner.__init__(self, *args, **kwargs)
@@ -76,14 +86,16 @@ class Cleaner(clean.Cleaner):
             # remember if first paragraph created from text
             first_par = True
 
+        # index of current child, tracked instead of doc.index(child) calls
+        # which are linear
+        i = 0
         for child in doc.getchildren():
-            i = doc.index(child)
-
             if child.tag == 'br' and 'br' in self.tags_to_wrap:
                 if (child.tail or "").strip():
                     par = self.get_wrapper_tag()
                     doc.insert(i, par)
                     par.text = child.tail
+                    i += 1
                 doc.remove(child)
                 continue
 
@@ -93,15 +105,20 @@ class Cleaner(clean.Cleaner):
                 par.text = child.tail
                 child.tail = None
                 doc.insert(i+1, par)
+                i += 2
                 continue
 
             if child.tag in self.tags_to_wrap:
                 if par is None:
                     par = self.get_wrapper_tag()
                     doc.insert(i, par)
+                    i += 1
+                # moving child to paragraph shifts next ones
                 par.append(child)
             else:
-                if first_par and i == 0:
+                i += 1
+                if first_par and i == 1:
+                    # paragraph created from text
                     continue
                 par = None
 
@@ -123,7 +140,7 @@ class Cleaner(clean.Cleaner):
 
     def remove_brs_from_pars(self, doc):
         def split_by_br(par):
-            br = par.find('.//br')
+            br = next(par.iter('br'), None)
             if br is not None:
                 next_par = html.Element('p')
                 par.addnext(next_par)
@@ -136,48 +153,96 @@ class Cleaner(clean.Cleaner):
                     nxt = br.getnext()
                 br.drop_tag()
                 split_by_br(next_par)
-        for p in doc.findall('.//p'):
+        for p in list(doc.iterdescendants('p')):
             split_by_br(p)
 
-    def extra_clean(self, doc):
-        for el in doc.xpath('//*[@href]'):
-            scheme, netloc, path, query, fragment = urlsplit(el.attrib['href'])
-            if scheme and scheme not in self.allowed_protocols:
-                el.drop_tag()
+    def _filter_classes(self, el):
+        classes = filter(None, el.attrib['class'].split())
+        if el.tag in self.allow_classes:
+            allowed = self.allow_classes[el.tag]
+            condition = allowed if callable(allowed) else \
+                    (lambda cls: cls in allowed)
+            classes = filter(condition, classes)
+        else:
+            classes = []
 
-        for attr in self.attr_val_is_uri:
-            if attr == 'href':
+        if classes:
+            el.attrib['class'] = ' '.join(classes)
+        else:
+            el.attrib.pop('class')
+
+    def _uri_fails(self, attr, value):
+        scheme, netloc, path, query, fragment = urlsplit(value)
+        if scheme and scheme not in self.allowed_protocols:
+            return True
+        return attr != 'href' and not self.allow_external_src and \
+                bool(netloc)
+
+    def clean_elements(self, doc):
+        '''Applies protocol, link and class rules in one tree walk'''
+        uri_attrs = [attr for attr in self.attr_val_is_uri if attr != 'href']
+        filter_classes = self.allow_classes is not None
+        # iterating over elements is much cheaper than XPath queries
+        for el in list(doc.iter(etree.Element)):
+            attrib = el.attrib
+            if not attrib:
+                if self.a_without_href and el.tag == 'a':
+                    el.drop_tag()
+                continue
+            if 'href' in attrib and self._uri_fails('href', attrib['href']):
+                el.drop_tag()
                 continue
-            for el in doc.xpath('//*[@'+attr+']'):
-                scheme, netloc, path, query, fragment = urlsplit(el.attrib[attr])
-                scheme_fail = scheme and scheme not in self.allowed_protocols
-                netloc_fail = not self.allow_external_src and netloc
-                if scheme_fail or netloc_fail:
+            dropped = False
+            for attr in uri_attrs:
+                if attr in attrib and self._uri_fails(attr, attrib[attr]):
                     if attr == 'src':
                         el.drop_tag()
-                    else:
-                        el.attrib.pop(attr)
-
-        if self.a_without_href:
-            for link in doc.xpath('//a[not(@href)]'):
-                link.drop_tag()
-
-        if self.allow_classes is not None:
-            for el in doc.xpath('//*[@class]'):
-                classes = filter(None, el.attrib['class'].split())
-                if el.tag in self.allow_classes:
-                    allowed = self.allow_classes[el.tag]
-                    condition = allowed if callable(allowed) else \
-                            (lambda cls: cls in allowed)
-                    classes = filter(condition, classes)
-                else:
-                    classes = []
-
-                if classes:
-                    el.attrib['class'] = ' '.join(classes)
-                else:
-                    el.attrib.pop('class')
+                        dropped = True
+                        break
+                    attrib.pop(attr)
+            if dropped:
+                continue
+            if self.a_without_href and el.tag == 'a' and \
+                    'href' not in attrib:
+                el.drop_tag()
+                continue
+            if filter_classes and 'class' in attrib:
+                self._filter_classes(el)
+
+    def drop_empty_elements(self, doc):
+        '''Drops empty elements listed in `drop_empty_tags` in one tree
+        walk'''
+        if not self.drop_empty_tags:
+            return
+        for el in list(doc.iter(*self.drop_empty_tags)):
+            if not el.attrib and self.is_element_empty(el):
+                el.drop_tree()
+
+    def extra_clean(self, doc):
+        if self.single_pass:
+            self.clean_elements(doc)
+        else:
+            for el in doc.xpath('//*[@href]'):
+                if self._uri_fails('href', el.attrib['href']):
+                    el.drop_tag()
+
+            for attr in self.attr_val_is_uri:
+                if attr == 'href':
+                    continue
+                for el in doc.xpath('//*[@'+attr+']'):
+                    if self._uri_fails(attr, el.attrib[attr]):
+                        if attr == 'src':
+                            el.drop_tag()
+                        else:
+                            el.attrib.pop(attr)
+
+            if self.a_without_href:
+                for link in doc.xpath('//a[not(@href)]'):
+                    link.drop_tag()
 
+            if self.allow_classes is not None:
+                for el in doc.xpath('//*[@class]'):
+                    self._filter_classes(el)
 
         for callback in self.dom_callbacks:
             callback(doc)
@@ -188,14 +253,161 @@ class Cleaner(clean.Cleaner):
         if self.split_paragraphs_by_br:
             self.remove_brs_from_pars(doc)
 
-        for tag in self.drop_empty_tags:
-            for el in doc.xpath('//'+tag):
-                if not el.attrib and self.is_element_empty(el):
-                    el.drop_tree()
+        if self.single_pass:
+            self.drop_empty_elements(doc)
+        else:
+            for tag in self.drop_empty_tags:
+                for el in doc.xpath('//'+tag):
+                    if not el.attrib and self.is_element_empty(el):
+                        el.drop_tree()
 
 
-def sanitize(value, **kwargs):
+def clean_html(value, cleaner):
+    '''Returns HTML fragment `value` cleaned by `cleaner`'''
     doc = html.fragment_fromstring(value, create_parent=True)
-    Cleaner(**kwargs)(doc)
+    cleaner(doc)
     clean = html.tostring(doc, encoding='utf-8').decode('utf-8')
     return clean.split('>', 1)[1].rsplit('<', 1)[0]
+
+
+def _fingerprint_value(value, refs):
+    # Objects identified by `id()` are appended to `refs`
+    if isinstance(value, dict):
+        items = sorted(_fingerprint_value(key, refs) + ':' +
+                       _fingerprint_value(item, refs)
+                       for key, item in value.items())
+        return '{' + ','.join(items) + '}'
+    if isinstance(value, (set, frozenset)):
+        return '{' + ','.join(sorted(_fingerprint_value(item, refs)
+                                     for item in value)) + '}'
+    if isinstance(value, (list, tuple)):
+        return '[' + ','.join(_fingerprint_value(item, refs)
+                              for item in value) + ']'
+    if callable(value):
+        name = getattr(value, '__qualname__', getattr(value, '__name__', ''))
+        bound_to = getattr(value, '__self__', None)
+        if bound_to is not None and not isinstance(bound_to, ModuleType):
+            # bound methods depend on the state of their objects
+            refs.append(bound_to)
+            return 'id:{:x}.{}'.format(id(bound_to), name)
+        if not name or '<' in name or getattr(value, '__closure__', None):
+            # lambdas and closures can't be told apart by name, so they
+            # are identified within the process only
+            refs.append(value)
+            return 'id:{:x}'.format(id(value))
+        return '{}.{}'.format(value.__module__, name)
+    return repr(value)
+
+
+class SanitizeCache(object):
+    '''
+    Cache of cleaned HTML keyed by hash of the input and cleaner options,
+    so unchanged markup is not parsed and cleaned again::
+
+        cache = SanitizeCache(storage=MemcachedStorage(cfg.MEMCACHE))
+        clean = cache.clean(value, cleaner)
+
+    Results are kept in in-process LRU tier of `local_size` items and in
+    `iktomi.storage.Storage` backend if `storage` is given. Entries never
+    become stale, as changed input or options give a new key. Options
+    given as lambdas, closures or bound methods are identified by `id()`,
+    so results of such cleaners are kept in process only, along with
+    references to these objects (their ids can't be reused while the
+    results are cached). Change `version` when named callbacks or lxml
+    version change.
+    '''
+
+    key_prefix = 'html:'
+    #: Number of results kept in process
+    local_size = 256
+    #: Seconds to keep results in storage, 0 for no expiration
+    ttl = 0
+    version = '1'
+
+    def __init__(self, storage=None, local_size=None, ttl=None,
+                 key_prefix=None, version=None):
+        self.storage = storage
+        if local_size is not None:
+            self.local_size = local_size
+        if ttl is not None:
+            self.ttl = ttl
+        if key_prefix is not None:
+            self.key_prefix = key_prefix
+        if version is not None:
+            self.version = version
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+        self._fingerprints = weakref.WeakKeyDictionary()
+
+    def _fingerprint(self, cleaner):
+        # Returns fingerprint and objects identified by `id()` in it
+        memo = self._fingerprints.get(cleaner)
+        if memo is None:
+            refs = []
+            parts = [self.version,
+                     _fingerprint_value(cleaner.__class__, refs),
+                     _fingerprint_value(vars(cleaner), refs)]
+            digest = hashlib.sha1(u'\n'.join(parts).encode('utf-8'))
+            # the cleaner itself is not kept in the memo, so it can be
+            # collected
+            memo = (digest.hexdigest(),
+                    tuple(ref for ref in refs if ref is not cleaner),
+                    any(ref is cleaner for ref in refs))
+            with self._lock:
+                self._fingerprints[cleaner] = memo
+        fingerprint, refs, self_ref = memo
+        return fingerprint, (refs + (cleaner,) if self_ref else refs)
+
+    def fingerprint(self, cleaner):
+        '''Returns a digest of cleaner class and options'''
+        return self._fingerprint(cleaner)[0]
+
+    def _key(self, value, fingerprint):
+        digest = hashlib.sha1(fingerprint.encode('ascii'))
+        digest.update(six.text_type(value).encode('utf-8'))
+        return self.key_prefix + digest.hexdigest()
+
+    def key(self, value, cleaner):
+        return self._key(value, self.fingerprint(cleaner))
+
+    def _get_local(self, key):
+        with self._lock:
+            item = self._local.pop(key, None)
+            if item is None:
+                return None
+            self._local[key] = item
+            return item[0]
+
+    def _set_local(self, key, clean, refs=()):
+        with self._lock:
+            self._local[key] = (clean, refs)
+            while len(self._local) > self.local_size:
+                self._local.popitem(last=False)
+
+    def clean(self, value, cleaner):
+        '''Returns HTML fragment `value` cleaned by `cleaner`, from cache if
+        possible'''
+        fingerprint, refs = self._fingerprint(cleaner)
+        key = self._key(value, fingerprint)
+        clean = self._get_local(key)
+        if clean is not None:
+            return clean
+        # Keys with ids are meaningless in other processes
+        storage = self.storage if not refs else None
+        if storage is not None:
+            clean = storage.get(key)
+            if clean is not None:
+                self._set_local(key, clean)
+                return clean
+        clean = clean_html(value, cleaner)
+        self._set_local(key, clean, refs)
+        if storage is not None:
+            storage.set(key, clean, self.ttl)
+        return clean
+
+
+def sanitize(value, cache=None, **kwargs):
+    cleaner = Cleaner(**kwargs)
+    if cache is not None:
+        return cache.clean(value, cleaner)
+    return clean_html(value, cleaner)
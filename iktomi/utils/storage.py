@@ -3,10 +3,19 @@
 Versioned storage, a classes for `env` and `data` objects.
 '''
 
+try:
+    from collections.abc import Mapping
+except ImportError: # pragma: no cover, python 2
+    from collections import Mapping
+
+
 class StorageFrame(object):
 
     '''A single frame in the storage'''
 
+    #: Names of service attributes not included in `as_dict`
+    _hidden_attrs = frozenset(['_parent_storage', '_root_storage'])
+
     def __init__(self, _parent_storage=None, **kwargs):
         self._parent_storage = _parent_storage
         self.__dict__.update(kwargs)
@@ -14,12 +23,54 @@ class StorageFrame(object):
     def as_dict(self):
         d = dict(self._parent_storage.as_dict() if self._parent_storage else {},
                  **self.__dict__)
-        # XXX delete _parent_storage?
-        del d['_parent_storage']
-        if '_root_storage' in d:
-            del d['_root_storage']
+        for name in self._hidden_attrs:
+            d.pop(name, None)
         return d
 
+
+class StorageMapping(Mapping):
+    '''Read-only view of `VersionedStorage` attributes (the same as
+    returned by `as_dict`) without copying them'''
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    def _frames(self):
+        frame = self.storage._storage
+        while frame is not None:
+            yield frame
+            frame = frame._parent_storage
+
+    def __getitem__(self, key):
+        frame = self.storage._storage
+        while frame is not None:
+            attrs = frame.__dict__
+            if key in attrs and key not in frame._hidden_attrs:
+                return attrs[key]
+            frame = attrs['_parent_storage']
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        frame = self.storage._storage
+        while frame is not None:
+            attrs = frame.__dict__
+            if key in attrs and key not in frame._hidden_attrs:
+                return True
+            frame = attrs['_parent_storage']
+        return False
+
+    def __iter__(self):
+        seen = set()
+        for frame in self._frames():
+            for key in frame.__dict__:
+                if key not in seen and key not in frame._hidden_attrs:
+                    seen.add(key)
+                    yield key
+
+    def __len__(self):
+        return sum(1 for key in self)
+
+
 class VersionedStorage(object):
     '''Storage implements state managing interface, allowing to safely set
     attributes for `env` and `data` objects.
@@ -69,6 +120,10 @@ class VersionedStorage(object):
         '''Returns attributes of storage as dict'''
         return self._storage.as_dict()
 
+    def as_mapping(self):
+        '''Returns read-only mapping view of storage attributes'''
+        return StorageMapping(self)
+
 
 class storage_property_base(object):
 
@@ -5,3 +5,7 @@ from .filters import *
 from .reverse import *
 from .url import *
 from .testing import *
+from .timing import *
+from .monitoring import *
+from .cache import *
+from .compress import *
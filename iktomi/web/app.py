@@ -1,17 +1,24 @@
 # -*- coding: utf-8 -*-
 
-__all__ = ['Application', 'AppEnvironment']
+__all__ = ['Application', 'AppEnvironment', 'DeferredExecutor']
 
+import os
+import time
 import logging
+import functools
 import re
+import threading
+from six.moves import queue
 from iktomi.utils.storage import VersionedStorage, StorageFrame, storage_property
 from webob.exc import HTTPException, HTTPInternalServerError, \
                       HTTPNotFound
 from webob import Request
 from .route_state import RouteState
 from .reverse import Reverse
+from .timing import RequestTiming, null_timing
 
 logger = logging.getLogger(__name__)
+timing_logger = logging.getLogger(__name__ + '.timing')
 
 ip_number = '(\d|[1-9]\d|1\d{2}|2[0-4]\d|25[0-5])'
 dns_letter = '[a-z\d]([a-z\d\-]*[a-z\d])?'
@@ -44,15 +51,34 @@ class AppEnvironment(StorageFrame):
                 return db_maker()
     '''
 
+    #: :class:`RequestTiming<iktomi.web.timing.RequestTiming>` object if
+    #: timing is enabled in `Application`
+    timing = null_timing
+
+    _hidden_attrs = StorageFrame._hidden_attrs | frozenset(['_deferred'])
+
     def __init__(self, request=None, root=None, _parent_storage=None, **kwargs):
         StorageFrame.__init__(self, _parent_storage=_parent_storage, **kwargs)
         self.request = request
+        self._deferred = []
         if request:
             self.root = root.bind_to_env(self._root_storage)
             self._route_state = RouteState(request)
         else:
             self.root = root
 
+    def defer(self, func, *args, **kwargs):
+        '''
+        Schedules `func(*args, **kwargs)` call after the response is sent
+        to the client::
+
+            env.defer(search_index.update, doc.id)
+
+        Tasks are called in order they are scheduled, even if routing branch
+        they are scheduled in does not match.
+        '''
+        self._deferred.append((func, args, kwargs))
+
     def gettext(self, message):
         return message
 
@@ -70,19 +96,117 @@ class AppEnvironment(StorageFrame):
         return VersionedStorage(cls, *args, **kwargs)
 
 
+class DeferredExecutor(object):
+    '''
+    A bounded pool of daemon threads calling deferred tasks.
+
+    Threads are started on first use in each process, so the executor can be
+    created before the server forks.'''
+
+    def __init__(self, workers=1, queue_size=100):
+        self.workers = workers
+        self.queue = queue.Queue(queue_size)
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def depth(self):
+        '''Number of tasks waiting in the queue'''
+        return self.queue.qsize()
+
+    def _start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # A queue inherited from parent process may contain tasks
+            # belonging to the parent
+            self.queue = queue.Queue(self.queue.maxsize)
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._worker)
+                thread.daemon = True
+                thread.start()
+            self._pid = os.getpid()
+
+    def _worker(self):
+        while True:
+            task = self.queue.get()
+            try:
+                task()
+            finally:
+                self.queue.task_done()
+
+    def submit(self, task):
+        '''Puts callable into the queue. Returns False if the queue is full'''
+        if self._pid != os.getpid():
+            self._start()
+        try:
+            self.queue.put_nowait(task)
+        except queue.Full:
+            return False
+        return True
+
+
+class _DeferredAppIter(object):
+    '''Calls `callback` after WSGI server closes the response iterable'''
+
+    def __init__(self, app_iter, callback):
+        self.app_iter = app_iter
+        self.callback = callback
+
+    def __iter__(self):
+        return iter(self.app_iter)
+
+    def close(self):
+        try:
+            if hasattr(self.app_iter, 'close'):
+                self.app_iter.close()
+        finally:
+            self.callback()
+
+
 class Application(object):
     '''
     WSGI application made from `iktomi.web.WebHandler' instance::
 
         wsgi_app = Application(app, env_class=FrontEnvironment)
+
+    Tasks scheduled with `env.defer()` are called after the response is sent,
+    in the same thread by default. Set `deferred_executor` to
+    :class:`DeferredExecutor` instance to call them in background threads.
+
+    Set `timing_stats` to :class:`TimingStats<iktomi.web.timing.TimingStats>`
+    instance to measure request processing phases: host validation,
+    request object construction, routing, template rendering, handler code
+    and response serialization. Timing is added to `Server-Timing` header,
+    logged to `iktomi.web.app.timing` logger and collected in
+    `timing_stats` histograms.
+
+    Set `metrics` to :class:`Metrics<iktomi.web.monitoring.Metrics>` instance
+    to count requests per location and status, in-flight requests and
+    request latency histograms. This enables timing too.
     '''
 
     env_class = AppEnvironment
+    #: :class:`DeferredExecutor` instance for deferred tasks or `None`
+    deferred_executor = None
+    #: :class:`TimingStats<iktomi.web.timing.TimingStats>` instance or `None`
+    timing_stats = None
+    #: :class:`Metrics<iktomi.web.monitoring.Metrics>` instance or `None`
+    metrics = None
+    #: Whether to add `Server-Timing` header if timing is enabled
+    server_timing_header = True
 
-    def __init__(self, handler, env_class=None):
+    def __init__(self, handler, env_class=None, deferred_executor=None,
+                 timing_stats=None, metrics=None):
         self.handler = handler
         if env_class is not None:
             self.env_class = env_class
+        if deferred_executor is not None:
+            self.deferred_executor = deferred_executor
+        if timing_stats is not None:
+            self.timing_stats = timing_stats
+        if metrics is not None:
+            self.metrics = metrics
         self.root = Reverse.from_handler(handler)
 
     def handle_error(self, env):
@@ -113,23 +237,95 @@ class Application(object):
             response = HTTPInternalServerError()
         return response
 
+    def call_deferred(self, env, func, args, kwargs):
+        '''
+        Calls deferred task, unhandled exceptions are passed to
+        `handle_error` method.'''
+        try:
+            func(*args, **kwargs)
+        except Exception:
+            self.handle_error(env)
+
+    def run_deferred(self, env):
+        '''Calls or submits to `deferred_executor` tasks scheduled
+        with `env.defer()`.'''
+        executor = self.deferred_executor
+        for func, args, kwargs in env._deferred:
+            if executor is not None and executor.submit(
+                    functools.partial(self.call_deferred,
+                                      env, func, args, kwargs)):
+                continue
+            if executor is not None:
+                logger.warning('Deferred tasks queue is full, calling %r '
+                               'in request thread', func)
+            self.call_deferred(env, func, args, kwargs)
+        del env._deferred[:]
+
+    def log_timing(self, env, status, timing):
+        '''Logs request timing and adds it to `timing_stats`.'''
+        self.timing_stats.observe(timing)
+        timing_logger.info('%s %s %s %s', env.request.method,
+                           timing.location or '-', status, timing,
+                           extra={'timing': dict(timing.phases),
+                                  'location': timing.location,
+                                  'status': status})
+
     def __call__(self, environ, start_response):
         '''
         WSGI interface method.
         Creates webob and iktomi wrappers and calls `handle` method.
         '''
+        timed = self.timing_stats is not None or self.metrics is not None
+        timing = RequestTiming() if timed else null_timing
         # validating Host header to prevent problems with url parsing
-        if not is_host_valid(environ['HTTP_HOST']):
+        with timing.phase('host'):
+            host_valid = is_host_valid(environ['HTTP_HOST'])
+        if not host_valid:
             logger.warning('Unusual header "Host: {}", return HTTPNotFound'\
                            .format(environ['HTTP_HOST']))
             return HTTPNotFound()(environ, start_response)
-        request = Request(environ, charset='utf-8')
-        env = VersionedStorage(self.env_class, request=request, root=self.root)
-        data = VersionedStorage()
-        response = self.handle(env, data)
+        with timing.phase('request'):
+            request = Request(environ, charset='utf-8')
+            env = VersionedStorage(self.env_class, request=request,
+                                   root=self.root)
+            data = VersionedStorage()
+        if timed:
+            env.timing = timing
+        if self.metrics is not None:
+            self.metrics.add('iktomi_requests_in_progress', 1)
         try:
-            result = response(environ, start_response)
-        except Exception:
-            self.handle_error(env)
-            result = HTTPInternalServerError()(environ, start_response)
+            with timing.handling():
+                response = self.handle(env, data)
+        finally:
+            if self.metrics is not None:
+                self.metrics.add('iktomi_requests_in_progress', -1)
+
+        status = []
+        if timed:
+            def timed_start_response(status_, headers, exc_info=None):
+                status[:] = [status_.split(' ', 1)[0]]
+                if self.server_timing_header:
+                    headers = list(headers) + [
+                            ('Server-Timing', timing.server_timing())]
+                return start_response(status_, headers, exc_info)
+        else:
+            timed_start_response = start_response
+
+        with timing.phase('response'):
+            try:
+                result = response(environ, timed_start_response)
+            except Exception:
+                self.handle_error(env)
+                result = HTTPInternalServerError()(environ,
+                                                   timed_start_response)
+        if timed:
+            timing.add('total', time.time() - timing.started)
+            status = status[0] if status else '-'
+            if self.timing_stats is not None:
+                self.log_timing(env, status, timing)
+            if self.metrics is not None:
+                self.metrics.observe_request(timing, status)
+        if env._deferred:
+            result = _DeferredAppIter(result,
+                                      functools.partial(self.run_deferred, env))
         return result
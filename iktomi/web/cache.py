@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+'''
+Response caching filters.
+'''
+
+__all__ = ['cache_page', 'coalesce', 'conditional']
+
+import os
+import time
+import hashlib
+import logging
+import binascii
+import threading
+from webob import Response
+from webob.exc import HTTPNotModified
+from webob.datetime_utils import UTC
+from webob.etag import NoETag
+from .core import WebHandler
+
+logger = logging.getLogger(__name__)
+
+
+def request_digest(env, vary=(), vary_cookies=(), *extra):
+    '''Returns a digest of request host, path, query string, values of
+    `vary` headers and `vary_cookies` cookies and `extra` strings'''
+    request = env.request
+    query = '&'.join(sorted(request.query_string.split('&')))
+    parts = list(extra) + [request.host, request.path, query]
+    parts += [request.headers.get(name, '') for name in vary]
+    parts += [request.cookies.get(name, '') for name in vary_cookies]
+    return hashlib.md5(u'\n'.join(parts).encode('utf-8')).hexdigest()
+
+
+def is_shareable(response):
+    '''Whether response can be served to other clients'''
+    return response.status_int == 200 and \
+            'Set-Cookie' not in response.headers
+
+
+def _response(status, headerlist, body):
+    return Response(body=body, status=status, headerlist=list(headerlist))
+
+
+class cache_page(WebHandler):
+    '''
+    Caches responses of the next handler in `iktomi.storage.Storage`
+    backend for `ttl` seconds::
+
+        page_cache = web.cache_page(60, storage=cache, vary=['Accept'])
+
+    Query strings and header values are chosen by clients, so `storage`
+    must expire entries and be bounded in size (like memcached).
+    `LocalMemStorage` keeps entries forever and fits tests only.
+
+        web.match('/news/<int:id>', 'item') | page_cache | item
+
+    Cache key is built from current location name, request host, path and
+    query string, values of `vary` request headers and `vary_cookies`
+    cookies. Only successful `GET` and `HEAD` responses without cookies are
+    cached. Caching is skipped for authenticated users (when `env.user` is
+    set by :class:`CookieAuth<iktomi.auth.CookieAuth>`).
+
+    If `stale_ttl` is set, expired response is kept for `stale_ttl` more
+    seconds. The first request after expiration regenerates it while
+    concurrent requests are served with the stale copy.
+
+    All pages of a location are invalidated with::
+
+        page_cache.invalidate('news.item')
+    '''
+
+    key_prefix = 'page:'
+    #: Seconds to serve the expired response after `ttl`
+    stale_ttl = 0
+    #: Seconds to serve the stale response while it is being regenerated
+    revalidate_timeout = 30
+    methods = ('GET', 'HEAD')
+
+    def __init__(self, ttl, storage, vary=(), vary_cookies=(),
+                 stale_ttl=None, key_prefix=None):
+        self.ttl = ttl
+        self.storage = storage
+        self.vary = tuple(vary)
+        self.vary_cookies = tuple(vary_cookies)
+        if stale_ttl is not None:
+            self.stale_ttl = stale_ttl
+        if key_prefix is not None:
+            self.key_prefix = key_prefix
+
+    def _version_key(self, location):
+        return '{}version:{}'.format(self.key_prefix, location)
+
+    def location_version(self, location):
+        '''Returns current version of location, it is a part of cache key'''
+        key = self._version_key(location)
+        version = self.storage.get(key)
+        if version is None:
+            version = self.invalidate(location)
+        return version
+
+    def invalidate(self, location):
+        '''Drops cached pages of location with given name'''
+        version = binascii.hexlify(os.urandom(4)).decode('ascii')
+        self.storage.set(self._version_key(location), version)
+        return version
+
+    def cache_key(self, env):
+        location = env.current_location
+        digest = request_digest(env, self.vary, self.vary_cookies,
+                                self.location_version(location))
+        return '{}{}:{}'.format(self.key_prefix, location, digest)
+
+    def should_cache(self, env):
+        return env.request.method in self.methods and \
+                getattr(env, 'user', None) is None
+
+    def is_cacheable(self, response):
+        return is_shareable(response)
+
+    def store(self, key, entry):
+        expires = entry[0]
+        ttl = int(expires - time.time()) + self.stale_ttl
+        if not self.storage.set(key, entry, max(ttl, 1)):
+            logger.warning('storage "%r" is unreachable', self.storage)
+
+    def cache_page(self, env, data):
+        if not self.should_cache(env):
+            return self.next_handler(env, data)
+        key = self.cache_key(env)
+        entry = self.storage.get(key)
+        now = time.time()
+        if entry is not None:
+            expires, status, headerlist, body = entry = tuple(entry)
+            if now < expires:
+                return _response(status, headerlist, body)
+            if now < expires + self.stale_ttl:
+                # Concurrent requests get the stale copy until this one
+                # regenerates the page
+                self.store(key, (now + self.revalidate_timeout,) + entry[1:])
+        response = self.next_handler(env, data)
+        if response is not None and self.is_cacheable(response):
+            self.store(key, (now + self.ttl, response.status,
+                             list(response.headerlist), response.body))
+        return response
+    __call__ = cache_page
+
+
+class _Flight(object):
+    '''Request being handled by the leader'''
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.entry = None
+
+
+class coalesce(WebHandler):
+    '''
+    Calls the next handler once for identical concurrent requests (same
+    host, path, query string, `vary` headers and `vary_cookies` cookies),
+    other requests wait for its response::
+
+        web.match('/', 'index') | web.coalesce(storage=cache) | \\
+                web.cache_page(60, storage=cache) | index
+
+    Requests are coalesced within a process, and across processes too if
+    `storage` supporting `add` method and expiration is given (a lock left
+    by killed process expires after `timeout`). Waiting requests call the
+    next handler themselves after `timeout` seconds or if the response can
+    not be shared (it sets cookies or is not successful). Requests of
+    authenticated users are not coalesced.
+    '''
+
+    key_prefix = 'coalesce:'
+    #: Seconds to wait for the response of identical request
+    timeout = 10
+    #: Seconds to check storage for the response of another process
+    poll_interval = 0.05
+    methods = ('GET', 'HEAD')
+
+    def __init__(self, storage=None, vary=(), vary_cookies=(), timeout=None,
+                 key_prefix=None):
+        self.storage = storage
+        self.vary = tuple(vary)
+        self.vary_cookies = tuple(vary_cookies)
+        if timeout is not None:
+            self.timeout = timeout
+        if key_prefix is not None:
+            self.key_prefix = key_prefix
+        # shared by copies of the handler
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def should_coalesce(self, env):
+        return env.request.method in self.methods and \
+                getattr(env, 'user', None) is None
+
+    def coalesce(self, env, data):
+        if not self.should_coalesce(env):
+            return self.next_handler(env, data)
+        key = self.key_prefix + request_digest(env, self.vary,
+                                               self.vary_cookies)
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            if flight.done.wait(self.timeout) and flight.entry is not None:
+                return _response(*flight.entry)
+            return self.next_handler(env, data)
+        try:
+            response = self._lead(env, data, key)
+            if response is not None and is_shareable(response):
+                flight.entry = (response.status, list(response.headerlist),
+                                response.body)
+            return response
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+    __call__ = coalesce
+
+    def _lead(self, env, data, key):
+        if self.storage is None:
+            return self.next_handler(env, data)
+        lock_key = key + ':lock'
+        result_key = key + ':result'
+        if not self.storage.add(lock_key, 1, int(self.timeout) + 1):
+            entry = self._wait(lock_key, result_key)
+            if entry is not None:
+                return _response(*entry)
+            return self.next_handler(env, data)
+        try:
+            # drop the result of previous identical request
+            self.storage.delete(result_key)
+            response = self.next_handler(env, data)
+            if response is not None and is_shareable(response):
+                entry = (response.status, list(response.headerlist),
+                         response.body)
+                self.storage.set(result_key, entry, int(self.timeout) + 1)
+            return response
+        finally:
+            self.storage.delete(lock_key)
+
+    def _wait(self, lock_key, result_key):
+        deadline = time.time() + self.timeout
+        while time.time() < deadline:
+            locked = self.storage.get(lock_key) is not None
+            entry = self.storage.get(result_key)
+            if entry is not None or not locked:
+                return entry
+            time.sleep(self.poll_interval)
+        logger.warning('Timeout waiting for %s', lock_key)
+        return None
+
+
+class conditional(WebHandler):
+    '''
+    Answers conditional `GET` and `HEAD` requests with `304 Not Modified`
+    before the next handler is called. Validators are computed by
+    `etag_func(env, data)` and `last_modified_func(env, data)`, and should be
+    much cheaper than the handler itself::
+
+        web.match('/<int:id>', 'item') | web.conditional(
+            last_modified_func=lambda env, data: \\
+                    env.db.query(News.updated_at).filter_by(id=data.id)\\
+                                                 .scalar()) | item
+
+    See :mod:`iktomi.db.sqla.validators` for helpers making such functions.
+    Functions may return `None` if the validator is unknown. Validators are
+    added to successful responses of the next handler.
+    '''
+
+    methods = ('GET', 'HEAD')
+
+    def __init__(self, etag_func=None, last_modified_func=None):
+        self.etag_func = etag_func
+        self.last_modified_func = last_modified_func
+
+    def validators(self, env, data):
+        '''Returns a tuple of ETag and last modification datetime'''
+        etag = last_modified = None
+        if self.etag_func is not None:
+            etag = self.etag_func(env, data)
+            if etag is not None:
+                etag = u'{}'.format(etag)
+        if self.last_modified_func is not None:
+            last_modified = self.last_modified_func(env, data)
+            if last_modified is not None:
+                if last_modified.tzinfo is None:
+                    last_modified = last_modified.replace(tzinfo=UTC)
+                # HTTP dates have seconds precision
+                last_modified = last_modified.replace(microsecond=0)
+        return etag, last_modified
+
+    def is_not_modified(self, request, etag, last_modified):
+        # If-Modified-Since is ignored if If-None-Match is present
+        if request.if_none_match is not NoETag:
+            return etag is not None and etag in request.if_none_match
+        if_modified_since = request.if_modified_since
+        return last_modified is not None and \
+                if_modified_since is not None and \
+                last_modified <= if_modified_since
+
+    def set_validators(self, response, etag, last_modified):
+        if etag is not None:
+            response.etag = etag
+        if last_modified is not None:
+            response.last_modified = last_modified
+
+    def conditional(self, env, data):
+        if env.request.method not in self.methods:
+            return self.next_handler(env, data)
+        etag, last_modified = self.validators(env, data)
+        if self.is_not_modified(env.request, etag, last_modified):
+            response = HTTPNotModified()
+            self.set_validators(response, etag, last_modified)
+            return response
+        response = self.next_handler(env, data)
+        if response is not None and response.status_int == 200:
+            self.set_validators(response, etag, last_modified)
+        return response
+    __call__ = conditional
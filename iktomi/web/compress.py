@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+'''
+Response compression filter.
+'''
+
+__all__ = ['compress']
+
+import zlib
+from .core import WebHandler
+try:
+    import brotli
+except ImportError: # pragma: no cover
+    # br encoding is available only if brotli package is installed
+    brotli = None
+
+
+class _BrotliCompressor(object):
+    '''Wraps brotli compressor with zlib compressor interface'''
+
+    def __init__(self, quality):
+        self.compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self.compressor.process(data)
+
+    def flush(self, mode=zlib.Z_FINISH):
+        if mode == zlib.Z_FINISH:
+            return self.compressor.finish()
+        return self.compressor.flush()
+
+
+class _CompressedIter(object):
+    '''
+    Compresses `app_iter` while the server iterates over it. Streamed
+    (not list or tuple) bodies are flushed after each chunk, so every part
+    reaches the client as soon as it is produced. `close` closes `app_iter`
+    even if iteration has never started.
+    '''
+
+    def __init__(self, app_iter, compressor):
+        self.app_iter = app_iter
+        self.compressor = compressor
+        self.sync_flush = not isinstance(app_iter, (list, tuple))
+
+    def __iter__(self):
+        compressor = self.compressor
+        for chunk in self.app_iter:
+            data = compressor.compress(chunk)
+            if self.sync_flush:
+                data += compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        yield compressor.flush()
+
+    def close(self):
+        if hasattr(self.app_iter, 'close'):
+            self.app_iter.close()
+
+
+def parse_accept_encoding(value):
+    '''Returns a dict mapping content codings to quality values'''
+    result = {}
+    for item in value.split(','):
+        parts = item.strip().split(';')
+        coding = parts[0].strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in parts[1:]:
+            name, _, param_value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    quality = float(param_value)
+                except ValueError:
+                    quality = 0.0
+        result[coding] = quality
+    return result
+
+
+class compress(WebHandler):
+    '''
+    Compresses responses of the next handler with the best encoding
+    accepted by the client (`br` if brotli package is installed, `gzip` or
+    `deflate`)::
+
+        wsgi_app = Application(web.compress(min_size=500) | app)
+
+    Response body is compressed incrementally while the server iterates
+    over it. Responses shorter than `min_size` bytes, already encoded
+    responses, partial content responses and responses of already
+    compressed content types (images, archives etc) are left as is.
+    '''
+
+    #: Encodings in order of server preference
+    encodings = ('br', 'gzip', 'deflate')
+    #: Minimal `Content-Length` to compress, responses of unknown length are
+    #: always compressed
+    min_size = 1024
+    #: zlib compression level for gzip and deflate (1-9)
+    level = 6
+    #: zlib memory usage level (1-9)
+    mem_level = 8
+    #: brotli quality (0-11)
+    brotli_quality = 4
+    #: Content types (or prefixes ending with `/`) that are not compressed.
+    #: Types with `+xml` or `+json` suffix (like `image/svg+xml`) are
+    #: compressed anyway.
+    skip_types = ('image/', 'video/', 'audio/', 'font/woff', 'font/woff2',
+                  'application/zip', 'application/gzip',
+                  'application/x-gzip', 'application/x-bzip2',
+                  'application/x-xz', 'application/x-7z-compressed',
+                  'application/x-rar-compressed', 'application/pdf',
+                  'application/octet-stream')
+
+    def __init__(self, encodings=None, min_size=None, level=None,
+                 mem_level=None, brotli_quality=None):
+        if encodings is not None:
+            self.encodings = tuple(encodings)
+        if min_size is not None:
+            self.min_size = min_size
+        if level is not None:
+            self.level = level
+        if mem_level is not None:
+            self.mem_level = mem_level
+        if brotli_quality is not None:
+            self.brotli_quality = brotli_quality
+
+    def choose_encoding(self, request):
+        accepted = parse_accept_encoding(
+                request.headers.get('Accept-Encoding', ''))
+        for encoding in self.encodings:
+            if encoding == 'br' and brotli is None:
+                continue
+            quality = accepted.get(encoding, accepted.get('*', 0))
+            if quality > 0:
+                return encoding
+        return None
+
+    def is_compressible(self, response):
+        if response.status_int < 200 or \
+                response.status_int in (204, 206, 304):
+            return False
+        # Byte ranges refer to unencoded representation
+        if 'Content-Range' in response.headers:
+            return False
+        content_type = response.content_type
+        if not content_type or 'Content-Encoding' in response.headers:
+            return False
+        if content_type.endswith(('+xml', '+json')):
+            return True
+        for skip_type in self.skip_types:
+            if skip_type.endswith('/') and content_type.startswith(skip_type):
+                return False
+            if content_type == skip_type:
+                return False
+        return True
+
+    def compressor(self, encoding):
+        if encoding == 'br':
+            return _BrotliCompressor(self.brotli_quality)
+        wbits = zlib.MAX_WBITS
+        if encoding == 'gzip':
+            wbits += 16
+        return zlib.compressobj(self.level, zlib.DEFLATED, wbits,
+                                self.mem_level)
+
+    def compress(self, env, data):
+        response = self.next_handler(env, data)
+        if response is None or not self.is_compressible(response):
+            return response
+        vary = tuple(response.vary or ())
+        if 'Accept-Encoding' not in vary:
+            response.vary = vary + ('Accept-Encoding',)
+        content_length = response.content_length
+        if content_length is not None and content_length < self.min_size:
+            return response
+        encoding = self.choose_encoding(env.request)
+        if encoding is None:
+            return response
+        response.app_iter = _CompressedIter(response.app_iter,
+                                            self.compressor(encoding))
+        response.content_length = None
+        response.content_encoding = encoding
+        # Representations with different encodings are not byte-identical
+        etag = response.headers.get('ETag')
+        if etag is not None and not etag.startswith('W/'):
+            response.headers['ETag'] = 'W/' + etag
+        return response
+    __call__ = compress
@@ -14,6 +14,7 @@ from .core import WebHandler, cases
 from . import Response
 from .url_templates import UrlTemplate
 from .reverse import Location
+from .timing import null_timing
 from iktomi.utils.deprecation import deprecated
 
 
@@ -57,6 +58,7 @@ class match(WebHandler):
         matched, kwargs = self.builder.match(env._route_state.path, env=env)
         if matched is not None:
             env.current_url_name = self.url_name
+            getattr(env, 'timing', null_timing).route_matched(env)
             update_data(data, kwargs)
             return self.next_handler(env, data)
         return None
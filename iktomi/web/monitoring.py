@@ -0,0 +1,431 @@
+# -*- coding: utf-8 -*-
+'''
+Application metrics in Prometheus text format.
+'''
+
+__all__ = ['Metrics', 'MeteredStorage', 'metrics']
+
+import os
+import time
+import json
+import errno
+import fcntl
+import weakref
+import logging
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+from webob import Response
+from iktomi.storage import Storage
+from .core import WebHandler
+from .timing import Histogram
+
+logger = logging.getLogger(__name__)
+
+
+class _Shard(object):
+    '''Metric values written by a single thread'''
+
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        # histogram value is a list of counts per bucket (the last one is
+        # +Inf bucket) followed by sum of observed values
+        self.histograms = {}
+
+
+class _ShardOwner(object):
+    '''Is kept in thread local storage, so it's released when the thread
+    exits'''
+
+
+def _key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        if value == float('inf'):
+            return '+Inf'
+        return repr(value)
+    return str(value)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = []
+    for name, value in labels:
+        value = u'{}'.format(value).replace('\\', '\\\\')\
+                                   .replace('"', '\\"')\
+                                   .replace('\n', '\\n')
+        escaped.append(u'{}="{}"'.format(name, value))
+    return u'{' + u','.join(escaped) + u'}'
+
+
+class Metrics(object):
+    '''
+    Registry of counters, gauges and histograms::
+
+        metrics = Metrics(path='/dev/shm/myproject-metrics')
+        wsgi_app = Application(app, metrics=metrics)
+
+    Each thread writes to its own shard, so no locks are taken on request
+    path. If `path` directory is given, each process periodically dumps
+    its values to `<path>/<pid>.json` (use tmpfs to keep it in memory),
+    and :class:`metrics` handler served by any of preforked workers
+    returns values aggregated over all of them.
+
+    Counters of exited processes are kept, gauges are dropped. Files of
+    exited processes are merged into `<path>/exited.json` when values are
+    collected. Shards of exited threads are merged into process values.
+    '''
+
+    exited_file = 'exited.json'
+
+    buckets = Histogram.buckets
+    #: Interval (in seconds) of dumping process values to `path`
+    flush_interval = 1
+
+    def __init__(self, path=None, buckets=None, flush_interval=None):
+        self.path = path
+        if buckets is not None:
+            self.buckets = tuple(sorted(buckets))
+        if flush_interval is not None:
+            self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def _start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # Inherited thread local storage is released after the lock,
+            # since callbacks of released shard owners acquire it too
+            inherited = self.__dict__.get('_local')
+            # shards inherited from parent process contain its values
+            self._local = threading.local()
+            # shard -> (weak reference to its owner, thread)
+            self._shards = {}
+            # values of exited threads
+            self._retired = _Shard()
+            if self.path is not None:
+                if not os.path.isdir(self.path):
+                    os.makedirs(self.path)
+                # left by exited process with the same PID
+                self._merge_exited(os.getpid())
+                thread = threading.Thread(target=self._flusher)
+                thread.daemon = True
+                thread.start()
+            self._pid = os.getpid()
+        # owners of inherited shards are released here, their shards are not
+        # registered anymore
+        del inherited
+
+    def _shard(self):
+        if self._pid != os.getpid():
+            self._start()
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = _Shard()
+            owner = self._local.owner = _ShardOwner()
+            callback = lambda ref, shard=shard: self._retire(shard)
+            with self._lock:
+                self._shards[shard] = (weakref.ref(owner, callback),
+                                       threading.current_thread())
+        return shard
+
+    def _retire(self, shard):
+        # Is called when the thread owning the shard exits
+        with self._lock:
+            self._retire_shard(shard)
+
+    def _retire_shard(self, shard):
+        if self._shards.pop(shard, None) is None:
+            # already retired or registry was reset in forked process
+            return
+        self._merge_shard(self._retired, shard)
+
+    def _retire_exited(self):
+        # Thread local storage may be released some time after the thread
+        # has exited (e.g. on Python 2)
+        for shard, (ref, thread) in list(self._shards.items()):
+            if not thread.is_alive():
+                self._retire_shard(shard)
+
+    def _merge_shard(self, target, shard):
+        for key, value in list(shard.counters.items()):
+            target.counters[key] = target.counters.get(key, 0) + value
+        for key, value in list(shard.gauges.items()):
+            target.gauges[key] = target.gauges.get(key, 0) + value
+        for key, value in list(shard.histograms.items()):
+            self._merge_histogram(target.histograms, key, value)
+
+    def inc(self, name, value=1, **labels):
+        '''Increments counter'''
+        counters = self._shard().counters
+        key = _key(name, labels)
+        counters[key] = counters.get(key, 0) + value
+
+    def add(self, name, delta, **labels):
+        '''Adds `delta` (may be negative) to gauge'''
+        gauges = self._shard().gauges
+        key = _key(name, labels)
+        gauges[key] = gauges.get(key, 0) + delta
+
+    def observe(self, name, value, **labels):
+        '''Adds value to histogram'''
+        histograms = self._shard().histograms
+        key = _key(name, labels)
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = [0] * (len(self.buckets) + 2)
+        histogram[bisect_left(self.buckets, value)] += 1
+        histogram[-1] += value
+
+    def observe_request(self, timing, status):
+        '''Adds metrics of request measured by
+        :class:`RequestTiming<iktomi.web.timing.RequestTiming>` object'''
+        location = timing.location or ''
+        self.inc('iktomi_requests_total', location=location, status=status)
+        self.observe('iktomi_request_duration_seconds',
+                     timing.phases.get('total', 0), location=location)
+        for phase, duration in timing.phases.items():
+            if phase != 'total':
+                self.observe('iktomi_request_phase_seconds', duration,
+                             phase=phase)
+
+    def snapshot(self):
+        '''Returns values of current process as a tuple of `counters`,
+        `gauges` and `histograms` dicts'''
+        if self._pid != os.getpid():
+            self._start()
+        result = _Shard()
+        with self._lock:
+            self._retire_exited()
+            # shards are not merged into retired values meanwhile
+            for shard in [self._retired] + list(self._shards):
+                self._merge_shard(result, shard)
+        return (defaultdict(int, result.counters),
+                defaultdict(int, result.gauges), result.histograms)
+
+    def _merge_histogram(self, histograms, key, value):
+        histogram = histograms.get(key)
+        if histogram is None:
+            histograms[key] = list(value)
+        else:
+            for i, count in enumerate(value):
+                histogram[i] += count
+
+    def _file_path(self, pid):
+        return os.path.join(self.path, '{}.json'.format(pid))
+
+    def _write(self, file_path, counters, gauges, histograms):
+        data = {'buckets': self.buckets}
+        for kind, values in [('counters', counters), ('gauges', gauges),
+                             ('histograms', histograms)]:
+            data[kind] = [[name, labels, value]
+                          for (name, labels), value in values.items()]
+        with open(file_path + '.tmp', 'w') as f:
+            json.dump(data, f)
+        os.rename(file_path + '.tmp', file_path)
+
+    def _read(self, file_path):
+        '''Returns values stored in the file as `_Shard` or `None` if the
+        file is missing or can't be used'''
+        try:
+            with open(file_path) as f:
+                data = json.load(f)
+        except IOError as exc:
+            if exc.errno != errno.ENOENT:
+                logger.warning('Failed to read metrics from %s', file_path)
+            return None
+        except ValueError:
+            logger.warning('Failed to read metrics from %s', file_path)
+            return None
+        if tuple(data['buckets']) != self.buckets:
+            return None
+        shard = _Shard()
+        for kind in ['counters', 'gauges', 'histograms']:
+            getattr(shard, kind).update(
+                ((name, tuple(map(tuple, labels))), value)
+                for name, labels, value in data[kind])
+        return shard
+
+    def flush(self):
+        '''Writes values of current process to `path` directory'''
+        counters, gauges, histograms = self.snapshot()
+        self._write(self._file_path(os.getpid()), counters, gauges,
+                    histograms)
+
+    def _flusher(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Failed to write metrics to %s', self.path)
+
+    def _merge_exited(self, pid):
+        '''Moves counters and histograms of exited process to
+        `exited_file`'''
+        file_path = self._file_path(pid)
+        if not os.path.exists(file_path):
+            return
+        exited_path = os.path.join(self.path, self.exited_file)
+        # other processes may merge the same file at the same time
+        with open(exited_path + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            values = self._read(file_path)
+            if values is not None:
+                exited = self._read(exited_path) or _Shard()
+                values.gauges.clear()
+                self._merge_shard(exited, values)
+                self._write(exited_path, exited.counters, {},
+                            exited.histograms)
+            try:
+                os.remove(file_path)
+            except OSError as exc:
+                if exc.errno != errno.ENOENT:
+                    raise
+
+    def collect(self):
+        '''Returns values aggregated over all processes sharing `path`'''
+        counters, gauges, histograms = self.snapshot()
+        if self.path is None:
+            return counters, gauges, histograms
+        file_names = [file_name for file_name in os.listdir(self.path)
+                      if file_name.endswith('.json') and
+                         file_name != self.exited_file]
+        for file_name in file_names:
+            try:
+                pid = int(file_name[:-len('.json')])
+            except ValueError:
+                continue
+            if pid == os.getpid():
+                continue
+            if not _pid_alive(pid):
+                self._merge_exited(pid)
+                continue
+            values = self._read(os.path.join(self.path, file_name))
+            if values is not None:
+                for key, value in values.counters.items():
+                    counters[key] += value
+                for key, value in values.gauges.items():
+                    gauges[key] += value
+                for key, value in values.histograms.items():
+                    self._merge_histogram(histograms, key, value)
+        # read after merging files of processes exited just now
+        exited = self._read(os.path.join(self.path, self.exited_file))
+        if exited is not None:
+            for key, value in exited.counters.items():
+                counters[key] += value
+            for key, value in exited.histograms.items():
+                self._merge_histogram(histograms, key, value)
+        return counters, gauges, histograms
+
+    def _storage_hit_ratios(self, counters):
+        requests = defaultdict(lambda: [0, 0])
+        for (name, labels), value in counters.items():
+            if name != 'iktomi_storage_requests_total':
+                continue
+            labels = dict(labels)
+            requests[labels['storage']][labels['result'] == 'hit'] += value
+        return dict((('iktomi_storage_hit_ratio', (('storage', storage),)),
+                     float(hits) / (hits + misses))
+                    for storage, (misses, hits) in requests.items())
+
+    def render(self):
+        '''Returns aggregated values in Prometheus text format'''
+        counters, gauges, histograms = self.collect()
+        gauges.update(self._storage_hit_ratios(counters))
+        lines = []
+        for kind, values in [('counter', counters), ('gauge', gauges)]:
+            last_name = None
+            for (name, labels), value in sorted(values.items()):
+                if name != last_name:
+                    lines.append(u'# TYPE {} {}'.format(name, kind))
+                    last_name = name
+                lines.append(u'{}{} {}'.format(name, _format_labels(labels),
+                                               _format_value(value)))
+        last_name = None
+        for (name, labels), value in sorted(histograms.items()):
+            if name != last_name:
+                lines.append(u'# TYPE {} histogram'.format(name))
+                last_name = name
+            total = 0
+            for bound, count in zip(self.buckets + (float('inf'),), value):
+                total += count
+                bucket_labels = labels + (('le', _format_value(
+                                                float(bound))),)
+                lines.append(u'{}_bucket{} {}'.format(
+                        name, _format_labels(bucket_labels), total))
+            lines.append(u'{}_sum{} {}'.format(name, _format_labels(labels),
+                                               _format_value(value[-1])))
+            lines.append(u'{}_count{} {}'.format(name, _format_labels(labels),
+                                                 total))
+        return u'\n'.join(lines) + u'\n'
+
+
+_missing = object()
+
+
+class MeteredStorage(Storage):
+    '''
+    :class:`Storage<iktomi.storage.Storage>` wrapper counting hits and misses
+    of `get` calls in `iktomi_storage_requests_total` counter. Hit ratio
+    is exposed as `iktomi_storage_hit_ratio` gauge::
+
+        cache = MeteredStorage(MemcachedStorage(cfg.MEMCACHE), metrics,
+                               name='memcache')
+    '''
+
+    def __init__(self, storage, metrics, name='default'):
+        self.storage = storage
+        self.metrics = metrics
+        self.name = name
+
+    def set(self, key, value, time=0):
+        return self.storage.set(key, value, time)
+
+    def get(self, key, default=None):
+        value = self.storage.get(key, _missing)
+        if value is _missing:
+            self.metrics.inc('iktomi_storage_requests_total',
+                             storage=self.name, result='miss')
+            return default
+        self.metrics.inc('iktomi_storage_requests_total',
+                         storage=self.name, result='hit')
+        return value
+
+    def add(self, key, value, time=0):
+        return self.storage.add(key, value, time)
+
+    def delete(self, key):
+        return self.storage.delete(key)
+
+
+class metrics(WebHandler):
+    '''
+    Returns :class:`Metrics` values in Prometheus text format::
+
+        web.match('/_metrics') | web.metrics(metrics)
+    '''
+
+    content_type = 'text/plain; version=0.0.4'
+
+    def __init__(self, registry):
+        self.registry = registry
+
+    def metrics(self, env, data):
+        return Response(self.registry.render(),
+                        content_type=self.content_type, charset='utf-8')
+    __call__ = metrics
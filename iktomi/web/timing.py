@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+'''
+Request processing phases timing.
+'''
+
+__all__ = ['RequestTiming', 'Histogram', 'TimingStats']
+
+import time
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class NullTiming(object):
+    '''Does nothing, is used when timing is disabled'''
+
+    def add(self, name, duration):
+        pass
+
+    @contextmanager
+    def phase(self, name):
+        yield
+
+    @contextmanager
+    def handling(self, name='handler'):
+        yield
+
+    def route_matched(self, env):
+        pass
+
+
+#: is used in place of `RequestTiming` when timing is disabled
+null_timing = NullTiming()
+
+
+class RequestTiming(NullTiming):
+    '''
+    Collects durations of request processing phases (in seconds).
+    Is available as `env.timing` if timing is enabled in `Application`.
+
+    Extra phases can be measured in handlers::
+
+        with env.timing.phase('db'):
+            items = env.db.query(Item).all()
+    '''
+
+    #: location name (see `AppEnvironment.current_location`) of matched route
+    location = None
+
+    def __init__(self):
+        self.phases = OrderedDict()
+        self.started = time.time()
+        self._active = set()
+        self._handling_started = self.started
+
+    def add(self, name, duration):
+        self.phases[name] = self.phases.get(name, 0) + duration
+
+    @contextmanager
+    def phase(self, name):
+        '''Context manager measuring a phase. Nested phases with the same
+        name (templates rendered from templates) are counted once.'''
+        if name in self._active:
+            yield
+            return
+        self._active.add(name)
+        start = time.time()
+        try:
+            yield
+        finally:
+            self._active.discard(name)
+            self.add(name, time.time() - start)
+
+    @contextmanager
+    def handling(self, name='handler'):
+        '''Context manager measuring request handling. Time of phases
+        measured inside (routing, templates etc) is not included.'''
+        measured = sum(self.phases.values())
+        self._handling_started = start = time.time()
+        try:
+            yield
+        finally:
+            nested = sum(self.phases.values()) - measured
+            self.add(name, max(time.time() - start - nested, 0))
+
+    def route_matched(self, env):
+        '''Called by `web.match` to finish routing phase'''
+        if 'routing' not in self.phases:
+            self.location = env.current_location
+            self.add('routing', time.time() - self._handling_started)
+
+    def server_timing(self):
+        '''Value of `Server-Timing` header'''
+        return ', '.join('{};dur={:.1f}'.format(name, duration * 1000)
+                         for name, duration in self.phases.items())
+
+    def __str__(self):
+        return ' '.join('{}={:.1f}ms'.format(name, duration * 1000)
+                        for name, duration in self.phases.items())
+
+
+class Histogram(object):
+    '''Thread-safe histogram with fixed buckets (upper bounds)'''
+
+    buckets = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+    def __init__(self, buckets=None):
+        if buckets is not None:
+            self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def cumulative(self):
+        '''Returns a list of `(upper_bound, count)` pairs, the last bound is
+        `float('inf')`'''
+        with self._lock:
+            counts = list(self.counts)
+        result = []
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class TimingStats(object):
+    '''Aggregated histograms of request phases durations'''
+
+    def __init__(self, buckets=None):
+        self.buckets = buckets
+        self.histograms = OrderedDict()
+        self._lock = threading.Lock()
+
+    def histogram(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(
+                        name, Histogram(self.buckets))
+        return histogram
+
+    def observe(self, timing):
+        '''Adds all phases of `RequestTiming` object'''
+        for name, duration in timing.phases.items():
+            self.histogram(name).observe(duration)
@@ -1,14 +1,23 @@
 # -*- coding: utf-8 -*-
 import os
 import sys
+import json
 import unittest
-from iktomi.cli.fcgi import Flup
+from iktomi.cli.fcgi import Flup, server_class, flup_fastcgi, \
+                            LISTEN_FD_ENV, PREDECESSOR_ENV, WAKEUP_CHILD
 from .fcgi_client import FastCGIClient
 import shutil
 import signal
 from time import sleep
+import socket
 import subprocess
 import tempfile
+import threading
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
 
 
 class FlupTests(unittest.TestCase):
@@ -23,6 +32,321 @@ class FlupTests(unittest.TestCase):
         self.assertEqual(flup.pidfile, os.path.join(cwd, 'fcgi.pid'))
 
 
+class GracefulRestartTests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.bind = os.path.join(self.temp_dir, 'fcgi.sock')
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(self.bind)
+        self.sock.listen(1)
+
+    def tearDown(self):
+        self.sock.close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_inherit_socket(self):
+        for preforked in (False, True):
+            server = server_class(preforked)(lambda e, s: [],
+                                             bindAddress=self.bind)
+            environ = {LISTEN_FD_ENV: str(os.dup(self.sock.fileno())),
+                       PREDECESSOR_ENV: '12345'}
+            with patch.dict(os.environ, environ):
+                with patch('os.kill') as kill:
+                    sock = server._setupSocket()
+                    kill.assert_called_once_with(12345, signal.SIGQUIT)
+                self.assertNotIn(LISTEN_FD_ENV, os.environ)
+                self.assertNotIn(PREDECESSOR_ENV, os.environ)
+            self.assertEqual(sock.getsockname(), self.bind)
+            # socket file is not replaced
+            client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            client.connect(self.bind)
+            client.close()
+            sock.close()
+
+    def test_drain_children(self):
+        server = server_class(preforked=True)(lambda e, s: [],
+                                              bindAddress=self.bind)
+        pairs = [socket.socketpair() for x in range(2)]
+        for master_end, child_end in pairs:
+            self.addCleanup(master_end.close)
+            self.addCleanup(child_end.close)
+        # the second child has accepted a connection, but its state is not
+        # received yet
+        server._children = {1: {'file': pairs[0][0], 'avail': True},
+                            2: {'file': pairs[1][0], 'avail': True}}
+        with patch('os.kill') as kill:
+            server._drainHandler(signal.SIGQUIT, None)
+            self.assertFalse(kill.called)
+        self.assertFalse(server._keepGoing)
+        # children exit when they are waiting for the next request
+        for master_end, child_end in pairs:
+            self.assertEqual(child_end.recv(1), b'')
+            self.assertEqual(master_end.recv(1), b'')
+
+    def test_restart_not_running(self):
+        pidfile = os.path.join(self.temp_dir, 'fcgi.pid')
+        flup = Flup('app', bind=self.bind, pidfile=pidfile)
+        self.assertRaises(SystemExit, flup.command_restart)
+        # a PID of surely finished process
+        proc = subprocess.Popen([sys.executable, '-c', ''])
+        proc.wait()
+        with open(pidfile, 'w') as f:
+            f.write(str(proc.pid))
+        with self.assertRaises(SystemExit) as cm:
+            flup.command_restart()
+        self.assertEqual(cm.exception.code, 'Not running')
+
+    def test_restart_command(self):
+        # the new master is started by start command, not by the one which
+        # started the current master
+        with patch.object(sys, 'argv', ['manage.py', 'fcgi:restart',
+                                        '--hard']):
+            with patch('iktomi.cli.fcgi.server_class') as server_class:
+                server_class.return_value.options = ()
+                flup_fastcgi(lambda e, s: [], self.bind)
+        server = server_class.return_value.return_value
+        self.assertEqual(server._argv,
+                         [os.path.abspath('manage.py'), 'fcgi:start'])
+        server.run.assert_called_once_with()
+
+    def test_restart_unsupported(self):
+        pidfile = os.path.join(self.temp_dir, 'fcgi.pid')
+        statusfile = os.path.join(self.temp_dir, 'fcgi.status')
+        flup = Flup('app', bind=self.bind, pidfile=pidfile,
+                    statusfile=statusfile)
+        flup.restart_timeout = 0
+        with open(pidfile, 'w') as f:
+            f.write(str(os.getpid()))
+        stop = patch.object(flup, 'command_stop')
+        start = patch.object(flup, 'command_start')
+        # running server has not reported graceful restart support
+        with stop, start, patch('os.kill') as kill:
+            flup.command_restart()
+            flup.command_start.assert_called_once_with(daemonize=True)
+            self.assertNotIn(signal.SIGUSR2,
+                             [call[0][1] for call in kill.call_args_list])
+        with open(statusfile, 'w') as f:
+            json.dump({'pid': os.getpid(), 'graceful_restart': True}, f)
+        with stop, start, patch('os.kill') as kill:
+            self.assertRaises(SystemExit, flup.command_restart)
+            kill.assert_called_with(os.getpid(), signal.SIGUSR2)
+            self.assertFalse(flup.command_start.called)
+
+
+    def test_status_unsupported(self):
+        pidfile = os.path.join(self.temp_dir, 'fcgi.pid')
+        statusfile = os.path.join(self.temp_dir, 'fcgi.status')
+        flup = Flup('app', bind=self.bind, pidfile=pidfile,
+                    statusfile=statusfile)
+        flup.restart_timeout = 0
+        with open(pidfile, 'w') as f:
+            f.write(str(os.getpid()))
+        # running server has not written status file on start
+        with patch('os.kill') as kill:
+            self.assertRaises(SystemExit, flup.command_status)
+            self.assertNotIn(signal.SIGUSR1,
+                             [call[0][1] for call in kill.call_args_list])
+        # status file of another process
+        with open(statusfile, 'w') as f:
+            json.dump({'pid': os.getpid() + 1, 'graceful_restart': True}, f)
+        with patch('os.kill') as kill:
+            self.assertRaises(SystemExit, flup.command_status)
+            self.assertNotIn(signal.SIGUSR1,
+                             [call[0][1] for call in kill.call_args_list])
+        with open(statusfile, 'w') as f:
+            json.dump({'pid': os.getpid(), 'graceful_restart': True}, f)
+        with patch('os.kill') as kill:
+            with self.assertRaises(SystemExit) as cm:
+                flup.command_status()
+            kill.assert_called_with(os.getpid(), signal.SIGUSR1)
+        self.assertEqual(cm.exception.code,
+                         'Server has not reported its state')
+
+
+class AutoscaleTests(unittest.TestCase):
+
+    def setUp(self):
+        self.server = server_class(preforked=True)(lambda e, s: [],
+                                                   bindAddress='fcgi.sock')
+        self.server.__dict__.update(min_workers=2, max_workers=4,
+                                    scale_down_delay=0)
+        self.server._workers = self.server._maxSpare = 2
+        self.server._listenSock = socket.socket(socket.AF_UNIX,
+                                                socket.SOCK_STREAM)
+        self.addCleanup(self.server._listenSock.close)
+
+    def set_children(self, *avail):
+        self.files = [socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                      for x in avail]
+        for f in self.files:
+            self.addCleanup(f.close)
+        self.server._children = dict(
+            (pid, {'file': f, 'avail': x})
+            for pid, f, x in zip(range(1, len(avail)+1), self.files, avail))
+
+    def test_scale_up(self):
+        self.set_children(False, False)
+        self.server._autoscale()
+        self.assertEqual(self.server._workers, 3)
+        self.assertEqual(self.server._maxSpare, 3)
+        self.set_children(False, False, False, False)
+        self.server._workers = 4
+        self.server._autoscale()
+        self.assertEqual(self.server._workers, 4)
+
+    def test_scale_down(self):
+        self.set_children(True, True, True, False)
+        self.server._workers = 4
+        # the first check just remembers the load is low
+        self.server._autoscale()
+        self.assertEqual(self.server._workers, 4)
+        self.server._autoscale()
+        self.assertEqual(self.server._workers, 3)
+        # an idle child is told to exit
+        self.assertIsNone(self.server._children[1]['file'])
+        self.assertFalse(self.server._children[1]['avail'])
+        self.assertIsNotNone(self.server._children[2]['file'])
+        # moderate load resets low load period
+        self.set_children(True, False, False)
+        self.server._autoscale()
+        self.assertIsNone(self.server._lowLoadSince)
+
+    def test_closed_children(self):
+        # a child closed on scale down is not reaped yet
+        self.set_children(True, False, True)
+        self.server._workers = 2
+        self.server._children[1].update(file=None, avail=False)
+        self.server._autoscale()
+        self.assertEqual(self.server._workers, 2)
+        self.assertEqual(self.server._status()['workers'], 2)
+        self.assertEqual(self.server._status()['busy'], 1)
+
+    def test_timer(self):
+        self.set_children(True, True, True)
+        self.server._workers = 3
+        pairs = [socket.socketpair() for x in range(3)]
+        for pid, (master_end, child_end) in enumerate(pairs, 1):
+            self.addCleanup(master_end.close)
+            self.addCleanup(child_end.close)
+            self.server._children[pid]['file'] = master_end
+        with patch('signal.setitimer') as setitimer:
+            self.server._installSignalHandlers()
+            setitimer.assert_called_once_with(signal.ITIMER_REAL, 5, 5)
+            self.assertEqual(signal.getsignal(signal.SIGALRM),
+                             self.server._alarmHandler)
+            # idle workers are stopped while main loop is blocked in select
+            self.server._alarmHandler(signal.SIGALRM, None)
+            self.server._alarmHandler(signal.SIGALRM, None)
+            self.assertEqual(self.server._workers, 2)
+            # socket is shut down, not closed, so the child exits
+            self.assertEqual(pairs[0][1].recv(1), b'')
+            self.assertEqual(pairs[0][0].recv(1), b'')
+            self.assertIsNotNone(self.server._children[1]['file'])
+            self.server._restoreSignalHandlers()
+            setitimer.assert_called_with(signal.ITIMER_REAL, 0)
+
+    def test_timer_scale_up(self):
+        self.set_children(False, False)
+        wakeup, wakeup_end = socket.socketpair()
+        self.addCleanup(wakeup.close)
+        self.addCleanup(wakeup_end.close)
+        self.server._wakeup = wakeup
+        self.server._children[WAKEUP_CHILD] = {'file': wakeup_end,
+                                               'avail': False}
+        # main loop blocked in select() is woken up to spawn workers
+        self.server._alarmHandler(signal.SIGALRM, None)
+        self.assertEqual(self.server._workers, 3)
+        # the pseudo-child is counted by flup, but not as a worker
+        self.assertEqual(self.server._maxSpare, 4)
+        self.assertEqual(self.server._status()['workers'], 2)
+        self.assertEqual(wakeup_end.recv(1), b'\x00')
+
+    def test_wakeup_child(self):
+        self.server.max_workers = None
+        self.server._children = {}
+        with patch('flup.server.fcgi_fork.WSGIServer.run'):
+            self.server.run()
+        self.assertEqual(self.server._children, {})
+        self.server.max_workers = 4
+        with patch('flup.server.fcgi_fork.WSGIServer.run'):
+            self.server.run()
+        self.assertEqual(list(self.server._children), [WAKEUP_CHILD])
+        self.assertEqual(self.server._maxSpare, 3)
+        self.assertEqual(self.server._maxChildren, 5)
+        with patch('flup.server.preforkserver.PreforkServer.'
+                   '_cleanupChildren') as cleanup:
+            self.server._cleanupChildren()
+            cleanup.assert_called_once_with()
+        self.assertEqual(self.server._children, {})
+        self.assertIsNone(self.server._wakeup)
+
+    def test_min_workers(self):
+        self.set_children(True, True)
+        self.server._autoscale()
+        self.server._autoscale()
+        self.assertEqual(self.server._workers, 2)
+
+    def test_status(self):
+        self.set_children(True, False)
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        self.server.status_file = os.path.join(temp_dir, 'fcgi.status')
+        self.server._statusHandler(signal.SIGUSR1, None)
+        with open(self.server.status_file) as f:
+            status = json.load(f)
+        self.assertEqual(status, {
+            'pid': os.getpid(), 'workers': 2, 'busy': 1, 'queue': None,
+            'graceful_restart': True,
+            'autoscale': {'workers': 2, 'min_workers': 2, 'max_workers': 4}})
+
+
+class GracefulDrainTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+
+    def test_drain_request_in_progress(self):
+        bind = os.path.join(self.temp_dir, 'fcgi.sock')
+        started = os.path.join(self.temp_dir, 'started')
+        def app(environ, start_response):
+            open(started, 'w').close()
+            sleep(1)
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            return [b'done']
+        pid = os.fork()
+        if not pid:
+            try:
+                server_class(preforked=True)(app, bindAddress=bind,
+                                             maxSpare=2).run()
+            finally:
+                os._exit(0)
+        try:
+            for i in range(50):
+                if os.path.exists(bind):
+                    break
+                sleep(0.1)
+            results = []
+            thread = threading.Thread(target=lambda: results.append(
+                FastCGIClient(bind).make_request()[0]))
+            thread.start()
+            for i in range(50):
+                if os.path.exists(started):
+                    break
+                sleep(0.1)
+            os.kill(pid, signal.SIGQUIT)
+            thread.join(5)
+            self.assertEqual([b''.join(x) for x in results], [b'done'])
+            # the master exits after the request is done
+            self.assertEqual(os.waitpid(pid, 0), (pid, 0))
+            pid = None
+        finally:
+            if pid is not None:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+
+
 class FlupDaemonTest(unittest.TestCase):
 
     def setUp(self):
@@ -78,3 +402,5 @@ class FlupDaemonTest(unittest.TestCase):
 
 if sys.version_info[0] >= 3:
     FlupDaemonTest.test_daemon = unittest.skip(FlupDaemonTest.test_daemon)
+    GracefulDrainTest.test_drain_request_in_progress = unittest.skip(
+        GracefulDrainTest.test_drain_request_in_progress)
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+from iktomi.cli.templates import Templates
+from iktomi.templates import Template
+from iktomi.templates.jinja2 import TemplateEngine
+from iktomi.templates.profile import TemplateProfile
+from iktomi.web.monitoring import Metrics
+from iktomi.storage import LocalMemStorage
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+__all__ = ['TemplatesTests']
+
+
+class TemplatesTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.write('index.html', '{% extends "base.html" %}')
+        self.write('base.html', '<html>{% block body %}{% endblock %}</html>')
+        self.storage = LocalMemStorage()
+        engine = TemplateEngine(self.dir, cache=self.storage)
+        self.template = Template(self.dir, engines={'html': engine},
+                                 profile=TemplateProfile(Metrics()))
+        self.cli = Templates(self.template)
+
+    def write(self, name, content):
+        with open(os.path.join(self.dir, name), 'w') as f:
+            f.write(content)
+
+    def test_compile(self):
+        with mock.patch('sys.stdout') as stdout:
+            self.cli.command_compile(verbose=True)
+        output = ''.join(call[0][0] for call in stdout.write.call_args_list)
+        self.assertIn('base.html\nindex.html\n', output)
+        self.assertIn('Compiled 2 templates, 0 failed', output)
+        self.assertEqual(len(self.storage.storage), 2)
+
+    def test_compile_error(self):
+        self.write('broken.html', '{% block %}')
+        with mock.patch('sys.stdout'), mock.patch('sys.stderr') as stderr:
+            with self.assertRaises(SystemExit):
+                self.cli.command_compile()
+        output = ''.join(call[0][0] for call in stderr.write.call_args_list)
+        self.assertIn('broken.html: ', output)
+        self.assertEqual(len(self.storage.storage), 2)
+
+    def test_profile(self):
+        self.template.render('index')
+        self.template.render('index')
+        with mock.patch('sys.stdout') as stdout:
+            self.cli.command_profile(sort='calls', limit='1')
+        output = ''.join(call[0][0] for call in stdout.write.call_args_list)
+        lines = output.splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(lines[0].split()[:3], ['calls', 'total', 'ms'])
+        self.assertEqual(lines[1].split()[0], '2')
+        self.assertIn(lines[1].split()[-1], ['index.html', 'base.html'])
+
+        with self.assertRaises(SystemExit):
+            self.cli.command_profile(sort='unknown')
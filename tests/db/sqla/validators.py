@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+import unittest
+from datetime import datetime
+from sqlalchemy import create_engine, Column, Integer, DateTime
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+from iktomi.utils.storage import VersionedStorage
+from iktomi.db.sqla.validators import last_modified, version_etag
+
+
+Base = declarative_base()
+
+
+class ValidatedObject(Base):
+    __tablename__ = 'ValidatedObject'
+
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False)
+    updated_at = Column(DateTime)
+
+    __mapper_args__ = {'version_id_col': version}
+
+
+class ValidatorsTest(unittest.TestCase):
+
+    def setUp(self):
+        engine = create_engine('sqlite://')
+        Base.metadata.create_all(engine)
+        self.db = sessionmaker(bind=engine)()
+        self.db.add(ValidatedObject(id=1,
+                                    updated_at=datetime(2020, 1, 1, 12)))
+        self.db.commit()
+        self.env = VersionedStorage(db=self.db)
+
+    def test_last_modified(self):
+        func = last_modified(ValidatedObject.updated_at)
+        self.assertEqual(func(self.env, VersionedStorage(id=1)),
+                         datetime(2020, 1, 1, 12))
+        self.assertEqual(func(self.env, VersionedStorage(id=2)), None)
+        self.assertEqual(func(self.env, VersionedStorage()), None)
+
+    def test_version_etag(self):
+        func = version_etag(ValidatedObject.version, data_attr='item_id')
+        data = VersionedStorage(item_id=1)
+        self.assertEqual(func(self.env, data), 'ValidatedObject-1-1')
+        obj = self.db.query(ValidatedObject).get(1)
+        obj.updated_at = datetime(2020, 1, 2)
+        self.db.commit()
+        self.assertEqual(func(self.env, data), 'ValidatedObject-1-2')
+        self.assertEqual(func(self.env, VersionedStorage(item_id=2)), None)
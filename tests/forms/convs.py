@@ -7,10 +7,11 @@ from iktomi.forms import *
 from iktomi.web.app import AppEnvironment
 from webob.multidict import MultiDict
 from collections import OrderedDict
-from iktomi.forms import Form, Field, FieldSet
+from iktomi.forms import Form, Field, FieldSet, FieldList
 from iktomi.utils import cached_property
+from iktomi.storage import LocalMemStorage
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, Integer, String, orm, create_engine
+from sqlalchemy import Column, Integer, String, orm, create_engine, event
 from iktomi.db.sqla.declarative import AutoTableNameMeta
 
 
@@ -658,6 +659,50 @@ class HtmlTests(unittest.TestCase):
         self.assertEqual(cleaner.wrap_inline_tags, True)
         self.assertEqual(cleaner.tags_to_wrap, ['b', 'i'])
 
+    def test_shared_cleaner(self):
+        created = []
+        class CountingCleaner(object):
+            def __init__(self, **kwargs):
+                created.append(kwargs)
+
+        class MyHtml(convs.Html):
+            Cleaner = CountingCleaner
+            allowed_classes = {'p': set(['note'])}
+
+        cleaner = MyHtml().cleaner
+        self.assertIs(init_conv(MyHtml()).cleaner, cleaner)
+        self.assertIs(MyHtml(allowed_classes={'p': set(['note'])}).cleaner,
+                      cleaner)
+        self.assertIsNot(MyHtml(add_allowed_elements=['span']).cleaner,
+                         cleaner)
+        self.assertIsNot(MyHtml(allowed_classes={'p': set(['lead'])}).cleaner,
+                         cleaner)
+        self.assertEqual(len(created), 3)
+
+        cleaner = MyHtml(shared_cleaner=False).cleaner
+        self.assertIsNot(MyHtml(shared_cleaner=False).cleaner, cleaner)
+
+    def test_clean_cache(self):
+        from iktomi.utils.html import SanitizeCache
+        cleaned = []
+        class UpperCleaner(object):
+            def __init__(self, **kwargs):
+                self.allow_tags = kwargs['allow_tags']
+            def __call__(self, doc):
+                cleaned.append(doc)
+                doc[0].text = doc[0].text.upper()
+
+        class MyHtml(convs.Html):
+            Cleaner = UpperCleaner
+            clean_cache = SanitizeCache()
+
+        self.assertEqual(MyHtml().clean_value('<p>text</p>'), '<p>TEXT</p>')
+        self.assertEqual(MyHtml().clean_value('<p>text</p>'), '<p>TEXT</p>')
+        self.assertEqual(len(cleaned), 1)
+        conv = MyHtml(allowed_elements=['p', 'b'])
+        self.assertEqual(conv.clean_value('<p>text</p>'), '<p>TEXT</p>')
+        self.assertEqual(len(cleaned), 2)
+
 class ValidatorTests(unittest.TestCase):
 
     def test_length(self):
@@ -837,6 +882,9 @@ class ModelChoiceTests(unittest.TestCase):
     def setUp(self):
         engine = create_engine('sqlite://')
         Base.metadata.create_all(engine)
+        self.queries = []
+        event.listen(engine, 'before_cursor_execute',
+                     lambda *args: self.queries.append(args[2]))
         Session = orm.sessionmaker()
         self.db = Session(bind=engine)
         self.env.db = self.db
@@ -923,6 +971,114 @@ class ModelChoiceTests(unittest.TestCase):
             ('2', 'title2'),
         ])
 
+    def test_list_of(self):
+        class F(Form):
+            fields = [
+                Field('obj', conv=convs.ListOf(
+                            convs.ModelChoice(model=ChoiceObject))),
+            ]
+        form = F(self.env)
+        del self.queries[:]
+        self.assertTrue(form.accept(MultiDict([('obj', '3'), ('obj', '100'),
+                                               ('obj', 'aaa'), ('obj', '1'),
+                                               ('obj', '3')])))
+        self.assertEqual([obj.id for obj in form.python_data['obj']],
+                         [3, 1, 3])
+        self.assertEqual(len(self.queries), 1)
+        self.assertIn(' IN ', self.queries[0])
+
+    def test_field_list(self):
+        class F(Form):
+            fields = [
+                FieldList('list', field=FieldSet(None, fields=[
+                    Field('obj', conv=convs.ModelChoice(model=ChoiceObject,
+                                                        required=True)),
+                ])),
+            ]
+        form = F(self.env)
+        del self.queries[:]
+        data = MultiDict([('list-indices', '1'), ('list-indices', '2'),
+                          ('list-indices', '3'), ('list.1.obj', '2'),
+                          ('list.2.obj', '1'), ('list.3.obj', '100')])
+        self.assertFalse(form.accept(data))
+        self.assertEqual(list(form.errors), ['list.3.obj'])
+        self.assertEqual([item['obj'].id for item in form.python_data['list']
+                          if item['obj'] is not None], [2, 1])
+        self.assertEqual(len(self.queries), 1)
+
+        # objects are loaded again on the next accept
+        data['list.3.obj'] = '3'
+        self.assertTrue(form.accept(data))
+        self.assertEqual(len(self.queries), 2)
+
+        self.assertTrue(form.accept_json({'list': [{'obj': 2}, {'obj': '3'}]}))
+        self.assertEqual([item['obj'].id for item in form.python_data['list']],
+                         [2, 3])
+        self.assertEqual(len(self.queries), 3)
+
+        # JSON values of incompatible type are field errors
+        for value in [{'id': 1}, [1]]:
+            self.assertFalse(form.accept_json({'list': [{'obj': value}]}))
+            self.assertEqual(list(form.errors), ['list.1.obj'])
+
+    def test_field_list_incompatible_type(self):
+        class F(Form):
+            fields = [
+                FieldList('list', field=Field(
+                    'obj', conv=convs.ModelChoice(model=ChoiceObject))),
+            ]
+        form = F(self.env)
+        # e.g. uploaded file
+        data = MultiDict([('list-indices', '1'), ('list-indices', '2'),
+                          ('list.1', object()), ('list.2', '2')])
+        self.assertFalse(form.accept(data))
+        self.assertEqual(form.errors,
+                         {'list.1': 'Given value has incompatible type'})
+        self.assertEqual(form.python_data['list'][1].id, 2)
+
+    def test_options_cache(self):
+        options_cache = convs.OptionsCache(LocalMemStorage())
+        options_cache.track(self.db)
+        conv = self._init_modelchoice_conv(condition=ChoiceObject.id > 1,
+                                           options_cache=options_cache)
+        del self.queries[:]
+        self.assertEqual(list(conv.options()), [('2', 'title2'),
+                                                ('3', 'title3')])
+        self.assertEqual(list(conv.options()), [('2', 'title2'),
+                                                ('3', 'title3')])
+        self.assertEqual(len(self.queries), 1)
+
+        other = self._init_modelchoice_conv(condition=ChoiceObject.id > 2,
+                                            options_cache=options_cache)
+        self.assertEqual(list(other.options()), [('3', 'title3')])
+
+        self.db.add(ChoiceObject(id=4, title='title4'))
+        self.db.flush()
+        self.assertEqual(len(list(conv.options())), 2)
+        self.db.commit()
+        self.assertEqual(len(list(conv.options())), 3)
+
+    def test_selected_options(self):
+        conv = self._init_modelchoice_conv()
+        del self.queries[:]
+        self.assertEqual(list(conv.selected_options(['3', '', '100', '1'])),
+                         [('3', 'title3'), ('1', 'title1')])
+        self.assertEqual(len(self.queries), 1)
+
+    def test_search(self):
+        self.db.add_all([ChoiceObject(id=i, title=u'Item {}'.format(i))
+                         for i in range(10, 15)] +
+                        [ChoiceObject(id=20, title=u'100%_')])
+        self.db.commit()
+        conv = self._init_modelchoice_conv(search_page_size=2)
+        self.assertEqual(conv.search(u'item'),
+                         ([('10', 'Item 10'), ('11', 'Item 11')], True))
+        self.assertEqual(conv.search(u'ITEM', page=3),
+                         ([('14', 'Item 14')], False))
+        self.assertEqual(conv.search(u'%_'), ([('20', '100%_')], False))
+        self.assertEqual(conv.search(u'title', page=2),
+                         ([('3', 'title3')], False))
+
     def test_slug(self):
         conv = self._init_modelchoice_conv(conv=convs.Char(), model=SlugObject)
 
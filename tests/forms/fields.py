@@ -64,6 +64,18 @@ class FieldTests(unittest.TestCase):
                      '%s is not instance of %s' % (nm, cls))
         self.assertEqual(form.get_field(nm).input_name,
                          'blocksubfield')
+        self.assertEqual(form.get_field('missing'), None)
+        self.assertEqual(form.get_field('fieldset.missing'), None)
+
+    def test_get_field_first(self):
+        class F(Form):
+            fields = [
+                FieldBlock('block', [Field('name', label='block')]),
+                Field('name', label='form'),
+            ]
+        form = F(AppEnvironment.create())
+        self.assertEqual(form.get_field('name').label, 'block')
+        self.assertEqual(form.fields[0].field_names, ['name'])
 
     def test_accept_multiple(self):
         class F(Form):
@@ -283,3 +295,72 @@ class FileFieldTests(unittest.TestCase):
         form = F()
         self.assertEqual(form.accept(request.POST), False)
         self.assertEqual(list(form.errors.keys()), ['inp'])
+
+
+class BindTests(unittest.TestCase):
+
+    def assertBound(self, field, parent):
+        self.assertIs(field.parent, parent)
+        self.assertIs(field.conv.field, field)
+        # widget refers to the field through weakref.proxy, which is not
+        # equal to its referent on Python 2
+        self.assertIs(field.widget.field.conv, field.conv)
+        for subfield in getattr(field, 'fields', []):
+            self.assertBound(subfield, field)
+        if isinstance(field, FieldList):
+            self.assertBound(field.field, field)
+
+    def assertSameCopy(self, copy, expected):
+        self.assertEqual(type(copy), type(expected))
+        self.assertEqual(sorted(copy.__dict__), sorted(expected.__dict__))
+        self.assertEqual(sorted(copy._init_kwargs),
+                         sorted(expected._init_kwargs))
+        self.assertEqual(type(copy.conv), type(expected.conv))
+        self.assertEqual(sorted(copy.conv.__dict__),
+                         sorted(expected.conv.__dict__))
+        self.assertEqual(copy.conv.validators, expected.conv.validators)
+        self.assertEqual(type(copy.widget), type(expected.widget))
+        self.assertEqual(sorted(copy.widget.__dict__),
+                         sorted(expected.widget.__dict__))
+
+    def test_bind(self):
+        class F(Form):
+            fields = [
+                Field('date', convs.Date(required=True), label='Date'),
+                FieldSet('set', fields=[
+                    Field('a', convs.Int(), permissions='r'),
+                    FieldBlock('block', fields=[Field('b')]),
+                ]),
+                FieldList('list', field=Field(None, convs.Int())),
+            ]
+        form = F(AppEnvironment.create())
+        for prototype, field in zip(F.fields, form.fields):
+            self.assertBound(field, form)
+            self.assertSameCopy(prototype._bind(form),
+                                prototype(parent=form))
+        self.assertEqual(form.get_field('set.a').permissions, set('r'))
+        self.assertEqual(form.get_field('date').label, 'Date')
+        self.assertEqual(form.get_field('list.1').input_name, 'list.1')
+        self.assertTrue(form.accept({'date': '01.01.2020', 'set.a': '1',
+                                     'set.b': 'b', 'list-indices': '1',
+                                     'list.1': '2'}))
+        self.assertEqual(form.python_data['list'], [2])
+        # prototypes are not changed
+        self.assertIs(F.fields[0].parent, None)
+
+    def test_custom_init(self):
+        class CustomField(Field):
+            def __init__(self, *args, **kwargs):
+                kwargs['calls'] = kwargs.get('calls', 0) + 1
+                Field.__init__(self, *args, **kwargs)
+        class CustomConv(convs.Char):
+            def __init__(self, *args, **kwargs):
+                kwargs['calls'] = kwargs.get('calls', 0) + 1
+                convs.Char.__init__(self, *args, **kwargs)
+        class F(Form):
+            fields = [CustomField('a', CustomConv())]
+        form = F(AppEnvironment.create())
+        field = form.get_field('a')
+        self.assertEqual(field.calls, 2)
+        self.assertEqual(field.conv.calls, 3)
+        self.assertBound(field, form)
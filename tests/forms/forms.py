@@ -2,8 +2,11 @@
 import six
 import os
 import unittest
+import time
 
 from iktomi.forms import *
+from iktomi.forms import form as form_module
+from iktomi.forms.fields import BaseField
 from iktomi.templates import Template
 from iktomi.templates.jinja2 import TemplateEngine
 from webob.multidict import MultiDict
@@ -297,6 +300,191 @@ class FormClassAcceptTests(unittest.TestCase):
         self.assertEqual(form.errors, {})
 
 
+class FormValidateManyTests(unittest.TestCase):
+
+    class _Form(Form):
+        fields=[
+            Field('first', convs.Int()),
+            Field('second', convs.Int(required=True)),
+            FieldSet('set', fields=[Field('number', convs.Int())]),
+            Field('readonly', convs.Int(), permissions='r'),
+            FieldList('list', field=Field('number', convs.Int())),
+        ]
+
+    rows = [
+        {'first': '1', 'second': '2', 'set.number': '3', 'readonly': '9'},
+        MultiDict([('first', 'x'), ('second', '2'), ('list-indices', '1'),
+                   ('list-indices', '2'), ('list.1', '5'),
+                   ('list.2', '6')]),
+        {'first': '1'},
+    ]
+
+    def check_results(self, results):
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results[0], ({'first': 1, 'second': 2,
+                                       'set': {'number': 3},
+                                       'readonly': 7, 'list': []}, {}))
+        python_data, errors = results[1]
+        self.assertEqual(python_data['list'], [5, 6])
+        self.assertEqual(python_data['set'], {'number': None})
+        self.assertEqual(list(errors), ['first'])
+        python_data, errors = results[2]
+        self.assertEqual(python_data['first'], 1)
+        self.assertEqual(python_data['list'], [])
+        self.assertEqual(list(errors), ['second'])
+
+    def test_validate_many(self):
+        env = AppEnvironment.create()
+        results = self._Form.validate_many(env, iter(self.rows),
+                                           initial={'readonly': 7})
+        self.assertFalse(isinstance(results, list))
+        self.check_results(list(results))
+
+    def test_aggregate_state(self):
+        class _Form(Form):
+            fields=[
+                FieldList('list', field=FieldSet(None, fields=[
+                    Field('a', convs.Int(), permissions='r')])),
+            ]
+        env = AppEnvironment.create()
+        initial = {'list': [{'a': 1}, {'a': 2}]}
+        rows = [MultiDict([('list-indices', '1')]),
+                MultiDict([('list-indices', '1'), ('list-indices', '2')])]
+        expected = []
+        for row in rows:
+            form = _Form(env, initial=initial)
+            form.accept(row)
+            expected.append(form.python_data['list'])
+        self.assertEqual(expected, [[{'a': 1}], [{'a': 1}, {'a': 2}]])
+        results = _Form.validate_many(env, rows, initial=initial)
+        self.assertEqual([python_data['list'] for python_data, errors
+                          in results], expected)
+
+    def test_processes(self):
+        env = AppEnvironment.create()
+        results = self._Form.validate_many(env, self.rows, processes=2,
+                                           chunk_size=2,
+                                           initial={'readonly': 7})
+        self.check_results(list(results))
+
+    def test_processes_read_ahead(self):
+        env = AppEnvironment.create()
+        read = []
+        def rows():
+            for i in range(1000):
+                read.append(i)
+                yield {'second': str(i)}
+        results = self._Form.validate_many(env, rows(), processes=2,
+                                           chunk_size=10)
+        self.assertEqual(next(results)[0]['second'], 0)
+        time.sleep(0.2)
+        # 2 * processes chunks in flight, the next one is being read
+        self.assertLessEqual(len(read), 50)
+        self.assertEqual([python_data['second']
+                          for python_data, errors in results],
+                         list(range(1, 1000)))
+        self.assertEqual(len(read), 1000)
+
+    def test_processes_interleaved(self):
+        env = AppEnvironment.create()
+        first = self._Form.validate_many(env, self.rows, processes=1,
+                                         chunk_size=1,
+                                         initial={'readonly': 8})
+        second = self._Form.validate_many(env, self.rows, processes=1,
+                                          chunk_size=1,
+                                          initial={'readonly': 7})
+        self.assertEqual(next(first)[0]['readonly'], 8)
+        results = [next(second)]
+        first.close()
+        # worker state lives in worker processes only
+        self.assertIsNone(form_module._batch_validator)
+        results.extend(second)
+        self.check_results(results)
+
+
+class FormAcceptJsonTests(unittest.TestCase):
+
+    class _Form(Form):
+        fields=[
+            Field('int', convs.Int()),
+            Field('bool', convs.Bool()),
+            Field('char', convs.Char(required=False)),
+            Field('ints', convs.ListOf(convs.Int())),
+            Field('readonly', convs.Int(), permissions='r'),
+            FieldBlock('block', fields=[Field('in_block', convs.Int())]),
+            FieldSet('set', fields=[Field('number', convs.Int())]),
+            FieldList('list', field=FieldSet(None, fields=[
+                Field('number', convs.Int()),
+                FieldList('sublist', field=Field(None, convs.Char())),
+            ])),
+        ]
+
+    def test_accept_json(self):
+        env = AppEnvironment.create()
+        data = {'int': 1, 'bool': True, 'char': None, 'ints': ['1', 2],
+                'readonly': 5, 'in_block': '3', 'set': {'number': 4},
+                'list': [{'number': 5, 'sublist': ['a', 'b']},
+                         {'number': '6'}]}
+        form = self._Form(env, initial={'readonly': 7})
+        self.assertTrue(form.accept_json(data))
+        self.assertEqual(form.python_data, {
+            'int': 1, 'bool': True, 'char': '', 'ints': [1, 2],
+            'readonly': 7, 'in_block': 3, 'set': {'number': 4},
+            'list': [{'number': 5, 'sublist': ['a', 'b']},
+                     {'number': 6, 'sublist': []}]})
+
+        # the same result as for flattened data
+        raw_data = MultiDict([
+            ('int', '1'), ('bool', '1'), ('ints', '1'), ('ints', '2'),
+            ('readonly', '5'), ('in_block', '3'), ('set.number', '4'),
+            ('list-indices', '1'), ('list-indices', '2'),
+            ('list.1.number', '5'), ('list.1.sublist-indices', '1'),
+            ('list.1.sublist-indices', '2'), ('list.1.sublist.1', 'a'),
+            ('list.1.sublist.2', 'b'), ('list.2.number', '6')])
+        json_data = form.python_data
+        form = self._Form(env, initial={'readonly': 7})
+        self.assertTrue(form.accept(raw_data))
+        self.assertEqual(form.python_data, json_data)
+
+    def test_errors(self):
+        env = AppEnvironment.create()
+        form = self._Form(env)
+        self.assertFalse(form.accept_json({'int': 'x', 'char': {'a': 1},
+                                           'set': {'number': [1]},
+                                           'list': [{'number': 1},
+                                                    {'number': 'x'}]}))
+        self.assertEqual(sorted(form.errors),
+                         ['char', 'int', 'list.2.number', 'set.number'])
+        self.assertEqual(form.python_data['list'],
+                         [{'number': 1, 'sublist': []},
+                          {'number': None, 'sublist': []}])
+        self.assertTrue(form.accept_json({}))
+        self.assertEqual(form.python_data['int'], None)
+        self.assertEqual(form.python_data['list'], [])
+
+    def test_custom_field(self):
+        class CommaSeparated(BaseField):
+            # implements accept only
+            def get_initial(self):
+                return []
+            def from_python(self, value):
+                return ','.join(value)
+            def set_raw_value(self, raw_data, value):
+                raw_data[self.input_name] = value
+            def accept(self):
+                value = self.form.raw_data.get(self.input_name, '')
+                self.clean_value = [x for x in value.split(',') if x]
+                return {self.name: self.clean_value}
+        class _Form(Form):
+            fields=[CommaSeparated('tags')]
+        form = _Form(AppEnvironment.create())
+        self.assertTrue(form.accept_json({'tags': 'a,b'}))
+        self.assertEqual(form.python_data, {'tags': ['a', 'b']})
+        form = _Form(AppEnvironment.create())
+        self.assertTrue(form.accept_json({}))
+        self.assertEqual(form.python_data, {'tags': []})
+
+
 class FormReadonlyFieldsTest(unittest.TestCase):
 
     def test_readonly(self):
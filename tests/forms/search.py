@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+__all__ = ['ChoiceSearchTests']
+
+import json
+import unittest
+from os import path
+from lxml import html
+from webob.multidict import MultiDict
+from sqlalchemy import Column, Integer, String, orm, create_engine
+from sqlalchemy.ext.declarative import declarative_base
+from iktomi import web
+from iktomi.web.app import Application
+from iktomi.forms import Form, Field, convs, widgets
+from iktomi.forms.search import choice_search
+from iktomi.templates import Template, BoundTemplate
+from iktomi.templates import jinja2 as jnj
+from iktomi.templates.jinja2 import TemplateEngine
+from webtest import TestApp as TA
+
+Base = declarative_base()
+
+
+class Author(Base):
+
+    __tablename__ = 'author'
+
+    id = Column(Integer, primary_key=True)
+    title = Column(String(200))
+
+
+class ArticleForm(Form):
+
+    fields = [
+        Field('author', conv=convs.ModelChoice(model=Author,
+                                               search_page_size=2),
+              widget=widgets.RemoteSelect(url='/authors')),
+        Field('hidden', conv=convs.ModelChoice(model=Author),
+              permissions=''),
+    ]
+
+
+class ChoiceSearchTests(unittest.TestCase):
+
+    def setUp(self):
+        engine = create_engine('sqlite://')
+        Base.metadata.create_all(engine)
+        self.db = orm.sessionmaker(bind=engine)()
+        self.db.add_all([Author(id=i, title=u'Author {}'.format(i))
+                         for i in range(1, 6)])
+        self.db.commit()
+
+    def environment(self, env, data, next_handler):
+        env.db = self.db
+        return next_handler(env, data)
+
+    def app(self, field_name):
+        return TA(Application(web.request_filter(self.environment) |
+                              choice_search(ArticleForm, field_name)))
+
+    def test_search(self):
+        response = self.app('author').get('/', {'q': 'author', 'page': '2'})
+        self.assertEqual(response.content_type, 'application/json')
+        self.assertEqual(json.loads(response.text), {
+            'results': [{'id': '3', 'text': 'Author 3'},
+                        {'id': '4', 'text': 'Author 4'}],
+            'more': True,
+        })
+        response = self.app('author').get('/', {'q': '5', 'page': 'x'})
+        self.assertEqual(json.loads(response.text)['results'],
+                         [{'id': '5', 'text': 'Author 5'}])
+
+    def test_not_accessible(self):
+        self.app('hidden').get('/', status=403)
+        self.app('missing').get('/', status=404)
+
+    def test_render(self):
+        templates = [path.join(path.dirname(path.abspath(jnj.__file__)),
+                               'templates')]
+        template = Template(engines={'html': TemplateEngine(templates)},
+                            *templates)
+        env = web.AppEnvironment.create()
+        env.db = self.db
+        env.template = BoundTemplate(env, template)
+        form = ArticleForm(env)
+        form.raw_data = MultiDict({'author': '4'})
+        doc = html.fragment_fromstring(form.get_field('author').widget.render(),
+                                       create_parent=True)
+        self.assertEqual(doc.xpath('.//select/@data-url'), ['/authors'])
+        self.assertEqual([(option.get('value'), option.text.strip())
+                          for option in doc.xpath('.//option')],
+                         [('', '--------'), ('4', 'Author 4')])
@@ -439,3 +439,76 @@ class TestFieldList(TestFormClass):
         self.assertIn('id="list.%list-index%.name"', template)
         self.assertNotIn('First', template)
         self.assertNotIn('Second', template)
+
+
+class TestFormRenderer(TestFormClass):
+
+    class CountingRenderer(jnj.FormRenderer):
+
+        compiled = 0
+
+        def _compile_template(self, template, name):
+            self.compiled += 1
+            return jnj.FormRenderer._compile_template(self, template, name)
+
+    def get_form(self, renderer):
+        class F(Form):
+            fields = [
+                Field('name', conv=convs.Char(),
+                      label='Name', hint='Hint'),
+                Field('hidden', conv=convs.Int(),
+                      widget=widgets.HiddenInput),
+                Field('unreadable', permissions='w', conv=convs.Char()),
+                Field('flag', conv=convs.Bool(), widget=widgets.CheckBox),
+                Field('choice',
+                      conv=convs.EnumChoice(choices=[('1', 'One')]),
+                      widget=widgets.Select),
+                FieldSet('set', fields=[
+                    Field('title', conv=convs.Char(),
+                          widget=widgets.Textarea)]),
+                FieldList('list', field=FieldSet(None, fields=[
+                    Field('name', conv=convs.Char())])),
+            ]
+        F.renderer = renderer
+        return F
+
+    def test_same_output(self):
+        env = self.env
+        data = MultiDict([('name', ''), ('hidden', '3'), ('flag', 'on'),
+                          ('set.title', '<b>'), ('list-indices', '1'),
+                          ('list-indices', '2'), ('list.1.name', 'First')])
+        forms = []
+        for renderer in [None, jnj.FormRenderer()]:
+            form = self.get_form(renderer)(env)
+            form.accept(data)
+            form.errors['name'] = 'Error'
+            forms.append(form)
+        default, compiled = forms
+        self.assertEqual(default.render(), compiled.render())
+        self.assertIn('First', compiled.render())
+        self.assertIn('Error', compiled.render())
+        for name in ['name', 'set', 'list']:
+            self.assertEqual(default.get_field(name).widget.render(),
+                             compiled.get_field(name).widget.render())
+
+    def test_compiled_once(self):
+        env = self.env
+        renderer = self.CountingRenderer()
+        F = self.get_form(renderer)
+        F(env).render()
+        # Layout and textinput, hiddeninput, checkbox, select, fieldset,
+        # textarea, fieldlist templates
+        self.assertEqual(renderer.compiled, 8)
+        F(env).render()
+        F(env).get_field('name').widget.render()
+        self.assertEqual(renderer.compiled, 8)
+
+    def test_changed_widget_template(self):
+        env = self.env
+        renderer = self.CountingRenderer()
+        form = self.get_form(renderer)(env)
+        form.render()
+        widget = form.get_field('name').widget
+        widget.template = 'widgets/span'
+        self.assertIn('<span', widget.render())
+        self.assertEqual(renderer.compiled, 9)
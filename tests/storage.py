@@ -34,6 +34,13 @@ class LocalMemStorageTest(unittest.TestCase):
         s.set('key', 'value')
         self.assertEqual(s.get('key'), 'value')
 
+    def test_add(self):
+        '`LocalMemStorage` add method'
+        s = LocalMemStorage()
+        self.assertEqual(s.add('key', 'value'), True)
+        self.assertEqual(s.add('key', 'value1'), False)
+        self.assertEqual(s.get('key'), 'value')
+
     def test_delete(self):
         '`LocalMemStorage` delete method'
         s = LocalMemStorage()
@@ -68,6 +75,12 @@ class MemcachedStorageTest(unittest.TestCase):
         self.storage.set('key', 'value')
         self.assertEqual(self.storage.get('key'), 'value')
 
+    def test_add(self):
+        '`MemcachedStorage` add method'
+        self.assertEqual(self.storage.add('key', 'value'), True)
+        self.assertEqual(self.storage.add('key', 'value1'), False)
+        self.assertEqual(self.storage.get('key'), 'value')
+
     def test_delete(self):
         '`MemcachedStorage` delete method'
         self.storage.delete('key')
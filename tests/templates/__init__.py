@@ -1,8 +1,14 @@
 import os
+import shutil
+import tempfile
 import unittest
 from iktomi import web
 from iktomi.templates import Template, TemplateError, BoundTemplate
-from iktomi.templates.jinja2 import TemplateEngine
+from iktomi.templates.jinja2 import TemplateEngine, StorageBytecodeCache, \
+        FragmentCache, FragmentCacheExtension
+from iktomi.templates.profile import TemplateProfile
+from iktomi.web.monitoring import Metrics
+from iktomi.storage import LocalMemStorage
 
 try:
     from unittest.mock import Mock
@@ -33,6 +39,20 @@ class TemplateTest(unittest.TestCase):
         self.assertIn('readonly="readonly"', rendered)
         self.assertIn('>Sample text<', rendered)
 
+    def test_render_to_stream(self):
+        widget = Mock(id=101, classname="big", input_name="big_input")
+        kwargs = dict(widget=widget, readonly=True, value="Sample text")
+        rendered = self.template.render('widgets/textarea', **kwargs)
+        stream = self.template.render_to_stream('widgets/textarea', **kwargs)
+        self.assertEqual(list(stream), [rendered])
+
+        self.template.stream_buffer_size = 10
+        chunks = list(self.template.render_to_stream('widgets/textarea',
+                                                     **kwargs))
+        self.assertTrue(len(chunks) > 1)
+        self.assertTrue(all(len(chunk) >= 10 for chunk in chunks[:-1]))
+        self.assertEqual(u''.join(chunks), rendered)
+
     def test_resolve(self):
         filename, engine = self.template.resolve('widgets/textarea')
         self.assertEqual(filename, 'widgets/textarea.html')
@@ -41,6 +61,199 @@ class TemplateTest(unittest.TestCase):
             self.template.resolve('nonexsistent/path')
 
 
+class BytecodeCacheTest(unittest.TestCase):
+
+    templates_dir = os.path.join(os.path.dirname(__file__), '..', '..',
+                                 'iktomi', 'templates', 'jinja2', 'templates')
+
+    def test_storage(self):
+        storage = LocalMemStorage()
+        engine = TemplateEngine(self.templates_dir, cache=storage)
+        self.assertIsInstance(engine.env.bytecode_cache, StorageBytecodeCache)
+        engine.compile('widgets/textarea.html')
+        keys = list(storage.storage)
+        self.assertEqual(len(keys), 1)
+        self.assertTrue(keys[0].startswith('jinja2/bytecode/'))
+
+        engine = TemplateEngine(self.templates_dir, cache=storage)
+        rendered = engine.render('widgets/textarea.html',
+                                 widget=Mock(id=1), value='text')
+        self.assertIn('>text<', rendered)
+        self.assertEqual(list(storage.storage), keys)
+
+    def test_directory(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        engine = TemplateEngine(self.templates_dir, cache=cache_dir)
+        engine.compile('widgets/textarea.html')
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+    def test_disabled(self):
+        engine = TemplateEngine(self.templates_dir)
+        self.assertEqual(engine.env.bytecode_cache, None)
+
+
+class FragmentCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.storage = LocalMemStorage()
+        self.engine = TemplateEngine([], extensions=[FragmentCacheExtension])
+        self.template = self.engine.env.from_string(
+                u'{% cache ("menu", lang), 60 %}<b>{{ value }}</b>'
+                u'{% endcache %}')
+
+    def render(self, lang='en', value='1'):
+        return self.template.render(lang=lang, value=value)
+
+    def test_disabled(self):
+        self.assertEqual(self.render(value='1'), u'<b>1</b>')
+        self.assertEqual(self.render(value='2'), u'<b>2</b>')
+
+    def test_cache(self):
+        self.engine.env.fragment_cache = FragmentCache(self.storage,
+                                                       local_ttl=0)
+        self.assertEqual(self.render(value='<1>'), u'<b>&lt;1&gt;</b>')
+        self.assertEqual(self.render(value='<2>'), u'<b>&lt;1&gt;</b>')
+        self.assertEqual(self.render(lang='ru', value='3'), u'<b>3</b>')
+
+    def test_invalidate(self):
+        fragment_cache = FragmentCache(self.storage, local_ttl=0)
+        self.engine.env.fragment_cache = fragment_cache
+        self.render(value='1')
+        keys = set(self.storage.storage)
+        fragment_cache.invalidate('menu')
+        self.assertEqual(self.render(value='2'), u'<b>2</b>')
+        # old fragment is orphaned, not deleted
+        self.assertTrue(keys < set(self.storage.storage))
+
+    def test_local_tier(self):
+        fragment_cache = FragmentCache(self.storage, local_ttl=60)
+        self.engine.env.fragment_cache = fragment_cache
+        self.render(value='1')
+        self.storage.storage.clear()
+        self.assertEqual(self.render(value='2'), u'<b>1</b>')
+
+        fragment_cache.local.ttl = -1
+        fragment_cache.local.items.clear()
+        self.assertEqual(self.render(value='3'), u'<b>3</b>')
+
+
+class TemplateIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        os.mkdir(os.path.join(self.dir, 'widgets'))
+        self.touch('widgets/input.html')
+        self.html = Mock()
+        self.txt = Mock()
+
+    def touch(self, name):
+        open(os.path.join(self.dir, name), 'w').close()
+
+    def replace_html_with_txt(self):
+        widgets_dir = os.path.join(self.dir, 'widgets')
+        os.unlink(os.path.join(widgets_dir, 'input.html'))
+        self.touch('widgets/input.txt')
+        # mtime resolution of some filesystems is too low
+        mtime = os.stat(widgets_dir).st_mtime + 10
+        os.utime(widgets_dir, (mtime, mtime))
+
+    def test_list_templates(self):
+        other_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, other_dir)
+        os.mkdir(os.path.join(other_dir, 'widgets'))
+        open(os.path.join(other_dir, 'widgets', 'input.html'), 'w').close()
+        open(os.path.join(other_dir, 'index.html'), 'w').close()
+        open(os.path.join(other_dir, 'style.css'), 'w').close()
+        template = Template(self.dir, other_dir, engines={'html': self.html})
+        self.assertEqual(list(template.list_templates()),
+                         [('widgets/input.html', self.html),
+                          ('index.html', self.html)])
+
+    def test_dev(self):
+        template = Template(self.dir,
+                            engines={'html': self.html, 'txt': self.txt})
+        self.assertEqual(template.resolve('widgets/input'),
+                         ('widgets/input.html', self.html))
+        self.assertEqual(template.resolve('widgets/input'),
+                         ('widgets/input.html', self.html))
+        self.replace_html_with_txt()
+        self.assertEqual(template.resolve('widgets/input'),
+                         ('widgets/input.txt', self.txt))
+
+    def test_frozen(self):
+        template = Template(self.dir, cache=True,
+                            engines={'html': self.html, 'txt': self.txt})
+        self.assertEqual(template.resolve('widgets/input'),
+                         ('widgets/input.html', self.html))
+        self.replace_html_with_txt()
+        self.assertEqual(template.resolve('widgets/input'),
+                         ('widgets/input.html', self.html))
+        with self.assertRaises(TemplateError):
+            template.resolve('widgets/missing')
+
+
+class PlainEngine(object):
+
+    def render(self, template_name, **kw):
+        return 'text'
+
+
+class TemplateProfileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.write('base.html', '<html>{% block body %}{% endblock %}</html>')
+        self.write('page.html', '{% extends "base.html" %}{% block body %}'
+                                '{% include "item.html" %}'
+                                '{% include "item.html" %}{% endblock %}')
+        self.write('item.html', '<p>{{ value }}</p>')
+        self.write('plain.txt', 'text')
+        self.profile = TemplateProfile(Metrics())
+        self.engine = TemplateEngine(self.dir)
+        self.template = Template(self.dir, profile=self.profile, engines={
+            'html': self.engine,
+            'txt': PlainEngine(),
+        })
+
+    def write(self, name, content):
+        with open(os.path.join(self.dir, name), 'w') as f:
+            f.write(content)
+
+    def stats(self):
+        return dict((stat['template'], stat) for stat in self.profile.stats())
+
+    def test_nested(self):
+        self.assertIs(self.engine.profile, self.profile)
+        self.template.render('page', value=1)
+        stats = self.stats()
+        self.assertEqual(sorted(stats), ['base.html', 'item.html',
+                                         'page.html'])
+        self.assertEqual(stats['item.html']['calls'], 2)
+        self.assertEqual(stats['item.html']['size'], 16)
+        self.assertEqual(stats['base.html']['size'], 29)
+        page = stats['page.html']
+        self.assertEqual(page['calls'], 1)
+        self.assertTrue(page['self_time'] <= page['time'])
+        self.assertTrue(stats['base.html']['time'] <= page['time'])
+
+    def test_other_engines(self):
+        self.template.render('plain')
+        self.assertEqual(list(self.template.render_to_stream('plain')),
+                         ['text'])
+        stats = self.stats()
+        self.assertEqual(stats['plain.txt']['calls'], 2)
+        self.assertEqual(stats['plain.txt']['size'], 8)
+
+    def test_disabled(self):
+        engine = TemplateEngine(self.dir)
+        template = Template(self.dir, engines={'html': engine})
+        self.assertEqual(template.render('item', value=1), '<p>1</p>')
+        self.assertIs(engine.profile, None)
+
+
 class BoundTemplateTest(unittest.TestCase):
 
     def setUp(self):
@@ -68,6 +281,17 @@ class BoundTemplateTest(unittest.TestCase):
         self.assertEqual(self.bound._vars(env),
                          {'readonly':True, 'foo':'bar', 'request':None, 'root':None})
 
+    def test_context(self):
+        self.assertEqual(dict(self.bound._context(None)), {'readonly':True})
+        context = self.bound._context({'foo':'bar'}, readonly=False, a=1)
+        self.assertEqual(dict(context),
+                         {'readonly':True, 'foo':'bar', 'a':1})
+        env = web.AppEnvironment.create(foo='bar')
+        env.defer(len, [])
+        self.assertEqual(dict(self.bound._context(env)),
+                         {'readonly':True, 'foo':'bar', 'request':None,
+                          'root':None})
+
     def test_render(self):
         widget = Mock(id=111,
                       classname="big",)
@@ -94,3 +318,18 @@ class BoundTemplateTest(unittest.TestCase):
         self.assertIn('class="big"', rendered)
         self.assertIn('readonly="readonly"', rendered)
         self.assertIn('>Sample text<', rendered)
+
+    def test_stream_to_response(self):
+        widget = Mock(id=111,
+                      classname="big",)
+        response = self.bound.stream_to_response('widgets/textarea',
+                                                 {'widget':widget,
+                                                  'value':"Sample text"})
+        self.assertIn('text/html', response.headers['Content-Type'])
+        self.assertNotIn('Content-Length', response.headers)
+
+        rendered = b''.join(response.app_iter).decode('utf-8')
+        self.assertIn('<textarea', rendered)
+        self.assertIn('id="111"', rendered)
+        self.assertIn('readonly="readonly"', rendered)
+        self.assertIn('>Sample text<', rendered)
@@ -3,7 +3,7 @@
 import unittest
 from iktomi.utils import (
     quoteattr, quoteattrs, quote_js, weakproxy,
-    cached_property, cached_class_property,
+    cached_property, cached_class_property, ChainMapping,
 )
 
 
@@ -49,6 +49,20 @@ class Tests(unittest.TestCase):
         with self.assertRaises(ReferenceError):
             p.a
 
+    def test_chain_mapping(self):
+        first = {'a': 1}
+        second = {'a': 2, 'b': 3}
+        mapping = ChainMapping(first, second)
+        self.assertEqual(mapping['a'], 1)
+        self.assertEqual(mapping['b'], 3)
+        self.assertNotIn('c', mapping)
+        self.assertEqual(mapping.get('c', 4), 4)
+        self.assertEqual(sorted(mapping), ['a', 'b'])
+        self.assertEqual(len(mapping), 2)
+        # mappings are not copied
+        first['c'] = 5
+        self.assertEqual(dict(mapping), {'a': 1, 'b': 3, 'c': 5})
+
     def test_cached_property(self):
         class C(object):
             def __init__(self):
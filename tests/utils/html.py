@@ -6,6 +6,7 @@ from iktomi.utils import html
 from lxml.html import Element
 from lxml import etree
 import lxml.html as h
+from iktomi.storage import LocalMemStorage
 
 class TestSanitizer(unittest.TestCase):
     '''Tests for sanitizer based on lxml'''
@@ -327,6 +328,108 @@ class TestSanitizer(unittest.TestCase):
         self.assertRaises(ValueError, html.Cleaner, **self.attrs)
 
 
+class TestSinglePassSanitizer(TestSanitizer):
+    '''The same tests for single pass mode of sanitizer'''
+
+    def setUp(self):
+        TestSanitizer.setUp(self)
+        self.attrs['single_pass'] = True
+
+    def test_same_output(self):
+        self.attrs['allow_classes'] = {'p': set(['lead']), 'a': set()}
+        self.attrs['tags_to_wrap'] = ['b', 'i', 'br']
+        self.attrs['safe_attrs'] += ['cite', 'longdesc']
+        text = ('lead<b>bold</b><br>'
+                '<p class="lead note">p <a href="javascript:x()">js</a>'
+                '<a>no href</a><a href="/rel" class="x">rel</a></p>'
+                '<img src="http://example.com/a.png" longdesc="ftp://a">'
+                '<img src="/local.png" longdesc="/desc">'
+                '<blockquote cite="http://example.com">q<br>t</blockquote>'
+                '<p>a<br><i></i><br>b</p><u><b> </b></u>')
+        expected = html.sanitize(text, **dict(self.attrs, single_pass=False))
+        self.assertSanitize(text, expected)
+
+
+class TestSanitizeCache(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+        self.attrs = {'allow_tags': ['p', 'b'],
+                      'allow_classes': {},
+                      'tags_to_wrap': []}
+
+    def count_calls(self, doc):
+        self.calls.append(h.tostring(doc))
+
+    def sanitize(self, text, cache, **kwargs):
+        kwargs = dict(self.attrs, dom_callbacks=[self.count_calls], **kwargs)
+        return html.sanitize(text, cache=cache, **kwargs)
+
+    def test_local(self):
+        cache = html.SanitizeCache(local_size=2)
+        self.assertEqual(self.sanitize('<p>a<i>b</i></p>', cache),
+                         '<p>ab</p>')
+        self.assertEqual(self.sanitize('<p>a<i>b</i></p>', cache),
+                         '<p>ab</p>')
+        self.assertEqual(len(self.calls), 1)
+        # options are a part of the key
+        self.assertEqual(self.sanitize('<p>a<i>b</i></p>', cache,
+                                       allow_tags=['p', 'i']),
+                         '<p>a<i>b</i></p>')
+        self.assertEqual(len(self.calls), 2)
+        # the least recently used value is dropped
+        self.sanitize('<p>c</p>', cache)
+        self.sanitize('<p>a<i>b</i></p>', cache)
+        self.assertEqual(len(self.calls), 4)
+
+    def test_storage(self):
+        storage = LocalMemStorage()
+        cleaner = html.Cleaner(**self.attrs)
+        cache = html.SanitizeCache(storage=storage)
+        self.assertEqual(cache.clean('<b>a</b>', cleaner), '<b>a</b>')
+        key = cache.key('<b>a</b>', cleaner)
+        self.assertEqual(storage.get(key), '<b>a</b>')
+        # other process with equal cleaner
+        storage.set(key, 'cached')
+        self.assertEqual(html.SanitizeCache(storage=storage).clean(
+                                '<b>a</b>', html.Cleaner(**self.attrs)),
+                         'cached')
+
+    def test_identified_options(self):
+        storage = LocalMemStorage()
+        cache = html.SanitizeCache(storage=storage)
+        def upper(doc):
+            for el in doc.iter():
+                el.text = el.text and el.text.upper()
+        def clean(callback):
+            return cache.clean('<p>abc</p>',
+                               html.Cleaner(allow_tags=['p'],
+                                            dom_callbacks=[callback]))
+        # the first lambda is freed, so the second one may get its id
+        self.assertEqual(clean(lambda doc: upper(doc)), '<p>ABC</p>')
+        self.assertEqual(clean(lambda doc: None), '<p>abc</p>')
+        # results are not shared with other processes
+        self.assertEqual(storage.storage, {})
+
+    def test_fingerprint(self):
+        cache = html.SanitizeCache()
+        def fingerprint(**kwargs):
+            return cache.fingerprint(html.Cleaner(**dict(self.attrs,
+                                                         **kwargs)))
+        self.assertEqual(fingerprint(allow_tags=set(['p', 'b'])),
+                         fingerprint(allow_tags=set(['b', 'p'])))
+        self.assertEqual(fingerprint(dom_callbacks=[spaceless]),
+                         fingerprint(dom_callbacks=[spaceless]))
+        callbacks = [lambda doc: None, lambda doc: None]
+        self.assertNotEqual(fingerprint(dom_callbacks=callbacks[:1]),
+                            fingerprint(dom_callbacks=callbacks[1:]))
+        self.assertNotEqual(fingerprint(), fingerprint(single_pass=True))
+        self.assertNotEqual(
+                cache.fingerprint(html.Cleaner(**self.attrs)),
+                html.SanitizeCache(version='2').fingerprint(
+                        html.Cleaner(**self.attrs)))
+
+
 def spaceless(clean, **kwargs):
     clean = re.compile('\s+').sub(' ', clean)
     return clean.strip()
@@ -31,6 +31,29 @@ class VersionedStorageTests(unittest.TestCase):
         self.assertEqual(b.as_dict(), {'a': 1, 'b': 2})
         self.assertEqual(c.as_dict(), {'a': 1, 'b': 4, 'c': 3})
 
+    def test_as_mapping(self):
+        'VersionedStorage as_mapping method'
+        vs = VersionedStorage(a=1)
+        mapping = vs.as_mapping()
+        vs._push(b=2)
+        vs._push(c=3, b=4)
+        self.assertEqual(mapping['b'], 4)
+        self.assertNotIn('_parent_storage', mapping)
+        self.assertNotIn('_root_storage', mapping)
+        self.assertEqual(dict(mapping), vs.as_dict())
+        self.assertEqual(len(mapping), 3)
+        vs._pop()
+        self.assertEqual(dict(mapping), {'a': 1, 'b': 2})
+
+    def test_hidden_attrs(self):
+        'StorageFrame service attributes are not included in as_dict'
+        class Env(StorageFrame):
+            _hidden_attrs = StorageFrame._hidden_attrs | set(['_private'])
+        vs = VersionedStorage(Env, a=1, _private=2)
+        vs._push(b=3)
+        self.assertEqual(vs.as_dict(), {'a': 1, 'b': 3})
+        self.assertEqual(dict(vs.as_mapping()), {'a': 1, 'b': 3})
+
     def test_push_pop(self):
         'VersionedStorage push/pop'
         vs = VersionedStorage(a=1)
@@ -1,13 +1,14 @@
 # -*- coding: utf-8 -*-
 
-__all__ = ['ApplicationTests']
+__all__ = ['ApplicationTests', 'DeferTests']
 
 import sys
 import unittest
 from webob import Response, Request
 from webob.exc import HTTPMethodNotAllowed
 from iktomi import web
-from iktomi.web.app import Application, AppEnvironment, is_host_valid
+from iktomi.web.app import Application, AppEnvironment, is_host_valid, \
+                           DeferredExecutor
 from iktomi.utils.storage import VersionedStorage
 from iktomi.utils import cached_property
 # import as TA because py.test generates warning about TestApp name
@@ -111,6 +112,63 @@ class ApplicationTests(unittest.TestCase):
         app.get('http://.example.com/', status=404)
 
 
+class DeferTests(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+        def handler(env, data):
+            env.defer(self.calls.append, 'first')
+            env.defer(lambda: 1+'')
+            env.defer(self.calls.append, 'second')
+            self.calls.append('handler')
+            return Response(body='index')
+        self.wsgi_app = Application(web.match('/', 'index') | handler)
+        self.errors = []
+        def handle_error(env):
+            _, e, _ = sys.exc_info()
+            self.errors.append(e)
+        self.wsgi_app.handle_error = handle_error
+
+    def test_defer(self):
+        self.assertEqual(TA(self.wsgi_app).get('/').body, b'index')
+        self.assertEqual(self.calls, ['handler', 'first', 'second'])
+        self.assertEqual(len(self.errors), 1)
+        self.assertIsInstance(self.errors[0], TypeError)
+
+    def test_defer_after_close(self):
+        environ = {
+            'SERVER_NAME': 'localhost',
+            'SERVER_PORT': '80',
+            'REQUEST_METHOD': 'GET',
+            'SCRIPT_NAME': '',
+            'PATH_INFO': '/',
+            'HTTP_HOST': 'localhost'
+        }
+        result = self.wsgi_app(environ, lambda status, headers: None)
+        self.assertEqual(b''.join(result), b'index')
+        self.assertEqual(self.calls, ['handler'])
+        result.close()
+        self.assertEqual(self.calls, ['handler', 'first', 'second'])
+
+    def test_executor(self):
+        executor = DeferredExecutor(workers=2)
+        self.wsgi_app.deferred_executor = executor
+        TA(self.wsgi_app).get('/')
+        executor.queue.join()
+        self.assertEqual(sorted(self.calls), ['first', 'handler', 'second'])
+        self.assertEqual(len(self.errors), 1)
+        self.assertEqual(executor.depth, 0)
+
+    def test_executor_full(self):
+        executor = DeferredExecutor(workers=0, queue_size=1)
+        self.wsgi_app.deferred_executor = executor
+        TA(self.wsgi_app).get('/')
+        # the first task is queued, others are called in place
+        self.assertEqual(executor.depth, 1)
+        self.assertEqual(self.calls, ['handler', 'second'])
+        self.assertEqual(len(self.errors), 1)
+
+
 class HostnameValidationTest(unittest.TestCase):
 
     def test_host_name_validity(self):
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+
+__all__ = ['CachePageTests', 'CoalesceTests', 'ConditionalTests']
+
+import time
+import threading
+import unittest
+from datetime import datetime
+from webob import Response
+from iktomi import web
+from iktomi.web.app import Application
+from iktomi.storage import LocalMemStorage
+from webtest import TestApp as TA
+
+
+class CachePageTests(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = calls = []
+        self.storage = LocalMemStorage()
+
+        def item(env, data):
+            calls.append(data.id)
+            response = Response(body=u'{} {}'.format(data.id, len(calls)))
+            if 'set_cookie' in env.request.GET:
+                response.set_cookie('a', 'b')
+            return response
+
+        self.page_cache = web.cache_page(60, storage=self.storage,
+                                         vary=['Accept'], stale_ttl=60)
+        self.app = TA(Application(web.cases(
+            web.prefix('/news', name='news') | web.cases(
+                web.match('/<int:id>', 'item') | self.page_cache | item,
+                web.match('/auth/<int:id>', 'auth') | \
+                        web.request_filter(self._login) | \
+                        self.page_cache | item,
+            ),
+        )))
+
+    def _login(self, env, data, next_handler):
+        env.user = 'user'
+        return next_handler(env, data)
+
+    def test_storage_required(self):
+        # there is no unbounded in-process default
+        self.assertRaises(TypeError, web.cache_page, 60)
+
+    def test_cache(self):
+        self.assertEqual(self.app.get('/news/1').text, '1 1')
+        self.assertEqual(self.app.get('/news/1').text, '1 1')
+        self.assertEqual(self.app.get('/news/2').text, '2 2')
+        self.assertEqual(self.app.get('/news/1?a=1').text, '1 3')
+        self.assertEqual(self.app.get('/news/1',
+                                      headers={'Accept': 'text/html'}).text,
+                         '1 4')
+        self.assertEqual(self.calls, [1, 2, 1, 1])
+
+    def test_not_cacheable(self):
+        self.app.post('/news/1')
+        self.app.post('/news/1')
+        self.app.get('/news/1?set_cookie=1')
+        self.app.get('/news/1?set_cookie=1')
+        self.app.get('/news/auth/1')
+        self.app.get('/news/auth/1')
+        self.app.get('/news/2/missing', status=404)
+        self.assertEqual(self.calls, [1] * 6)
+
+    def test_invalidate(self):
+        self.app.get('/news/1')
+        self.app.get('/news/1')
+        self.page_cache.invalidate('news.item')
+        self.assertEqual(self.app.get('/news/1').text, '1 2')
+        self.assertEqual(self.app.get('/news/1').text, '1 2')
+
+    def test_stale(self):
+        self.app.get('/news/1')
+        key, = [k for k in self.storage.storage if 'version' not in k]
+        entry = self.storage.storage[key]
+        stale = (time.time() - 1,) + tuple(entry[1:])
+        self.storage.storage[key] = stale
+
+        calls = []
+        def regenerate(env, data):
+            # concurrent requests are served with the stale copy
+            calls.append(self.app.get('/news/1').text)
+            return Response(body='fresh')
+        app = TA(Application(web.prefix('/news', name='news') | \
+                             web.match('/<int:id>', 'item') | \
+                             self.page_cache | regenerate))
+        self.assertEqual(app.get('/news/1').text, 'fresh')
+        self.assertEqual(calls, ['1 1'])
+        self.assertEqual(self.app.get('/news/1').text, 'fresh')
+
+        # stale period is over
+        self.storage.storage[key] = (time.time() - 61,) + tuple(entry[1:])
+        self.assertEqual(self.app.get('/news/1').text, '1 2')
+
+
+class CoalesceTests(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+        self.release = threading.Event()
+        self.storage = LocalMemStorage()
+
+    def handler(self, env, data):
+        self.calls.append(env.request.path_qs)
+        body = u'{}'.format(len(self.calls))
+        self.release.wait(5)
+        response = Response(body=body)
+        if 'set_cookie' in env.request.GET:
+            response.set_cookie('a', 'b')
+        return response
+
+    def make_app(self, **kwargs):
+        coalesce = web.coalesce(**kwargs)
+        return Application(web.match('/', 'index') | coalesce | self.handler)
+
+    def run_concurrently(self, apps, urls):
+        results = []
+        def request(app, url):
+            results.append(TA(app).get(url).text)
+        threads = [threading.Thread(target=request, args=(app, url))
+                   for app, url in zip(apps, urls)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.2)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        return sorted(results)
+
+    def test_process(self):
+        app = self.make_app()
+        results = self.run_concurrently([app] * 5, ['/'] * 4 + ['/?a=1'])
+        self.assertEqual(results, ['1', '1', '1', '1', '2'])
+        self.assertEqual(sorted(self.calls), ['/', '/?a=1'])
+
+    def test_storage(self):
+        # handlers with separate in-process state emulate processes
+        apps = [self.make_app(storage=self.storage) for i in range(4)]
+        results = self.run_concurrently(apps, ['/'] * 4)
+        self.assertEqual(results, ['1'] * 4)
+        self.assertEqual(self.calls, ['/'])
+        self.assertEqual(self.storage.get('coalesce:lock'), None)
+
+    def test_not_shareable(self):
+        apps = [self.make_app(storage=self.storage)] * 2 + \
+               [self.make_app(storage=self.storage)]
+        self.run_concurrently(apps, ['/?set_cookie=1'] * 3)
+        self.assertEqual(len(self.calls), 3)
+
+    def test_timeout(self):
+        apps = [self.make_app(storage=self.storage, timeout=0.05)] * 2 + \
+               [self.make_app(storage=self.storage, timeout=0.05)]
+        self.run_concurrently(apps, ['/'] * 3)
+        self.assertEqual(len(self.calls), 3)
+
+
+class ConditionalTests(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = calls = []
+        def item(env, data):
+            calls.append(data.id)
+            return Response(body=u'item')
+        def etag(env, data):
+            return data.id if data.id < 10 else None
+        def last_modified(env, data):
+            return datetime(2020, 1, data.id, 0, 0, 0, 500)
+        self.app = TA(Application(web.cases(
+            web.match('/etag/<int:id>', 'etag') | \
+                    web.conditional(etag_func=etag) | item,
+            web.match('/modified/<int:id>', 'modified') | \
+                    web.conditional(last_modified_func=last_modified) | item,
+        )))
+
+    def test_etag(self):
+        response = self.app.get('/etag/1')
+        self.assertEqual(response.headers['ETag'], '"1"')
+        self.app.get('/etag/1', headers={'If-None-Match': '"1"'}, status=304)
+        self.app.get('/etag/1', headers={'If-None-Match': 'W/"2", W/"1"'},
+                     status=304)
+        self.app.get('/etag/1', headers={'If-None-Match': '*'}, status=304)
+        self.app.get('/etag/2', headers={'If-None-Match': '"1"'}, status=200)
+        response = self.app.get('/etag/10', headers={'If-None-Match': '*'})
+        self.assertNotIn('ETag', response.headers)
+        self.app.post('/etag/1', headers={'If-None-Match': '"1"'}, status=200)
+        self.assertEqual(self.calls, [1, 2, 10, 1])
+
+    def test_last_modified(self):
+        response = self.app.get('/modified/1')
+        self.assertEqual(response.headers['Last-Modified'],
+                         'Wed, 01 Jan 2020 00:00:00 GMT')
+        self.app.get('/modified/1', status=304, headers={
+            'If-Modified-Since': 'Wed, 01 Jan 2020 00:00:00 GMT'})
+        self.app.get('/modified/2', status=200, headers={
+            'If-Modified-Since': 'Wed, 01 Jan 2020 00:00:00 GMT'})
+        # If-None-Match takes precedence
+        self.app.get('/modified/1', status=200, headers={
+            'If-Modified-Since': 'Wed, 01 Jan 2020 00:00:00 GMT',
+            'If-None-Match': '"1"'})
+        self.assertEqual(self.calls, [1, 2, 1])
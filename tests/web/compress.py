@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+__all__ = ['CompressTests']
+
+import zlib
+import gzip
+import unittest
+from io import BytesIO
+from webob import Request, Response
+from iktomi import web
+from iktomi.web.app import Application
+from iktomi.web.compress import parse_accept_encoding
+
+
+class CompressTests(unittest.TestCase):
+
+    def setUp(self):
+        self.closed = closed = []
+        self.body = body = b'<p>iktomi</p>' * 200
+
+        def page(env, data):
+            response = Response(body=body)
+            response.etag = 'page'
+            return response
+
+        def small(env, data):
+            return Response(body=b'small')
+
+        def image(env, data):
+            return Response(body=body, content_type='image/png')
+
+        def svg(env, data):
+            return Response(body=body, content_type='image/svg+xml')
+
+        class AppIter(object):
+            def __iter__(self):
+                for i in range(200):
+                    yield b'<p>iktomi</p>'
+            def close(self):
+                closed.append(True)
+
+        def partial(env, data):
+            response = Response(body=body[:2000], status=206)
+            response.content_range = (0, 2000, len(body))
+            return response
+
+        def stream(env, data):
+            return Response(app_iter=AppIter())
+
+        self.app = Application(web.compress() | web.cases(
+            web.match('/', 'page') | page,
+            web.match('/small', 'small') | small,
+            web.match('/image', 'image') | image,
+            web.match('/svg', 'svg') | svg,
+            web.match('/partial', 'partial') | partial,
+            web.match('/stream', 'stream') | stream,
+        ))
+
+    def get(self, url, encoding='gzip, deflate'):
+        # webtest decodes responses, so webob is used
+        request = Request.blank(url, headers={'Accept-Encoding': encoding})
+        return request.get_response(self.app)
+
+    def test_gzip(self):
+        response = self.get('/')
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(response.headers['Vary'], 'Accept-Encoding')
+        self.assertEqual(response.headers['ETag'], 'W/"page"')
+        self.assertNotIn('Content-Length', response.headers)
+        body = gzip.GzipFile(fileobj=BytesIO(response.body)).read()
+        self.assertEqual(body, self.body)
+
+    def test_deflate(self):
+        response = self.get('/', 'gzip;q=0, deflate;q=0.5')
+        self.assertEqual(response.headers['Content-Encoding'], 'deflate')
+        self.assertEqual(zlib.decompress(response.body), self.body)
+
+    def test_not_accepted(self):
+        for encoding in ['', 'identity', 'gzip;q=0', '*;q=0']:
+            response = self.get('/', encoding)
+            self.assertNotIn('Content-Encoding', response.headers)
+            self.assertEqual(response.headers['Vary'], 'Accept-Encoding')
+            self.assertEqual(response.body, self.body)
+
+    def test_skipped(self):
+        for url in ['/small', '/image']:
+            response = self.get(url)
+            self.assertNotIn('Content-Encoding', response.headers)
+        response = self.get('/svg')
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+
+    def test_partial(self):
+        response = self.get('/partial')
+        self.assertEqual(response.status_int, 206)
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(response.body, self.body[:2000])
+        # range of full response
+        response = Response(body=self.body)
+        response.content_range = (0, len(self.body), len(self.body))
+        self.assertFalse(web.compress().is_compressible(response))
+
+    def test_stream(self):
+        response = self.get('/stream', 'gzip')
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        body = gzip.GzipFile(fileobj=BytesIO(response.body)).read()
+        self.assertEqual(body, self.body)
+        self.assertEqual(self.closed, [True])
+
+    def test_stream_flush(self):
+        request = Request.blank('/stream',
+                                headers={'Accept-Encoding': 'deflate'})
+        response = request.get_response(self.app)
+        app_iter = iter(response.app_iter)
+        decompressor = zlib.decompressobj()
+        # each chunk is decodable as soon as it is sent
+        for i in range(3):
+            self.assertEqual(decompressor.decompress(next(app_iter)),
+                             b'<p>iktomi</p>')
+        response.app_iter.close()
+        self.assertEqual(self.closed, [True])
+
+    def test_close_not_started(self):
+        # server closes the body without iterating it (HEAD request or
+        # client disconnect)
+        request = Request.blank('/stream',
+                                headers={'Accept-Encoding': 'gzip'})
+        headers = []
+        app_iter = self.app(request.environ,
+                            lambda status, h, exc_info=None: headers.extend(h))
+        self.assertIn(('Content-Encoding', 'gzip'), headers)
+        app_iter.close()
+        self.assertEqual(self.closed, [True])
+
+    def test_parse_accept_encoding(self):
+        self.assertEqual(parse_accept_encoding('gzip;q=0.5, BR, x;q=y'),
+                         {'gzip': 0.5, 'br': 1.0, 'x': 0.0})
@@ -7,6 +7,8 @@ import tempfile, shutil
 import os
 from iktomi import web
 from iktomi.web.app import Application
+from iktomi.web.route_state import RouteState
+from iktomi.utils.storage import VersionedStorage
 from webtest import TestApp as TA
 from webob import Response
 
@@ -240,6 +242,13 @@ class Match(unittest.TestCase):
         self.assertEqual(web.ask(app, '/first').status_int, 200)
         self.assertEqual(web.ask(app, '/second'), None)
 
+    def test_custom_env(self):
+        '''Match works with environment having no timing'''
+        app = web.match('/first', 'first') | (lambda e,d: Response())
+        env = VersionedStorage()
+        env._route_state = RouteState(web.Request.blank('/first'))
+        self.assertEqual(app(env, VersionedStorage()).status_int, 200)
+
     def test_int_converter(self):
         '''Check int converter'''
 
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+
+__all__ = ['MetricsTests', 'MeteredStorageTests', 'ApplicationMetricsTests']
+
+import os
+import json
+import shutil
+import signal
+import tempfile
+import threading
+import unittest
+from webob import Response
+from iktomi import web
+from iktomi.web.app import Application
+from iktomi.web.monitoring import Metrics, MeteredStorage
+from iktomi.storage import LocalMemStorage
+from webtest import TestApp as TA
+
+
+class MetricsTests(unittest.TestCase):
+
+    def test_render(self):
+        metrics = Metrics(buckets=[0.1, 1])
+        metrics.inc('hits_total', location='news')
+        metrics.inc('hits_total', 2, location='news')
+        metrics.inc('hits_total', location='say "hi"\n')
+        metrics.add('in_progress', 1)
+        metrics.observe('latency_seconds', 0.5)
+        metrics.observe('latency_seconds', 5)
+        self.assertEqual(metrics.render().splitlines(), [
+            '# TYPE hits_total counter',
+            'hits_total{location="news"} 3',
+            'hits_total{location="say \\"hi\\"\\n"} 1',
+            '# TYPE in_progress gauge',
+            'in_progress 1',
+            '# TYPE latency_seconds histogram',
+            'latency_seconds_bucket{le="0.1"} 0',
+            'latency_seconds_bucket{le="1.0"} 1',
+            'latency_seconds_bucket{le="+Inf"} 2',
+            'latency_seconds_sum 5.5',
+            'latency_seconds_count 2',
+        ])
+
+    def test_threads(self):
+        metrics = Metrics()
+        def worker():
+            for i in range(1000):
+                metrics.inc('hits_total')
+        threads = [threading.Thread(target=worker) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        counters, gauges, histograms = metrics.snapshot()
+        self.assertEqual(counters['hits_total', ()], 4000)
+        # shards of exited threads are merged
+        self.assertEqual(len(metrics._shards), 0)
+        metrics.inc('hits_total')
+        self.assertEqual(len(metrics._shards), 1)
+        counters, gauges, histograms = metrics.snapshot()
+        self.assertEqual(counters['hits_total', ()], 4001)
+
+    def test_fork(self):
+        metrics = Metrics()
+        metrics.inc('hits_total')
+        pid = os.fork()
+        if not pid:
+            # values of parent process are not inherited, and releasing
+            # them doesn't deadlock
+            signal.alarm(5)
+            metrics.inc('hits_total')
+            counters, gauges, histograms = metrics.snapshot()
+            os._exit(0 if counters['hits_total', ()] == 1 else 1)
+        self.assertEqual(os.waitpid(pid, 0), (pid, 0))
+        counters, gauges, histograms = metrics.snapshot()
+        self.assertEqual(counters['hits_total', ()], 1)
+
+    def test_processes(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        metrics = Metrics(path=path, flush_interval=3600)
+        metrics.inc('hits_total')
+        metrics.add('in_progress', 1)
+        # a file written by another (exited) worker
+        other = {'buckets': list(metrics.buckets),
+                 'counters': [['hits_total', [], 2]],
+                 'gauges': [['in_progress', [], 5]],
+                 'histograms': []}
+        with open(os.path.join(path, '999999999.json'), 'w') as f:
+            json.dump(other, f)
+        counters, gauges, histograms = metrics.collect()
+        self.assertEqual(counters['hits_total', ()], 3)
+        self.assertEqual(gauges['in_progress', ()], 1)
+        # the file is merged into exited processes' file
+        self.assertEqual(sorted(os.listdir(path)),
+                         ['exited.json', 'exited.json.lock'])
+        with open(os.path.join(path, '999999998.json'), 'w') as f:
+            json.dump(other, f)
+        counters, gauges, histograms = metrics.collect()
+        self.assertEqual(counters['hits_total', ()], 5)
+        self.assertEqual(gauges['in_progress', ()], 1)
+        self.assertNotIn('999999998.json', os.listdir(path))
+
+        metrics.flush()
+        with open(os.path.join(path, '{}.json'.format(os.getpid()))) as f:
+            self.assertEqual(json.load(f)['counters'],
+                             [['hits_total', [], 1]])
+        # own file is not counted twice
+        counters, gauges, histograms = metrics.collect()
+        self.assertEqual(counters['hits_total', ()], 5)
+
+    def test_reused_pid(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        metrics = Metrics(path=path, flush_interval=3600)
+        # a file of exited process with the same PID
+        other = {'buckets': list(metrics.buckets),
+                 'counters': [['hits_total', [], 2]],
+                 'gauges': [['in_progress', [], 5]],
+                 'histograms': []}
+        with open(os.path.join(path, '{}.json'.format(os.getpid())),
+                  'w') as f:
+            json.dump(other, f)
+        metrics.inc('hits_total')
+        metrics.flush()
+        counters, gauges, histograms = metrics.collect()
+        self.assertEqual(counters['hits_total', ()], 3)
+        self.assertEqual(gauges['in_progress', ()], 0)
+
+
+class MeteredStorageTests(unittest.TestCase):
+
+    def test_hit_ratio(self):
+        metrics = Metrics()
+        storage = MeteredStorage(LocalMemStorage(), metrics, name='mem')
+        storage.set('key', 'value')
+        self.assertEqual(storage.get('key'), 'value')
+        self.assertEqual(storage.get('missing', 'default'), 'default')
+        self.assertEqual(storage.get('missing'), None)
+        storage.delete('key')
+        self.assertEqual(storage.get('key'), None)
+        lines = metrics.render().splitlines()
+        self.assertIn('iktomi_storage_hit_ratio{storage="mem"} 0.25', lines)
+        self.assertIn('iktomi_storage_requests_total'
+                      '{result="miss",storage="mem"} 3', lines)
+
+
+class ApplicationMetricsTests(unittest.TestCase):
+
+    def test_metrics(self):
+        registry = Metrics()
+        in_progress = []
+        def handler(env, data):
+            counters, gauges, histograms = registry.snapshot()
+            in_progress.append(gauges['iktomi_requests_in_progress', ()])
+            return Response(body='index')
+        def error(env, data):
+            raise ValueError()
+        app = web.cases(
+            web.match('/', 'index') | handler,
+            web.match('/error', 'error') | error,
+            web.match('/_metrics', 'metrics') | web.metrics(registry),
+        )
+        wsgi_app = Application(app, metrics=registry)
+        TA(wsgi_app).get('/')
+        TA(wsgi_app).get('/')
+        TA(wsgi_app).get('/missing', status=404)
+        TA(wsgi_app).get('/error', status=500)
+        self.assertEqual(in_progress, [1, 1])
+
+        response = TA(wsgi_app).get('/_metrics')
+        self.assertEqual(response.content_type, 'text/plain')
+        lines = response.text.splitlines()
+        self.assertIn('iktomi_requests_total'
+                      '{location="index",status="200"} 2', lines)
+        self.assertIn('iktomi_requests_total'
+                      '{location="",status="404"} 1', lines)
+        self.assertIn('iktomi_requests_total'
+                      '{location="error",status="500"} 1', lines)
+        self.assertIn('iktomi_requests_in_progress 1', lines)
+        self.assertIn('iktomi_request_duration_seconds_count'
+                      '{location="index"} 2', lines)
+        self.assertIn('iktomi_request_phase_seconds_count'
+                      '{phase="routing"} 3', lines)
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+__all__ = ['RequestTimingTests', 'HistogramTests', 'ApplicationTimingTests']
+
+import logging
+import unittest
+from webob import Response
+from iktomi import web
+from iktomi.web.app import Application
+from iktomi.web.timing import RequestTiming, Histogram, TimingStats
+from webtest import TestApp as TA
+try:
+    from unittest import mock
+except ImportError: # pragma: no cover, python 2
+    import mock
+
+
+class Clock(object):
+    '''Replaces `time` module in `iktomi.web.timing`, time passes by
+    `sleep` calls only'''
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class RequestTimingTests(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        patcher = mock.patch('iktomi.web.timing.time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_phase(self):
+        timing = RequestTiming()
+        with timing.phase('template'):
+            with timing.phase('template'):
+                self.clock.sleep(0.01)
+        with timing.phase('db'):
+            pass
+        self.assertEqual(list(timing.phases), ['template', 'db'])
+        self.assertAlmostEqual(timing.phases['template'], 0.01)
+        self.assertIn('template;dur=10.0', timing.server_timing())
+        self.assertIn('db;dur=0.0', timing.server_timing())
+
+    def test_handling(self):
+        timing = RequestTiming()
+        with timing.handling():
+            with timing.phase('template'):
+                self.clock.sleep(0.01)
+            self.clock.sleep(0.002)
+        self.assertAlmostEqual(timing.phases['handler'], 0.002)
+        self.assertAlmostEqual(timing.phases['template'], 0.01)
+
+
+class HistogramTests(unittest.TestCase):
+
+    def test_observe(self):
+        histogram = Histogram(buckets=[1, 0.1])
+        for value in [0.05, 0.1, 0.5, 2]:
+            histogram.observe(value)
+        self.assertEqual(histogram.count, 4)
+        self.assertAlmostEqual(histogram.sum, 2.65)
+        self.assertEqual(histogram.cumulative(),
+                         [(0.1, 2), (1, 3), (float('inf'), 4)])
+
+    def test_stats(self):
+        stats = TimingStats()
+        timing = RequestTiming()
+        timing.add('handler', 0.2)
+        stats.observe(timing)
+        stats.observe(timing)
+        self.assertEqual(list(stats.histograms), ['handler'])
+        self.assertEqual(stats.histogram('handler').count, 2)
+
+
+class ApplicationTimingTests(unittest.TestCase):
+
+    def setUp(self):
+        def handler(env, data):
+            with env.timing.phase('db'):
+                pass
+            return Response(body='index')
+        self.app = web.cases(
+            web.prefix('/news', name='news') | web.match('/', 'index') | \
+                    handler,
+        )
+
+    def test_disabled(self):
+        response = TA(Application(self.app)).get('/news/')
+        self.assertEqual(response.body, b'index')
+        self.assertNotIn('Server-Timing', response.headers)
+
+    def test_enabled(self):
+        stats = TimingStats()
+        wsgi_app = Application(self.app, timing_stats=stats)
+        records = []
+        class Handler(logging.Handler):
+            def emit(self, record):
+                records.append(record)
+        logger = logging.getLogger('iktomi.web.app.timing')
+        handler = Handler()
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        self.addCleanup(logger.removeHandler, handler)
+
+        response = TA(wsgi_app).get('/news/')
+        header = response.headers['Server-Timing']
+        names = [x.split(';')[0] for x in header.split(', ')]
+        self.assertEqual(names,
+                         ['host', 'request', 'routing', 'db', 'handler'])
+        self.assertEqual(list(stats.histograms),
+                         ['host', 'request', 'routing', 'db', 'handler',
+                          'response', 'total'])
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0].location, 'news.index')
+        self.assertEqual(records[0].status, '200')
+
+        TA(wsgi_app).get('/missing', status=404)
+        self.assertEqual(stats.histogram('total').count, 2)
+        self.assertEqual(records[1].location, None)
+        self.assertEqual(records[1].status, '404')